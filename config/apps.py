@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class ProjectConfig(AppConfig):
+    name = 'config'
+
+    def ready(self):
+        import config.checks  # noqa: F401
@@ -2,6 +2,8 @@ import os
 
 from celery import Celery
 
+from config.metrics import connect_celery_signals
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 celery_app = Celery('config')
@@ -10,3 +12,5 @@ celery_app.config_from_object('django.conf:settings', namespace='CELERY')
 
 celery_app.autodiscover_tasks()
 
+connect_celery_signals()
+
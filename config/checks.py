@@ -0,0 +1,73 @@
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import Error, Tags, Warning, register
+from django.db import DatabaseError, connections
+
+
+@register(Tags.database, deploy=True)
+def check_database_connection(app_configs, databases=None, **kwargs):
+    errors = []
+    for alias in databases or []:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as e:
+            errors.append(Error(f'Нет соединения с базой данных {alias!r}: {e}', id='config.E001'))
+    return errors
+
+
+@register(Tags.database, deploy=True)
+def check_database_settings(app_configs, **kwargs):
+    errors = []
+    database = settings.DATABASES['default']
+    if database.get('OPTIONS', {}).get('pool') and database.get('CONN_MAX_AGE'):
+        errors.append(Error(
+            'Пул соединений нельзя совмещать с CONN_MAX_AGE',
+            hint='Оставьте CONN_MAX_AGE = 0 при включенном DB_POOL_ENABLED.',
+            id='config.E002',
+        ))
+    if not database.get('OPTIONS', {}).get('pool') and not database.get('CONN_MAX_AGE'):
+        errors.append(Warning(
+            'Соединение с базой данных открывается заново на каждый запрос',
+            hint='Задайте CONN_MAX_AGE или включите DB_POOL_ENABLED.',
+            id='config.W001',
+        ))
+    return errors
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    errors = []
+    if not settings.CACHE_ENABLED:
+        errors.append(Warning(
+            'Кеш локальный для каждого процесса',
+            hint='Ключи идемпотентности платежей, кеш ответов и троттлинг уведомлений должны быть общими '
+                 'для всех воркеров: включите CACHE_ENABLED.',
+            id='config.W002',
+        ))
+        return errors
+    try:
+        cache.set('config:self-check', 1, 5)
+    except Exception as e:
+        errors.append(Error(f'Кеш недоступен: {e}', id='config.E003'))
+    return errors
+
+
+@register(deploy=True)
+def check_metrics_access(app_configs, **kwargs):
+    if not settings.METRICS_TOKEN and not settings.METRICS_ALLOWED_IPS:
+        return [Warning(
+            'Эндпоинт /metrics отвечает 403 на все запросы',
+            hint='Задайте METRICS_TOKEN или METRICS_ALLOWED_IPS для сборщика метрик.',
+            id='config.W003',
+        )]
+    return []
+
+
+@register(deploy=True)
+def check_metrics_storage(app_configs, **kwargs):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory and not os.access(directory, os.W_OK):
+        return [Error(f'Каталог метрик {directory} недоступен для записи', id='config.E004')]
+    return []
@@ -0,0 +1,55 @@
+"""
+Конфигурация gunicorn, все параметры задаются переменными окружения.
+
+    gunicorn -c config/gunicorn.conf.py
+
+Приложение обслуживается через WSGI воркерами gthread. Под ASGI постоянные соединения
+Django не переиспользуются (каждый запрос открывает свое), поэтому CONN_MAX_AGE быстро
+исчерпывает max_connections Postgres.
+
+Асинхронный эндпоинт создания платежа под WSGI отвечает, но ничего не выигрывает: Django
+выполняет его в отдельном цикле событий на каждый запрос, поток воркера ждет Stripe так же,
+как в синхронном эндпоинте, а пул соединений httpx создается заново и не переиспользуется.
+В этом профиле клиентам нужен синхронный /api/payments/create-payment-intent/.
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = 'config.wsgi:application'
+worker_class = 'gthread'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Перезапуск воркеров ограничивает рост памяти; jitter не дает им перезапуститься одновременно
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def on_starting(server):
+    """Самопроверка Django перед запуском воркеров: при ошибках конфигурации gunicorn не стартует"""
+    import django
+    from django.core.management import call_command
+    from django.db import connections
+
+    from config.metrics import clear_multiprocess_dir
+
+    # Файлы метрик прошлого запуска удаляются до старта воркеров
+    clear_multiprocess_dir()
+    django.setup()
+    call_command('check', deploy=True, databases=['default'], fail_level='ERROR')
+    # Соединения мастера не должны достаться воркерам после fork
+    connections.close_all()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,180 @@
+import glob
+import hmac
+import ipaddress
+import os
+import time
+from contextlib import contextmanager
+
+from celery import signals
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Задержки внешних вызовов и задач больше, чем у HTTP-запросов, поэтому у них свои бакеты
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'Число HTTP-запросов', ['method', 'view', 'action', 'status'],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса', ['method', 'view', 'action'],
+    buckets=REQUEST_BUCKETS,
+)
+TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'Время выполнения задачи Celery', ['task', 'state'], buckets=TASK_BUCKETS,
+)
+TASK_QUEUE_LAG = Histogram(
+    'celery_task_queue_lag_seconds', 'Время от постановки задачи в очередь до начала выполнения', ['task'],
+    buckets=TASK_BUCKETS,
+)
+TASK_BATCH_SIZE = Histogram(
+    'celery_task_batch_size', 'Размер пачки, обработанной задачей', ['task'], buckets=BATCH_BUCKETS,
+)
+EXTERNAL_CALL_DURATION = Histogram(
+    'external_call_duration_seconds', 'Время вызова внешнего API', ['service', 'operation'],
+    buckets=REQUEST_BUCKETS,
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    'external_call_errors_total', 'Число ошибок вызовов внешнего API', ['service', 'operation', 'error'],
+)
+
+
+def clear_multiprocess_dir():
+    """
+    Удаляет файлы метрик, оставшиеся от прошлого запуска сервиса в PROMETHEUS_MULTIPROC_DIR.
+
+    Вызывается один раз в главном процессе до запуска дочерних (gunicorn, воркер Celery):
+    иначе /metrics продолжает суммировать счетчики давно завершенных процессов.
+    """
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.db')):
+        os.remove(path)
+
+
+class MultiDirectoryCollector:
+    """Объединяет файлы метрик своего каталога и каталогов других сервисов (METRICS_COLLECT_DIRS)"""
+
+    def __init__(self, directories):
+        self.directories = directories
+
+    def collect(self):
+        files = [path for directory in self.directories for path in glob.glob(os.path.join(directory, '*.db'))]
+        return multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+
+
+def get_registry():
+    """
+    Реестр для выдачи метрик.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR, метрики всех процессов сервиса пишутся в файлы
+    этого каталога и собираются при каждом запросе к /metrics вместе с файлами каталогов
+    из METRICS_COLLECT_DIRS (например, воркера Celery).
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        registry.register(MultiDirectoryCollector(
+            [os.environ['PROMETHEUS_MULTIPROC_DIR'], *settings.METRICS_COLLECT_DIRS],
+        ))
+        return registry
+    return REGISTRY
+
+
+def _metrics_allowed(request):
+    """
+    Доступ к /metrics: по токену (Authorization: Bearer <METRICS_TOKEN>) или с адресов
+    из METRICS_ALLOWED_IPS. Если не задано ни то, ни другое, эндпоинт открыт только при DEBUG.
+    """
+    token, networks = settings.METRICS_TOKEN, settings.METRICS_ALLOWED_IPS
+    if not token and not networks:
+        return settings.DEBUG
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in networks)
+
+
+def metrics_view(request):
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+@contextmanager
+def track_external_call(service, operation):
+    """Замеряет время вызова внешнего API и считает ошибки по типу исключения"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        EXTERNAL_CALL_ERRORS.labels(service, operation, type(e).__name__).inc()
+        raise
+    finally:
+        EXTERNAL_CALL_DURATION.labels(service, operation).observe(time.perf_counter() - started)
+
+
+def _view_labels(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved', ''
+    actions = getattr(match.func, 'actions', None) or {}
+    return match.view_name or match.route, actions.get(request.method.lower(), '')
+
+
+class MetricsMiddleware:
+    """Считает HTTP-запросы и их длительность по имени маршрута и действию ViewSet"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        view, action = _view_labels(request)
+        HTTP_REQUEST_DURATION.labels(request.method, view, action).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(request.method, view, action, response.status_code).inc()
+        return response
+
+
+def _task_publish(sender=None, headers=None, **kwargs):
+    headers['published_at'] = time.time()
+
+
+def _task_prerun(task=None, **kwargs):
+    task.request._metrics_started = time.perf_counter()
+    published_at = task.request.get('published_at')
+    if published_at is not None:
+        TASK_QUEUE_LAG.labels(task.name).observe(max(time.time() - published_at, 0))
+
+
+def _task_postrun(task=None, state=None, **kwargs):
+    started = getattr(task.request, '_metrics_started', None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+def _worker_init(**kwargs):
+    clear_multiprocess_dir()
+
+
+def _worker_process_shutdown(pid=None, **kwargs):
+    # Дочерние процессы пула перезапускаются (max_tasks_per_child, autoscale), и без этого
+    # их live-gauge оставались бы в выдаче /metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def connect_celery_signals():
+    signals.before_task_publish.connect(_task_publish, weak=False)
+    signals.task_prerun.connect(_task_prerun, weak=False)
+    signals.task_postrun.connect(_task_postrun, weak=False)
+    signals.worker_init.connect(_worker_init, weak=False)
+    signals.worker_process_shutdown.connect(_worker_process_shutdown, weak=False)
@@ -0,0 +1,139 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.generics import GenericAPIView
+from rest_framework.serializers import BaseSerializer, ListSerializer
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+_current_profile = ContextVar('request_profile', default=None)
+_instrumented = False
+
+
+class RequestProfile:
+    """Замеры одного запроса: SQL-запросы и время по разделам (права, пагинация, сериализаторы)"""
+
+    def __init__(self):
+        self.queries = []
+        self.sections = defaultdict(float)
+
+    @property
+    def db_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    def duplicated_queries(self, limit):
+        """Самые частые повторяющиеся запросы: (sql, количество, суммарное время)"""
+        counts = Counter(sql for sql, _ in self.queries)
+        durations = defaultdict(float)
+        for sql, duration in self.queries:
+            durations[sql] += duration
+        return [(sql, count, durations[sql]) for sql, count in counts.most_common(limit) if count > 1]
+
+
+@contextmanager
+def profile_section(name):
+    """Добавляет время выполнения блока к разделу name текущего запроса, если профилирование включено"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] += time.perf_counter() - started
+
+
+def _profiled(method, name):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with profile_section(name):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def _profiled_serializer_data(fget):
+    @wraps(fget)
+    def wrapper(serializer):
+        target = serializer.child if isinstance(serializer, ListSerializer) else serializer
+        with profile_section(f'serializer.{type(target).__name__}'):
+            return fget(serializer)
+    return wrapper
+
+
+def install_instrumentation():
+    """Оборачивает проверку прав, пагинацию и сериализацию DRF замерами времени (один раз на процесс)"""
+    global _instrumented
+    if _instrumented:
+        return
+    APIView.check_permissions = _profiled(APIView.check_permissions, 'permissions')
+    APIView.check_object_permissions = _profiled(APIView.check_object_permissions, 'permissions')
+    GenericAPIView.paginate_queryset = _profiled(GenericAPIView.paginate_queryset, 'pagination')
+    GenericAPIView.get_paginated_response = _profiled(GenericAPIView.get_paginated_response, 'pagination')
+    BaseSerializer.data = property(_profiled_serializer_data(BaseSerializer.data.fget))
+    _instrumented = True
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запросов для staging-окружения (PROFILING_ENABLED).
+
+    Считает число и время SQL-запросов, время проверки прав, пагинации и сериализаторов,
+    отдает их в заголовке Server-Timing и пишет в лог медленные запросы
+    (дольше PROFILING_SLOW_REQUEST_MS) вместе с самыми частыми повторяющимися SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_instrumentation()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_query))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = self.server_timing(profile, total)
+        if total * 1000 >= settings.PROFILING_SLOW_REQUEST_MS:
+            self.log_slow_request(request, profile, total)
+        return response
+
+    @staticmethod
+    def server_timing(profile, total):
+        metrics = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={profile.db_time * 1000:.1f};desc="{len(profile.queries)} queries"',
+        ]
+        metrics.extend(f'{name};dur={duration * 1000:.1f}' for name, duration in profile.sections.items())
+        return ', '.join(metrics)
+
+    @staticmethod
+    def log_slow_request(request, profile, total):
+        duplicates = profile.duplicated_queries(settings.PROFILING_TOP_DUPLICATES)
+        lines = [f'  {count}x, {duration * 1000:.1f} ms: {sql}' for sql, count, duration in duplicates]
+        logger.warning(
+            'Медленный запрос %s %s: %.1f ms, SQL: %s запросов за %.1f ms%s',
+            request.method, request.get_full_path(), total * 1000, len(profile.queries), profile.db_time * 1000,
+            '\nПовторяющиеся запросы:\n' + '\n'.join(lines) if lines else '',
+        )
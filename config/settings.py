@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'django_filters',
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -167,12 +169,42 @@ SPECTACULAR_SETTINGS = {
 
 STRIPE_SECRET_KEY = env('STRIPE_SECRET_KEY', default='')
 STRIPE_PUBLISHABLE_KEY = env('STRIPE_PUBLISHABLE_KEY', default='')
+STRIPE_API_BASE = env('STRIPE_API_BASE', default='')
+STRIPE_TIMEOUT = env.float('STRIPE_TIMEOUT', default=10)
+STRIPE_CONNECT_TIMEOUT = env.float('STRIPE_CONNECT_TIMEOUT', default=3)
+STRIPE_MAX_NETWORK_RETRIES = env.int('STRIPE_MAX_NETWORK_RETRIES', default=2)
+STRIPE_WEBHOOK_SECRET = env('STRIPE_WEBHOOK_SECRET', default='')
+# Сессии Stripe живут не дольше 24 часов, поэтому сверять статусы старых платежей не нужно.
+STRIPE_RECONCILE_WINDOW = env.int('STRIPE_RECONCILE_WINDOW', default=25 * 60 * 60)
+STRIPE_RECONCILE_BATCH_SIZE = env.int('STRIPE_RECONCILE_BATCH_SIZE', default=500)
+STRIPE_SESSION_REUSE_WINDOW = env.int('STRIPE_SESSION_REUSE_WINDOW', default=23 * 60 * 60)
+PAYMENT_IDEMPOTENCY_TTL = env.int('PAYMENT_IDEMPOTENCY_TTL', default=24 * 60 * 60)
 FRONTEND_URL = env('FRONTEND_URL', default='http://localhost:8000')
 
 REDIS_HOST = env('REDIS_HOST', default='localhost')
 REDIS_PORT = env('REDIS_PORT', default='6379')
 REDIS_DB = env('REDIS_DB', default='0')
 
+CACHE_ENABLED = env.bool('CACHE_ENABLED', default=False)
+
+if CACHE_ENABLED:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': env('CACHE_LOCATION', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/1'),
+        }
+    }
+
+# Профилирование запросов (заголовок Server-Timing и лог медленных запросов), для staging
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=False)
+PROFILING_SLOW_REQUEST_MS = env.int('PROFILING_SLOW_REQUEST_MS', default=500)
+PROFILING_TOP_DUPLICATES = env.int('PROFILING_TOP_DUPLICATES', default=5)
+
+if PROFILING_ENABLED:
+    MIDDLEWARE.insert(0, 'config.profiling.ProfilingMiddleware')
+
+MATERIALS_RESPONSE_CACHE_TIMEOUT = env.int('MATERIALS_RESPONSE_CACHE_TIMEOUT', default=5 * 60)
+
 CELERY_BROKER_URL = env('CELERY_BROKER_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}')
 CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND', default=CELERY_BROKER_URL)
 CELERY_TIMEZONE = TIME_ZONE
@@ -185,7 +217,41 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'materials.tasks.deactivate_inactive_users',
         'schedule': timedelta(days=1),
     },
+    'reconcile-stripe-payments-each-minute': {
+        'task': 'users.tasks.reconcile_stripe_payments',
+        'schedule': timedelta(minutes=1),
+    },
+    'update-payment-rollups-every-5-minutes': {
+        'task': 'users.tasks.update_payment_rollups',
+        'schedule': timedelta(minutes=5),
+    },
+    'repair-course-stats-each-day': {
+        'task': 'materials.tasks.repair_course_stats',
+        'schedule': timedelta(days=1),
+    },
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='no-reply@example.com')
+
+COURSE_NOTIFICATION_CHUNK_SIZE = env.int('COURSE_NOTIFICATION_CHUNK_SIZE', default=500)
+# Не чаще одного уведомления об обновлении курса за интервал; задача откладывается на DELAY секунд.
+COURSE_NOTIFICATION_INTERVAL = env.int('COURSE_NOTIFICATION_INTERVAL', default=4 * 60 * 60)
+COURSE_NOTIFICATION_DELAY = env.int('COURSE_NOTIFICATION_DELAY', default=10 * 60)
+LESSONS_BULK_MAX_ITEMS = env.int('LESSONS_BULK_MAX_ITEMS', default=1000)
+SUBSCRIPTIONS_BATCH_MAX_ITEMS = env.int('SUBSCRIPTIONS_BATCH_MAX_ITEMS', default=500)
+SEARCH_MAX_RESULTS = env.int('SEARCH_MAX_RESULTS', default=20)
+SEARCH_RANK_CANDIDATES = env.int('SEARCH_RANK_CANDIDATES', default=1000)
+DEACTIVATE_USERS_BATCH_SIZE = env.int('DEACTIVATE_USERS_BATCH_SIZE', default=1000)
+COURSE_STATS_REBUILD_BATCH_SIZE = env.int('COURSE_STATS_REBUILD_BATCH_SIZE', default=1000)
+# Сколько последних дней суточных итогов платежей пересчитывать при каждом обновлении
+PAYMENT_ROLLUP_WINDOW_DAYS = env.int('PAYMENT_ROLLUP_WINDOW_DAYS', default=2)
+PAYMENT_ROLLUP_BATCH_SIZE = env.int('PAYMENT_ROLLUP_BATCH_SIZE', default=5000)
+PAYMENT_EXPORT_CHUNK_SIZE = env.int('PAYMENT_EXPORT_CHUNK_SIZE', default=2000)
+# Доступ к /metrics: токен (Authorization: Bearer ...) и/или адреса и подсети сборщика метрик
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=[])
+# Каталоги метрик других сервисов (воркера Celery), которые /metrics отдает вместе со своими
+METRICS_COLLECT_DIRS = env.list('METRICS_COLLECT_DIRS', default=[])
+# Проверять ли в benchmark_api бюджет по времени ответа (имеет смысл только на стабильной машине)
+BENCHMARK_CHECK_LATENCY = env.bool('BENCHMARK_CHECK_LATENCY', default=False)
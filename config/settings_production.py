@@ -0,0 +1,47 @@
+"""
+Настройки для production: DJANGO_SETTINGS_MODULE=config.settings_production.
+
+Наследуют config.settings и переопределяют то, что в разработке удобно, а под нагрузкой вредно:
+DEBUG выключен (иначе каждый SQL-запрос копится в памяти процесса), соединения с БД
+переиспользуются между запросами или берутся из пула psycopg 3.
+"""
+
+from config.settings import *  # noqa: F401,F403
+from config.settings import DATABASES, INSTALLED_APPS, env
+
+# Проверки production-конфигурации для manage.py check --deploy (config/checks.py)
+INSTALLED_APPS = [*INSTALLED_APPS, 'config.apps.ProjectConfig']
+
+DEBUG = env.bool('DEBUG', default=False)
+SECRET_KEY = env('SECRET_KEY')
+ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=['localhost', '127.0.0.1'])
+
+# Пул соединений psycopg 3 (Django 5.1+). С пулом постоянные соединения Django
+# не используются: соединение возвращается в пул в конце каждого запроса.
+DB_POOL_ENABLED = env.bool('DB_POOL_ENABLED', default=False)
+
+if DB_POOL_ENABLED:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+            'max_size': env.int('DB_POOL_MAX_SIZE', default=10),
+            'timeout': env.int('DB_POOL_TIMEOUT', default=10),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = env.int('CONN_MAX_AGE', default=60)
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Без DEBUG Django не выводит ошибки запросов в консоль, поэтому логируем их явно
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': env('LOG_LEVEL', default='INFO'),
+    },
+}
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class MaterialsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'materials' 
+    name = 'materials'
+
+    def ready(self):
+        import materials.signals  # noqa: F401
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from users.roles import is_moderator
+
+RESPONSES_VERSION_KEY = 'materials:responses:version'
+RESPONSE_KEY = 'materials:response:{version}:{audience}:{url_hash}'
+
+
+def get_responses_version():
+    version = cache.get(RESPONSES_VERSION_KEY)
+    if version is None:
+        # Начальное значение растет со временем: если ключ версии был вытеснен,
+        # новая версия не совпадет ни с одной из уже закешированных.
+        cache.add(RESPONSES_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(RESPONSES_VERSION_KEY)
+    return version
+
+
+def invalidate_responses():
+    """Делает недействительными все закешированные ответы курсов и уроков."""
+    try:
+        cache.incr(RESPONSES_VERSION_KEY)
+    except ValueError:
+        get_responses_version()
+
+
+def make_etag(data):
+    payload = json.dumps(data, sort_keys=True, default=str).encode()
+    return quote_etag(hashlib.md5(payload).hexdigest())
+
+
+class CachedResponseMixin:
+    """
+    Кеширует ответы list/retrieve и поддерживает ETag/If-None-Match.
+
+    Ключ включает версию данных, аудиторию запроса (модератор или конкретный
+    пользователь) и полный URL с параметрами пагинации. При совпадении
+    If-None-Match с ETag закешированного ответа возвращается 304 без
+    обращения к queryset и сериализатору.
+    """
+    response_cache_timeout = settings.MATERIALS_RESPONSE_CACHE_TIMEOUT
+    # Ответ зависит от пользователя даже для модераторов (например, is_subscribed).
+    response_cache_per_user = False
+
+    def get_response_cache_key(self, request):
+        if is_moderator(request) and not self.response_cache_per_user:
+            audience = 'moderator'
+        else:
+            audience = f'user:{request.user.pk}'
+        url_hash = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        return RESPONSE_KEY.format(version=get_responses_version(), audience=audience, url_hash=url_hash)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            etag = make_etag(response.data)
+            cache.set(key, (etag, response.data), self.response_cache_timeout)
+        else:
+            etag, data = cached
+            response = None
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        if response is None:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
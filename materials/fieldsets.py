@@ -0,0 +1,70 @@
+from rest_framework import serializers
+
+
+def parse_field_names(value):
+    """'id, name,,lessons' -> {'id', 'name', 'lessons'}"""
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Оставляет в ответе только поля из context['fields'] (None — все) и убирает поля из context['omit'].
+
+    Действует только на корневой сериализатор или элементы корневого списка: вложенные
+    сериализаторы (например, lessons в CourseSerializer) отдают все свои поля.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+        only, omit = self.context.get('fields'), self.context.get('omit') or set()
+        return {
+            name: field for name, field in fields.items()
+            if (only is None or name in only) and name not in omit
+        }
+
+
+class SparseFieldsetMixin:
+    """
+    Поддержка ?fields=id,name и ?omit=lessons в GET-запросах.
+
+    Выбранные поля передаются в контекст сериализатора (SparseFieldsetSerializerMixin),
+    а get_queryset через wants_field() и get_deferred_fields() может не загружать то,
+    что не попадет в ответ. Неизвестные имена полей игнорируются, как и в ?expand=
+    у платежей. На запись параметры не действуют: урезанный сериализатор потерял бы
+    записываемые поля.
+    """
+    # Поля, которые загружаются всегда: по ним проверяются права (IsOwnerOrModerator)
+    always_loaded_fields = ['owner']
+
+    def get_sparse_fieldset(self):
+        if self.request is None or self.request.method != 'GET':
+            return None, set()
+        # Пустой ?fields= означает все поля, а не ни одного
+        fields = parse_field_names(self.request.query_params.get('fields', '')) or None
+        return fields, parse_field_names(self.request.query_params.get('omit', ''))
+
+    def wants_field(self, name):
+        fields, omit = self.get_sparse_fieldset()
+        return (fields is None or name in fields) and name not in omit
+
+    def get_deferred_fields(self, model):
+        """
+        Поля модели, не попадающие в ответ, для queryset.defer(): невыбранные и те,
+        которых нет среди полей сериализатора (например, search_vector).
+        """
+        serialized = self.get_serializer_class()().fields
+        return [
+            field.name for field in model._meta.concrete_fields
+            if not field.primary_key and field.name not in self.always_loaded_fields
+            and not (field.name in serialized and self.wants_field(field.name))
+        ]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'], context['omit'] = self.get_sparse_fieldset()
+        return context
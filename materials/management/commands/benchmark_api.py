@@ -0,0 +1,367 @@
+import contextlib
+import itertools
+import json
+import statistics
+import time
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLResolver, resolve
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from materials.models import Course, Lesson, Subscription
+from users.analytics import rebuild_payment_rollups
+from users.fake_stripe import FakeStripeServer, sign_webhook_payload
+from users.models import Payment, User
+from users.roles import MODERATORS_GROUP
+from users.seeding import seed_data
+from users.services import get_stripe_client
+
+BUDGET_HEADROOM = 1.5
+# Время ответа зависит от машины, поэтому по умолчанию оно только выводится в отчете,
+# а ошибкой завершают превышения числа запросов и размера ответа
+LATENCY_METRICS = {'p95_ms'}
+# Модули маршрутов, каждый эндпоинт которых должен быть в списке замеров
+API_URLCONFS = ['materials.urls', 'users.urls']
+BENCHMARK_WEBHOOK_SECRET = 'whsec_benchmark'
+
+
+def iter_url_patterns(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from iter_url_patterns(pattern.url_patterns)
+        else:
+            yield pattern
+
+
+def pattern_methods(callback):
+    """HTTP-методы, которые обрабатывает представление маршрута; None — метод не определить"""
+    if getattr(callback, 'actions', None):
+        methods = set(callback.actions)
+    elif getattr(callback, 'view_class', None):
+        methods = {method for method in callback.view_class.http_method_names if hasattr(callback.view_class, method)}
+    else:
+        return {None}
+    return methods - {'head', 'options'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет все эндпоинты API на сгенерированном наборе данных, измеряет число SQL-запросов, '
+        'p50/p95 времени ответа и размер ответа и сравнивает их с бюджетом'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', default=str(settings.BASE_DIR / 'api_budget.json'),
+                            help='JSON-файл с бюджетом по эндпоинтам')
+        parser.add_argument('--update-budget', action='store_true',
+                            help='Записать текущие замеры (с запасом) в файл бюджета вместо проверки')
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--courses', type=int, default=500)
+        parser.add_argument('--lessons-per-course', type=int, default=10)
+        parser.add_argument('--subscriptions-per-user', type=int, default=5)
+        parser.add_argument('--payments-per-user', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Не сбрасывать кеш перед каждым запросом')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-analyze', dest='analyze', action='store_false',
+                            help='Не обновлять статистику планировщика после генерации данных')
+        parser.add_argument('--check-latency', action='store_true', default=settings.BENCHMARK_CHECK_LATENCY,
+                            help='Считать превышение бюджета по времени ответа ошибкой, а не предупреждением')
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), self.fake_stripe():
+            fixtures = self.seed(options)
+            endpoints = self.get_endpoints(fixtures)
+            self.check_coverage(endpoints)
+            results = self.run_endpoints(endpoints, fixtures, options['repeat'], options['warm_cache'])
+            transaction.set_rollback(True)
+
+        self.print_results(results)
+        if options['update_budget']:
+            self.write_budget(options['budget'], results)
+        else:
+            self.check_budget(options['budget'], results, options['check_latency'])
+
+    @contextlib.contextmanager
+    def fake_stripe(self):
+        """Эндпоинты оплаты обращаются к локальной имитации Stripe API, а не к сети"""
+        with FakeStripeServer() as server, override_settings(
+            STRIPE_SECRET_KEY='sk_test_benchmark',
+            STRIPE_API_BASE=server.url,
+            STRIPE_MAX_NETWORK_RETRIES=0,
+            STRIPE_WEBHOOK_SECRET=BENCHMARK_WEBHOOK_SECRET,
+        ):
+            get_stripe_client.cache_clear()
+            try:
+                yield server
+            finally:
+                get_stripe_client.cache_clear()
+
+    def seed(self, options):
+        seed_data(
+            users=options['users'],
+            courses=options['courses'],
+            lessons_per_course=options['lessons_per_course'],
+            subscriptions_per_user=options['subscriptions_per_user'],
+            payments_per_user=options['payments_per_user'],
+            seed=options['seed'],
+            prefix='benchmark',
+        )
+        seeded_users = User.objects.filter(email__startswith=f'benchmark{options["seed"]}-')
+        course = Course.objects.filter(owner__in=seeded_users).order_by('id').first()
+        owner = course.owner
+        moderator = seeded_users.exclude(pk=owner.pk).order_by('id').first()
+        moderator.groups.add(Group.objects.get_or_create(name=MODERATORS_GROUP)[0])
+        buyer = seeded_users.exclude(pk__in=[owner.pk, moderator.pk]).order_by('id').first()
+        admin = User.objects.create(email=f'benchmark{options["seed"]}-admin@example.com', is_staff=True)
+        payment = Payment.objects.create(user=owner, paid_course=course, amount=course.price,
+                                         payment_method='stripe', stripe_session_id='cs_benchmark',
+                                         payment_status='unpaid')
+        rebuild_payment_rollups()
+
+        # Без свежей статистики планировщик считает таблицы пустыми и выбирает не те планы
+        # ANALYZE меняет оценки числа строк в pg_class вне транзакции, и после отката
+        # они остаются устаревшими; в тестах это сбивает планы других проверок
+        if options['analyze'] and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in (User, Course, Lesson, Subscription, Payment):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+        return {
+            'owner': owner,
+            'moderator': moderator,
+            'admin': admin,
+            'buyer': buyer,
+            'anonymous': None,
+            'course': course,
+            'lesson': course.lessons.order_by('id').first(),
+            'payment': payment,
+        }
+
+    def get_endpoints(self, fixtures):
+        """
+        Эндпоинты для замера: (имя, роль, метод, url, данные[, подготовка[, параметры запроса]]).
+
+        url может быть функцией, которая создает объект для удаления и возвращает его адрес;
+        подготовка выполняется перед каждым повтором вне замера.
+        """
+        course, lesson, payment = fixtures['course'], fixtures['lesson'], fixtures['payment']
+        owner, buyer = fixtures['owner'], fixtures['buyer']
+
+        def unsubscribed():
+            Subscription.objects.filter(user=owner, course=course).delete()
+
+        def subscribed():
+            Subscription.objects.get_or_create(user=owner, course=course)
+
+        def no_open_payments():
+            Payment.objects.filter(user=buyer, payment_method='stripe', payment_status='unpaid').delete()
+
+        def not_registered():
+            User.objects.filter(email='benchmark-signup@example.com').delete()
+
+        def course_to_delete():
+            new_course = Course.objects.create(name='Course to delete', owner=owner, price=course.price)
+            Lesson.objects.bulk_create(
+                Lesson(name=f'Lesson to delete {i}', course=new_course, owner=owner) for i in range(10)
+            )
+            return f'/api/courses/{new_course.id}/'
+
+        def lesson_to_delete():
+            new_lesson = Lesson.objects.create(name='Lesson to delete', course=course, owner=owner)
+            return f'/api/lessons/{new_lesson.id}/'
+
+        def payment_to_delete():
+            new_payment = Payment.objects.create(user=owner, paid_course=course, amount=course.price,
+                                                 payment_method='cash')
+            return f'/api/payments/{new_payment.id}/'
+
+        deleted_users = itertools.count()
+
+        def user_to_delete():
+            new_user = User.objects.create(email=f'benchmark-delete-{next(deleted_users)}@example.com')
+            return f'/api/users/{new_user.id}/'
+
+        webhook_payload = json.dumps({
+            'id': 'evt_benchmark',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': {'id': payment.stripe_session_id, 'payment_status': 'paid'}},
+        })
+        webhook_request = {'content_type': 'application/json'}
+
+        def webhook_signed():
+            Payment.objects.filter(pk=payment.pk).update(payment_status='unpaid')
+            webhook_request['HTTP_STRIPE_SIGNATURE'] = sign_webhook_payload(webhook_payload, BENCHMARK_WEBHOOK_SECRET)
+
+        payment_data = {'user': owner.id, 'amount': str(course.price), 'payment_method': 'stripe',
+                        'stripe_session_id': payment.stripe_session_id, 'payment_status': 'unpaid'}
+
+        return [
+            ('GET /api/courses/', 'owner', 'get', '/api/courses/', None),
+            ('GET /api/courses/ (moderator)', 'moderator', 'get', '/api/courses/', None),
+            ('GET /api/courses/?fields=', 'moderator', 'get', '/api/courses/?fields=id,name', None),
+            ('POST /api/courses/', 'owner', 'post', '/api/courses/', {'name': 'New course'}),
+            ('GET /api/courses/{id}/', 'owner', 'get', f'/api/courses/{course.id}/', None),
+            ('PUT /api/courses/{id}/', 'owner', 'put', f'/api/courses/{course.id}/',
+             {'name': 'Renamed', 'description': 'Описание', 'price': str(course.price)}),
+            ('PATCH /api/courses/{id}/', 'owner', 'patch', f'/api/courses/{course.id}/', {'name': 'Renamed'}),
+            ('DELETE /api/courses/{id}/', 'owner', 'delete', course_to_delete, None),
+            ('POST /api/courses/{id}/subscribe/', 'owner', 'post', f'/api/courses/{course.id}/subscribe/', None, unsubscribed),
+            ('DELETE /api/courses/{id}/unsubscribe/', 'owner', 'delete', f'/api/courses/{course.id}/unsubscribe/', None,
+             subscribed),
+            ('GET /api/subscriptions/', 'owner', 'get', '/api/subscriptions/', None),
+            ('POST /api/subscriptions/batch/', 'owner', 'post', '/api/subscriptions/batch/',
+             {'subscribe': [course.id], 'unsubscribe': []}, unsubscribed),
+            ('GET /api/lessons/', 'owner', 'get', '/api/lessons/', None),
+            ('GET /api/lessons/ (moderator)', 'moderator', 'get', '/api/lessons/', None),
+            ('GET /api/lessons/?fields=', 'moderator', 'get', '/api/lessons/?fields=id,name,course', None),
+            ('GET /api/lessons/ (cursor)', 'moderator', 'get', '/api/lessons/?pagination=cursor', None),
+            ('POST /api/lessons/', 'owner', 'post', '/api/lessons/', {'name': 'New lesson', 'course': course.id}),
+            ('POST /api/lessons/bulk/', 'owner', 'post', '/api/lessons/bulk/', {
+                'create': [{'name': f'Bulk lesson {i}', 'course': course.id} for i in range(50)],
+                'update': [{'id': lesson.id, 'name': 'Renamed in bulk'}],
+            }),
+            ('GET /api/lessons/{id}/', 'owner', 'get', f'/api/lessons/{lesson.id}/', None),
+            ('PUT /api/lessons/{id}/', 'owner', 'put', f'/api/lessons/{lesson.id}/',
+             {'name': 'Renamed', 'course': course.id}),
+            ('PATCH /api/lessons/{id}/', 'owner', 'patch', f'/api/lessons/{lesson.id}/', {'name': 'Renamed'}),
+            ('DELETE /api/lessons/{id}/', 'owner', 'delete', lesson_to_delete, None),
+            ('GET /api/search/', 'owner', 'get', '/api/search/?q=курс', None),
+            ('GET /api/search/ (moderator)', 'moderator', 'get', f'/api/search/?q=урок курса {course.id}', None),
+            ('GET /api/payments/', 'owner', 'get', '/api/payments/', None),
+            ('GET /api/payments/?expand=', 'owner', 'get', '/api/payments/?expand=paid_course,paid_lesson', None),
+            ('POST /api/payments/', 'owner', 'post', '/api/payments/',
+             {'user': buyer.id, 'amount': str(course.price), 'payment_method': 'cash'}),
+            ('GET /api/payments/{id}/', 'owner', 'get', f'/api/payments/{payment.id}/', None),
+            ('PUT /api/payments/{id}/', 'owner', 'put', f'/api/payments/{payment.id}/', payment_data),
+            ('PATCH /api/payments/{id}/', 'owner', 'patch', f'/api/payments/{payment.id}/', {'payment_status': 'unpaid'}),
+            ('DELETE /api/payments/{id}/', 'owner', 'delete', payment_to_delete, None),
+            ('GET /api/payments/{id}/check-status/', 'owner', 'get', f'/api/payments/{payment.id}/check-status/', None),
+            ('GET /api/payments/export/', 'admin', 'get', '/api/payments/export/', None),
+            ('GET /api/payments/export/?output=ndjson', 'admin', 'get', '/api/payments/export/?output=ndjson', None),
+            ('POST /api/payments/create-payment-intent/', 'buyer', 'post', '/api/payments/create-payment-intent/',
+             {'course_id': course.id}, no_open_payments),
+            # Асинхронное представление не использует аутентификацию DRF и проверяет JWT само
+            ('POST /api/payments/create-payment-intent-async/', 'buyer', 'post',
+             '/api/payments/create-payment-intent-async/', {'course_id': course.id}, no_open_payments,
+             {'format': 'json', 'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(buyer).access_token}'}),
+            ('POST /api/payments/webhook/', 'anonymous', 'post', '/api/payments/webhook/', webhook_payload,
+             webhook_signed, webhook_request),
+            ('GET /api/payments/analytics/', 'admin', 'get', '/api/payments/analytics/?period=month&group_by=method,status',
+             None),
+            ('GET /api/users/', 'owner', 'get', '/api/users/', None),
+            ('POST /api/users/', 'anonymous', 'post', '/api/users/',
+             {'email': 'benchmark-signup@example.com', 'password': 'benchmark-password'}, not_registered),
+            ('GET /api/users/me/', 'owner', 'get', '/api/users/me/', None),
+            ('GET /api/users/{id}/', 'owner', 'get', f'/api/users/{owner.id}/', None),
+            ('PUT /api/users/{id}/', 'owner', 'put', f'/api/users/{owner.id}/', {'email': owner.email, 'city': 'Moscow'}),
+            ('PATCH /api/users/{id}/', 'owner', 'patch', f'/api/users/{owner.id}/', {'city': 'Moscow'}),
+            ('DELETE /api/users/{id}/', 'owner', 'delete', user_to_delete, None),
+        ]
+
+    def check_coverage(self, endpoints):
+        """Завершает команду ошибкой, если для маршрута API и его метода нет замера"""
+        covered = set()
+        # Объекты, которые создают url-функции, не должны остаться в данных для замеров
+        with transaction.atomic():
+            for name, role, method, url, *_ in endpoints:
+                url_name = resolve(urlsplit(url() if callable(url) else url).path).url_name
+                covered.update({(url_name, method), (url_name, None)})
+            transaction.set_rollback(True)
+
+        missing = []
+        for urlconf in API_URLCONFS:
+            for pattern in iter_url_patterns(import_module(urlconf).urlpatterns):
+                if pattern.name == 'api-root':
+                    continue
+                for method in sorted(pattern_methods(pattern.callback), key=str):
+                    if (pattern.name, method) not in covered:
+                        missing.append(f'{(method or "*").upper()} {pattern.name}')
+        if missing:
+            raise CommandError('Нет замеров для эндпоинтов:\n' + '\n'.join(sorted(set(missing))))
+
+    def run_endpoints(self, endpoints, fixtures, repeat, warm_cache):
+        results = {}
+        for name, role, method, url, data, *extra in endpoints:
+            prepare, request_options = (extra + [None, None])[:2]
+            client = APIClient(HTTP_HOST='localhost')
+            client.force_authenticate(user=fixtures[role])
+            timings, queries, size = [], 0, 0
+            for _ in range(repeat):
+                if prepare:
+                    prepare()
+                request_url = url() if callable(url) else url
+                if not warm_cache:
+                    cache.clear()
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(request_url, data, **(request_options or {'format': 'json'}))
+                    content = b''.join(response.streaming_content) if response.streaming else response.content
+                    timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    raise CommandError(f'{name}: ответ {response.status_code} {content[:200]!r}')
+                queries = max(queries, len(context.captured_queries))
+                size = max(size, len(content))
+            results[name] = {
+                'queries': queries,
+                'p50_ms': statistics.median(timings),
+                'p95_ms': statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0],
+                'bytes': size,
+            }
+        return results
+
+    def print_results(self, results):
+        self.stdout.write(f'{"endpoint":<48} {"queries":>7} {"p50, ms":>9} {"p95, ms":>9} {"bytes":>9}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<48} {result["queries"]:>7} {result["p50_ms"]:>9.2f} '
+                f'{result["p95_ms"]:>9.2f} {result["bytes"]:>9}'
+            )
+
+    def write_budget(self, path, results):
+        budget = {
+            name: {
+                'queries': result['queries'],
+                'p95_ms': round(result['p95_ms'] * BUDGET_HEADROOM + 10),
+                'bytes': int(result['bytes'] * BUDGET_HEADROOM),
+            }
+            for name, result in results.items()
+        }
+        with open(path, 'w') as f:
+            json.dump(budget, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f'Бюджет записан в {path}'))
+
+    def check_budget(self, path, results, check_latency=False):
+        with open(path) as f:
+            budget = json.load(f)
+
+        violations, warnings = [], []
+        for name, result in results.items():
+            limits = budget.get(name)
+            if limits is None:
+                violations.append(f'{name}: нет бюджета')
+                continue
+            for metric, limit in limits.items():
+                if result[metric] > limit:
+                    message = f'{name}: {metric} = {result[metric]:.0f} > {limit}'
+                    if metric in LATENCY_METRICS and not check_latency:
+                        warnings.append(message)
+                    else:
+                        violations.append(message)
+
+        for message in warnings:
+            self.stdout.write(self.style.WARNING(f'Время ответа выше бюджета: {message}'))
+        if violations:
+            raise CommandError('Превышен бюджет:\n' + '\n'.join(violations))
+        self.stdout.write(self.style.SUCCESS('Все эндпоинты укладываются в бюджет'))
@@ -0,0 +1,69 @@
+import statistics
+import time
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.pagination import Cursor
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from materials.models import Course, Lesson
+from materials.paginators import CourseLessonPagination
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает постраничную и курсорную пагинацию уроков на глубоких страницах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lessons', type=int, default=200_000,
+                            help='Сколько уроков должно быть в таблице (недостающие создаются и удаляются после замера)')
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 100, 1000, 10_000],
+                            help='Номера страниц для замера')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['lessons'])
+            self.stdout.write(f'{"page":>8} {"page-number, ms":>16} {"cursor, ms":>12}')
+            for page in options['pages']:
+                page_number = self.measure_page_number(page, options['page_size'], options['repeat'])
+                cursor = self.measure_cursor(page, options['page_size'], options['repeat'])
+                self.stdout.write(f'{page:>8} {page_number:>16.2f} {cursor:>12.2f}')
+            transaction.set_rollback(True)
+
+    def seed(self, lessons_count):
+        missing = lessons_count - Lesson.objects.count()
+        if missing <= 0:
+            return
+        self.stdout.write(f'Временно создается уроков: {missing}')
+        course = Course.objects.create(name='Benchmark course')
+        batch_size = 5000
+        for start in range(0, missing, batch_size):
+            Lesson.objects.bulk_create(
+                Lesson(name=f'Benchmark lesson {i}', course=course)
+                for i in range(start, min(start + batch_size, missing))
+            )
+
+    def paginate(self, params):
+        request = Request(APIRequestFactory().get('/api/lessons/', params, HTTP_HOST='localhost'))
+        paginator = CourseLessonPagination()
+        started = time.perf_counter()
+        list(paginator.paginate_queryset(Lesson.objects.all(), request))
+        return (time.perf_counter() - started) * 1000
+
+    def measure_page_number(self, page, page_size, repeat):
+        params = {'page': page, 'page_size': page_size}
+        return statistics.median(self.paginate(params) for _ in range(repeat))
+
+    def measure_cursor(self, page, page_size, repeat):
+        offset = (page - 1) * page_size
+        params = {'pagination': 'cursor', 'page_size': page_size}
+        if offset:
+            position = Lesson.objects.order_by('id').values_list('id', flat=True)[offset - 1]
+            pagination = CourseLessonPagination.cursor_pagination_class()
+            pagination.base_url = 'http://localhost/api/lessons/'
+            url = pagination.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+            params['cursor'] = parse_qs(urlparse(url).query)['cursor'][0]
+        return statistics.median(self.paginate(params) for _ in range(repeat))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from materials.stats import rebuild_course_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику курсов (CourseStats) по урокам, подпискам и платежам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='courses',
+                            help='id курса; можно указать несколько раз, по умолчанию — все курсы')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_course_stats(options['courses'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитана статистика курсов: {rebuilt}'))
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:39
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('materials', '0005_course_last_update'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='course',
+            index=models.Index(fields=['owner', 'id'], name='course_owner_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lesson',
+            index=models.Index(fields=['owner', 'id'], name='lesson_owner_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='subscription',
+            index=models.Index(fields=['course', 'user'], name='subscription_course_user_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 11:40
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('materials', '0006_composite_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'id'], name='subscription_user_id_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 6.0.2 on 2026-10-18 11:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Начальное заполнение одним INSERT ... SELECT; дальше счетчики поддерживаются materials.stats
+POPULATE_COURSE_STATS = """
+INSERT INTO materials_coursestats
+    (course_id, lessons_count, subscribers_count, payments_count, revenue, last_activity)
+SELECT
+    c.id,
+    (SELECT COUNT(*) FROM materials_lesson l WHERE l.course_id = c.id),
+    (SELECT COUNT(*) FROM materials_subscription s WHERE s.course_id = c.id),
+    COALESCE(p.payments_count, 0),
+    COALESCE(p.revenue, 0),
+    GREATEST(c.last_update, p.last_payment)
+FROM materials_course c
+LEFT JOIN (
+    SELECT paid_course_id, COUNT(*) AS payments_count, SUM(amount) AS revenue, MAX(payment_date) AS last_payment
+    FROM users_payment
+    WHERE payment_status = 'paid' OR payment_method <> 'stripe'
+    GROUP BY paid_course_id
+) p ON p.paid_course_id = c.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0007_subscription_user_id_idx'),
+        ('users', '0006_payment_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='materials.course', verbose_name='Курс')),
+                ('lessons_count', models.IntegerField(default=0, verbose_name='Количество уроков')),
+                ('subscribers_count', models.IntegerField(default=0, verbose_name='Количество подписчиков')),
+                ('payments_count', models.IntegerField(default=0, verbose_name='Количество оплат')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('last_activity', models.DateTimeField(blank=True, null=True, verbose_name='Последняя активность')),
+            ],
+            options={
+                'verbose_name': 'Статистика курса',
+                'verbose_name_plural': 'Статистика курсов',
+            },
+        ),
+        migrations.RunSQL(POPULATE_COURSE_STATS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:02
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations, models
+
+# ADD COLUMN ... GENERATED ALWAYS AS ... STORED переписывает таблицу под блокировкой ACCESS EXCLUSIVE:
+# пока вектор считается для всех строк, чтение и запись materials_course и materials_lesson стоят.
+# На 1 000 000 уроков это около 50 с (1 CPU), поэтому на больших таблицах миграцию нужно запускать
+# в окно обслуживания (см. README, раздел «Поиск курсов и уроков»).
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0008_coursestats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('name', config='russian', weight='A'), '||', django.contrib.postgres.search.SearchVector('description', config='russian', weight='B'), django.contrib.postgres.search.SearchConfig('russian')), output_field=django.contrib.postgres.search.SearchVectorField(), verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('name', config='russian', weight='A'), '||', django.contrib.postgres.search.SearchVector('description', config='russian', weight='B'), django.contrib.postgres.search.SearchConfig('russian')), output_field=django.contrib.postgres.search.SearchVectorField(), verbose_name='Поисковый вектор'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:02
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+# Триграммный поиск по названиям для опечаток. Расширение pg_trgm есть не во всех сборках
+# PostgreSQL, поэтому индексы создаются, только если его удалось подключить; без него
+# поиск работает только по полнотекстовому индексу (materials.search.trigram_available).
+TRIGRAM_INDEXES = {
+    'course_name_trgm_idx': 'materials_course',
+    'lesson_name_trgm_idx': 'materials_lesson',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, table in TRIGRAM_INDEXES.items():
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin (name gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name in TRIGRAM_INDEXES:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('materials', '0009_search_vector'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='course',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='course_search_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lesson',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='lesson_search_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
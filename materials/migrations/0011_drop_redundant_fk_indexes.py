@@ -0,0 +1,59 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Одиночные индексы, которые Django создал для ForeignKey; их покрывают составные индексы
+# из 0006/0007 и уникальный (user, course). AlterField с db_index=False удалил бы их
+# обычным DROP INDEX под блокировкой таблицы, поэтому база меняется через
+# DROP INDEX CONCURRENTLY, а AlterField применяется только к состоянию моделей.
+REDUNDANT_FK_INDEXES = [
+    ('materials_course_owner_id_494075a8', 'materials_course', 'owner_id'),
+    ('materials_lesson_owner_id_6f52e1e5', 'materials_lesson', 'owner_id'),
+    ('materials_subscription_course_id_8bb93521', 'materials_subscription', 'course_id'),
+    ('materials_subscription_user_id_a67c1f19', 'materials_subscription', 'user_id'),
+]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('materials', '0010_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    f'DROP INDEX CONCURRENTLY IF EXISTS {name}',
+                    reverse_sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column})',
+                )
+                for name, table, column in REDUNDANT_FK_INDEXES
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='course',
+                    name='owner',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='courses', to=settings.AUTH_USER_MODEL, verbose_name='Владелец'),
+                ),
+                migrations.AlterField(
+                    model_name='lesson',
+                    name='owner',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lessons', to=settings.AUTH_USER_MODEL, verbose_name='Владелец'),
+                ),
+                migrations.AlterField(
+                    model_name='subscription',
+                    name='course',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to='materials.course', verbose_name='Курс'),
+                ),
+                migrations.AlterField(
+                    model_name='subscription',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+                ),
+            ],
+        ),
+    ]
@@ -1,19 +1,71 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
 from users.models import User
 
+# Конфигурация полнотекстового поиска PostgreSQL: материалы на русском
+SEARCH_CONFIG = 'russian'
+
+
+def search_vector_field():
+    """Хранимая генерируемая колонка tsvector: название с весом A, описание с весом B"""
+    return models.GeneratedField(
+        expression=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+        verbose_name='Поисковый вектор',
+    )
+
+
+class CourseQuerySet(models.QuerySet):
+    def with_lessons_info(self, user, lessons=True, stats=True, is_subscribed=True):
+        """
+        Подгружает уроки, счетчики из CourseStats и признак подписки пользователя
+        фиксированным числом запросов независимо от размера выборки.
+
+        Ненужное для ответа можно отключить: lessons=False не выполняет prefetch уроков,
+        stats=False не присоединяет CourseStats, is_subscribed=False не добавляет подзапрос.
+        """
+        queryset = self.order_by('id')
+        if is_subscribed:
+            if user.is_authenticated:
+                subscribed = Exists(Subscription.objects.filter(course=OuterRef('pk'), user=user))
+            else:
+                subscribed = Value(False, output_field=BooleanField())
+            queryset = queryset.annotate(is_subscribed=subscribed)
+        if stats:
+            queryset = queryset.select_related('stats')
+        if lessons:
+            queryset = queryset.prefetch_related(
+                Prefetch('lessons', queryset=Lesson.objects.defer('search_vector').order_by('id')),
+            )
+        return queryset
+
 
 class Course(models.Model):
     name = models.CharField(max_length=255, verbose_name='Название')
     preview = models.ImageField(upload_to='courses/', blank=True, null=True, verbose_name='Превью')
     description = models.TextField(blank=True, null=True, verbose_name='Описание')
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='courses', verbose_name='Владелец', null=True, blank=True)
+    # Отдельный индекс по owner_id не нужен: его покрывает course_owner_id_idx (owner, id)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='courses', verbose_name='Владелец', null=True, blank=True, db_index=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Цена')
     last_update = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    search_vector = search_vector_field()
+
+    objects = CourseQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Курс'
         verbose_name_plural = 'Курсы'
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['owner', 'id'], name='course_owner_id_idx'),
+            GinIndex(fields=['search_vector'], name='course_search_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -25,26 +77,58 @@ class Lesson(models.Model):
     preview = models.ImageField(upload_to='lessons/', blank=True, null=True, verbose_name='Превью')
     video_url = models.URLField(blank=True, null=True, verbose_name='Ссылка на видео')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='lessons', verbose_name='Курс')
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lessons', verbose_name='Владелец', null=True, blank=True)
+    # Покрывается lesson_owner_id_idx (owner, id)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lessons', verbose_name='Владелец', null=True, blank=True, db_index=False)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Цена')
+    search_vector = search_vector_field()
 
     class Meta:
         verbose_name = 'Урок'
         verbose_name_plural = 'Уроки'
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['owner', 'id'], name='lesson_owner_id_idx'),
+            GinIndex(fields=['search_vector'], name='lesson_search_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
 class Subscription(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions', verbose_name='Пользователь')
-    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='subscriptions', verbose_name='Курс')
+    # Одиночные индексы FK покрываются уникальным (user, course) и subscription_course_user_idx (course, user)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions', verbose_name='Пользователь', db_index=False)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='subscriptions', verbose_name='Курс', db_index=False)
 
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
         unique_together = ['user', 'course']
+        indexes = [
+            models.Index(fields=['course', 'user'], name='subscription_course_user_idx'),
+            models.Index(fields=['user', 'id'], name='subscription_user_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.email} - {self.course.name}'
+
+
+class CourseStats(models.Model):
+    """
+    Счетчики курса, которые поддерживаются инкрементально сигналами и массовыми операциями
+    (materials.stats), чтобы не агрегировать уроки, подписки и платежи на каждый запрос.
+    """
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, primary_key=True, related_name='stats',
+                                  verbose_name='Курс')
+    lessons_count = models.IntegerField(default=0, verbose_name='Количество уроков')
+    subscribers_count = models.IntegerField(default=0, verbose_name='Количество подписчиков')
+    payments_count = models.IntegerField(default=0, verbose_name='Количество оплат')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Выручка')
+    last_activity = models.DateTimeField(null=True, blank=True, verbose_name='Последняя активность')
+
+    class Meta:
+        verbose_name = 'Статистика курса'
+        verbose_name_plural = 'Статистика курсов'
 
     def __str__(self):
-        return f'{self.user.email} - {self.course.name}' 
+        return f'Статистика курса {self.course_id}'
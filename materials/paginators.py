@@ -1,7 +1,64 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CourseLessonCursorPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    ordering = 'id'
 
 
 class CourseLessonPagination(PageNumberPagination):
+    """
+    Постраничная пагинация с переключением на курсорную (keyset) пагинацию.
+
+    Курсорный режим включается параметром ``?pagination=cursor``, параметром
+    ``?cursor=`` из ссылок next/previous или атрибутом представления
+    ``pagination_mode = 'cursor'``. В этом режиме не выполняется COUNT(*), а
+    выборка идет по условию ``id > курсор`` вместо OFFSET, поэтому время ответа
+    не зависит от глубины страницы.
+    """
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 50
\ No newline at end of file
+    max_page_size = 50
+    mode_query_param = 'pagination'
+    cursor_pagination_class = CourseLessonCursorPagination
+
+    cursor_paginator = None
+
+    def is_cursor_mode(self, request, view=None):
+        mode = request.query_params.get(self.mode_query_param)
+        if mode is None:
+            if self.cursor_pagination_class.cursor_query_param in request.query_params:
+                return True
+            mode = getattr(view, 'pagination_mode', 'page')
+        return mode == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_cursor_mode(request, view):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Режим пагинации: page (по умолчанию) или cursor.',
+                'schema': {'type': 'string', 'enum': ['page', 'cursor']},
+            },
+            {
+                'name': self.cursor_pagination_class.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор из ссылок next/previous в курсорном режиме.',
+                'schema': {'type': 'string'},
+            },
+        ]
@@ -1,14 +1,15 @@
 from rest_framework import permissions
 
+from users.roles import is_moderator
+
 
 class IsModerator(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Модераторы').exists()
+        return is_moderator(request)
 
 
 class IsOwnerOrModerator(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        is_moderator = request.user.groups.filter(name='Модераторы').exists()
         action = getattr(view, 'action', None)
         
         if not action:
@@ -21,7 +22,7 @@ class IsOwnerOrModerator(permissions.BasePermission):
             elif request.method == 'POST':
                 action = 'create'
         
-        if is_moderator:
+        if is_moderator(request):
             if action in ['update', 'partial_update', 'retrieve', 'list']:
                 return True
             if action in ['create', 'destroy']:
@@ -35,7 +36,6 @@ class IsOwnerOrModerator(permissions.BasePermission):
 
 class IsOwnerOrModeratorReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        is_moderator = request.user.groups.filter(name='Модераторы').exists()
         action = getattr(view, 'action', None)
         
         if not action:
@@ -48,7 +48,7 @@ class IsOwnerOrModeratorReadOnly(permissions.BasePermission):
             elif request.method == 'POST':
                 action = 'create'
         
-        if is_moderator:
+        if is_moderator(request):
             if action in ['update', 'partial_update', 'retrieve', 'list']:
                 return True
             if action in ['create', 'destroy']:
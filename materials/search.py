@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F
+
+from materials.models import SEARCH_CONFIG
+
+_trigram_available = None
+
+
+def trigram_available():
+    """Подключено ли расширение pg_trgm (см. миграцию 0010_search_indexes); проверяется один раз на процесс"""
+    global _trigram_available
+    if _trigram_available is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_available = cursor.fetchone() is not None
+    return _trigram_available
+
+
+def search(queryset, text, limit=None):
+    """
+    Ищет курсы или уроки queryset по названию и описанию, лучшие совпадения первыми.
+
+    Основной поиск — полнотекстовый по хранимой колонке search_vector (GIN-индекс),
+    запрос в синтаксисе websearch ("точная фраза", -исключение, or). Если он ничего
+    не нашел и доступен pg_trgm, ищет по похожести слов названия (оператор %>, порог
+    pg_trgm.word_similarity_threshold), чтобы найти запрос с опечаткой. У результатов
+    есть атрибут rank.
+
+    Ранжирование точное, пока совпадений не больше SEARCH_RANK_CANDIDATES. Если их больше,
+    оно приблизительное: лучшие выбираются среди первых SEARCH_RANK_CANDIDATES совпадений
+    в порядке обхода индекса, и более релевантная строка за их пределами в ответ не попадет.
+    """
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    queryset = queryset.defer('search_vector')
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    # Ранжируются не больше SEARCH_RANK_CANDIDATES совпадений: на частом слове вроде "урок"
+    # ts_rank по всем найденным строкам занимал бы почти секунду. Без order_by() подзапрос
+    # с LIMIT шел бы по первичному ключу в порядке Meta.ordering, минуя GIN-индекс
+    candidates = queryset.filter(search_vector=query).order_by().values('id')[:settings.SEARCH_RANK_CANDIDATES]
+    results = list(
+        queryset.filter(id__in=candidates)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', 'id')[:limit]
+    )
+    if results or not trigram_available():
+        return results
+    return list(
+        queryset.filter(name__trigram_word_similar=text)
+        .annotate(rank=TrigramWordSimilarity(text, 'name'))
+        .order_by('-rank', 'id')[:limit]
+    )
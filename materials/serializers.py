@@ -1,26 +1,47 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.fields import empty
+from materials.cache import invalidate_responses
+from materials.fieldsets import SparseFieldsetSerializerMixin
 from materials.models import Course, Lesson, Subscription
+from materials.services import schedule_course_update_notification
+from materials.stats import apply_stats_deltas, bulk_stats_changes, stats_deltas
 from materials.validators import validate_youtube_url, YouTubeURLValidator
+from users.roles import is_moderator
+from users.signals import schedule_stripe_product_sync
 
 
-class LessonSerializer(serializers.ModelSerializer):
+class LessonSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     video_url = serializers.URLField(validators=[validate_youtube_url], required=False, allow_null=True)
 
     class Meta:
         model = Lesson
-        fields = '__all__'
+        exclude = ['search_vector']
         validators = [YouTubeURLValidator(field='video_url')]
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     lessons_count = serializers.SerializerMethodField()
+    subscribers_count = serializers.SerializerMethodField()
     lessons = LessonSerializer(many=True, read_only=True)
     is_subscribed = serializers.SerializerMethodField()
 
     def get_lessons_count(self, obj):
+        stats = getattr(obj, 'stats', None)
+        if stats is not None:
+            return stats.lessons_count
         return obj.lessons.count()
 
+    def get_subscribers_count(self, obj):
+        stats = getattr(obj, 'stats', None)
+        if stats is not None:
+            return stats.subscribers_count
+        return obj.subscriptions.count()
+
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return Subscription.objects.filter(user=request.user, course=obj).exists()
@@ -28,4 +49,216 @@ class CourseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Course
-        fields = '__all__' 
+        exclude = ['search_vector']
+
+
+class CourseSearchSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Course
+        fields = ['id', 'name', 'description', 'rank']
+
+
+class LessonSearchSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Lesson
+        fields = ['id', 'name', 'description', 'course', 'rank']
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    """Параметры поиска: строка запроса и где искать"""
+    q = serializers.CharField(min_length=2, max_length=200)
+    type = serializers.ChoiceField(choices=['all', 'courses', 'lessons'], default='all')
+
+
+class SubscriptionSerializer(serializers.ModelSerializer):
+    course_name = serializers.CharField(source='course.name', read_only=True)
+
+    class Meta:
+        model = Subscription
+        fields = ['id', 'course', 'course_name']
+
+
+class SubscriptionBatchSerializer(serializers.Serializer):
+    """Списки id курсов для пакетной подписки и отписки"""
+    subscribe = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    unsubscribe = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+    def validate(self, attrs):
+        max_items = settings.SUBSCRIPTIONS_BATCH_MAX_ITEMS
+        if len(attrs['subscribe']) + len(attrs['unsubscribe']) > max_items:
+            raise serializers.ValidationError(f'Не больше {max_items} курсов за один запрос')
+        if set(attrs['subscribe']) & set(attrs['unsubscribe']):
+            raise serializers.ValidationError('Курс не может быть одновременно в subscribe и unsubscribe')
+        return attrs
+
+
+def parse_pk(value):
+    """Целый id из значения вида 5 или '5'; для всего остального None"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+class BulkCourseField(serializers.PrimaryKeyRelatedField):
+    """Курс урока из заранее загруженного context['courses'], без запроса к БД на каждый урок"""
+
+    def to_internal_value(self, data):
+        courses = self.context.get('courses')
+        if courses is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool) or not isinstance(data, (int, str)):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        course = courses.get(parse_pk(data))
+        if course is None:
+            self.fail('does_not_exist', pk_value=data)
+        return course
+
+
+class LessonBulkItemSerializer(LessonSerializer):
+    course = BulkCourseField(queryset=Course.objects.all())
+
+    class Meta(LessonSerializer.Meta):
+        read_only_fields = ['owner']
+
+
+class LessonBulkSerializer(serializers.Serializer):
+    """
+    Пакетное создание, изменение и удаление уроков.
+
+    Все элементы проверяются за один проход: курсы и изменяемые уроки загружаются
+    двумя запросами, а не по одному на элемент. Если хотя бы один элемент невалиден,
+    ничего не записывается и возвращаются ошибки по каждому элементу. Иначе изменения
+    пишутся в одной транзакции через bulk_create/bulk_update, а подписчики каждого
+    затронутого курса получают одно уведомление на весь пакет.
+    """
+    create = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    update = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+    def validate(self, attrs):
+        max_items = settings.LESSONS_BULK_MAX_ITEMS
+        if len(attrs['create']) + len(attrs['update']) + len(attrs['delete']) > max_items:
+            raise serializers.ValidationError(f'Не больше {max_items} уроков за один запрос')
+
+        request = self.context['request']
+        self.moderator = is_moderator(request)
+        # Элементы — произвольные словари: id проверяем до того, как класть их в множества
+        update_ids = [self.parse_lesson_id(item.get('id', empty)) for item in attrs['update']]
+        self.lessons = self.context['lessons'].in_bulk(
+            [pk for pk, _ in update_ids if pk is not None] + attrs['delete']
+        )
+        course_ids = {parse_pk(item.get('course')) for item in attrs['create'] + attrs['update']}
+        item_context = {
+            **self.context,
+            'courses': Course.objects.in_bulk([pk for pk in course_ids if pk is not None]),
+        }
+
+        self.to_create, self.to_update, self.to_delete, self.moved = [], [], [], []
+        self.affected_courses = set()
+        seen_ids = set()
+        errors = {'create': [], 'update': [], 'delete': []}
+
+        for item in attrs['create']:
+            serializer = LessonBulkItemSerializer(data=item, context=item_context)
+            item_errors = {} if serializer.is_valid() else serializer.errors
+            if not item_errors:
+                item_errors = self.check_course(serializer.validated_data['course'])
+            if not item_errors:
+                self.to_create.append(Lesson(**serializer.validated_data, owner=request.user))
+                self.affected_courses.add(serializer.validated_data['course'].id)
+            errors['create'].append(item_errors)
+
+        for (lesson_id, item_errors), item in zip(update_ids, attrs['update']):
+            lesson = None
+            if not item_errors:
+                lesson, item_errors = self.get_lesson(lesson_id, seen_ids)
+            if lesson is not None:
+                serializer = LessonBulkItemSerializer(lesson, data=item, partial=True, context=item_context)
+                item_errors = {} if serializer.is_valid() else serializer.errors
+                if not item_errors and 'course' in serializer.validated_data:
+                    item_errors = self.check_course(serializer.validated_data['course'])
+            if not item_errors:
+                # Урок мог переехать в другой курс: уведомляем подписчиков обоих
+                old_course_id = lesson.course_id
+                for field, value in serializer.validated_data.items():
+                    setattr(lesson, field, value)
+                self.affected_courses.update([old_course_id, lesson.course_id])
+                self.to_update.append((lesson, list(serializer.validated_data)))
+                if old_course_id != lesson.course_id:
+                    self.moved.append((old_course_id, lesson.course_id))
+            errors['update'].append(item_errors)
+
+        for lesson_id in attrs['delete']:
+            lesson, item_errors = self.get_lesson(lesson_id, seen_ids)
+            if not item_errors and self.moderator:
+                item_errors = {'id': ['Модератор не может удалять уроки']}
+            if not item_errors:
+                self.affected_courses.add(lesson.course_id)
+                self.to_delete.append(lesson)
+            errors['delete'].append(item_errors)
+
+        if any(any(item_errors) for item_errors in errors.values()):
+            raise serializers.ValidationError({op: items for op, items in errors.items() if items})
+        return attrs
+
+    def parse_lesson_id(self, value):
+        try:
+            return serializers.IntegerField().run_validation(value), {}
+        except serializers.ValidationError as e:
+            return None, {'id': e.detail}
+
+    def get_lesson(self, lesson_id, seen_ids):
+        if lesson_id in seen_ids:
+            return None, {'id': ['Урок указан в запросе несколько раз']}
+        seen_ids.add(lesson_id)
+        lesson = self.lessons.get(lesson_id)
+        if lesson is None:
+            return None, {'id': ['Урок не найден']}
+        return lesson, {}
+
+    def check_course(self, course):
+        if self.moderator or course.owner_id != self.context['request'].user.id:
+            return {'course': ['Добавлять уроки можно только в свои курсы']}
+        return {}
+
+    def save(self):
+        with transaction.atomic():
+            created = Lesson.objects.bulk_create(self.to_create)
+            updated = [lesson for lesson, _ in self.to_update]
+            if updated:
+                fields = sorted({field for _, fields in self.to_update for field in fields})
+                Lesson.objects.bulk_update(updated, fields)
+            deleted_ids = [lesson.id for lesson in self.to_delete]
+            if deleted_ids:
+                with bulk_stats_changes():
+                    Lesson.objects.filter(id__in=deleted_ids).delete()
+
+            # bulk_create и bulk_update не отправляют сигналы, а сигналы удаления отключены,
+            # поэтому кеш, статистику курсов и продукты Stripe обновляем явно
+            invalidate_responses()
+            deltas = stats_deltas()
+            for lesson in created:
+                deltas[lesson.course_id]['lessons_count'] += 1
+            for lesson in self.to_delete:
+                deltas[lesson.course_id]['lessons_count'] -= 1
+            for old_course_id, new_course_id in self.moved:
+                deltas[old_course_id]['lessons_count'] -= 1
+                deltas[new_course_id]['lessons_count'] += 1
+            apply_stats_deltas({course_id: deltas[course_id] for course_id in self.affected_courses})
+            for course_id in sorted(self.affected_courses):
+                schedule_course_update_notification(course_id)
+            for lesson in updated:
+                schedule_stripe_product_sync(lesson)
+
+        return {
+            'create': LessonSerializer(created, many=True).data,
+            'update': LessonSerializer(updated, many=True).data,
+            'delete': [{'id': lesson_id} for lesson_id in deleted_ids],
+        }
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from materials.cache import invalidate_responses
+from materials.models import Subscription
+from materials.stats import apply_stats_deltas, bulk_stats_changes, stats_deltas
+from materials.tasks import send_course_update_notifications
+
+PENDING_NOTIFICATION_KEY = 'materials:course-update-notification:{course_id}'
+
+
+def schedule_course_update_notification(course_id):
+    """
+    Планирует уведомление подписчиков об обновлении курса.
+
+    После фиксации транзакции первое изменение курса атомарно занимает ключ в кеше
+    (cache.add) на COURSE_NOTIFICATION_INTERVAL секунд и ставит отложенную задачу; все
+    последующие изменения в этом окне поглощаются. Так серия правок курса и его уроков,
+    в том числе параллельных, дает ровно одно уведомление за окно. Ключ занимается только
+    в on_commit: откаченная правка не должна поглощать уведомления о следующих.
+    """
+    key = PENDING_NOTIFICATION_KEY.format(course_id=course_id)
+
+    def enqueue():
+        if not cache.add(key, 1, settings.COURSE_NOTIFICATION_INTERVAL):
+            return
+        try:
+            send_course_update_notifications.apply_async(
+                (course_id,), countdown=settings.COURSE_NOTIFICATION_DELAY
+            )
+        except Exception:
+            cache.delete(key)
+            raise
+
+    transaction.on_commit(enqueue)
+
+
+def apply_subscription_batch(user, courses, subscribe_ids, unsubscribe_ids):
+    """
+    Подписывает пользователя на курсы subscribe_ids и отписывает от unsubscribe_ids.
+
+    Доступность курсов проверяется одним запросом по courses (queryset видимых
+    пользователю курсов), подписки создаются одним bulk_create(ignore_conflicts=True),
+    удаляются одним DELETE. Возвращает id курсов по итогу каждой операции.
+    """
+    requested = set(subscribe_ids) | set(unsubscribe_ids)
+    visible = set(courses.filter(id__in=requested).values_list('id', flat=True))
+    subscribed = set(
+        Subscription.objects.filter(user=user, course_id__in=visible).values_list('course_id', flat=True)
+    )
+
+    to_subscribe = sorted(visible.intersection(subscribe_ids) - subscribed)
+    to_unsubscribe = sorted(visible.intersection(unsubscribe_ids) & subscribed)
+
+    with transaction.atomic():
+        Subscription.objects.bulk_create(
+            [Subscription(user=user, course_id=course_id) for course_id in to_subscribe],
+            ignore_conflicts=True,
+        )
+        if to_unsubscribe:
+            with bulk_stats_changes():
+                Subscription.objects.filter(user=user, course_id__in=to_unsubscribe).delete()
+        if to_subscribe or to_unsubscribe:
+            # bulk_create не отправляет post_save, а сигналы удаления отключены, поэтому кеш
+            # ответов и счетчики подписчиков обновляем явно, по одному UPDATE на каждое направление
+            invalidate_responses()
+            deltas = stats_deltas()
+            for course_id in to_subscribe:
+                deltas[course_id]['subscribers_count'] += 1
+            for course_id in to_unsubscribe:
+                deltas[course_id]['subscribers_count'] -= 1
+            apply_stats_deltas(deltas)
+
+    return {
+        'subscribed': to_subscribe,
+        'already_subscribed': sorted(visible.intersection(subscribe_ids) & subscribed),
+        'unsubscribed': to_unsubscribe,
+        'not_subscribed': sorted(visible.intersection(unsubscribe_ids) - subscribed),
+        'not_found': sorted(requested - visible),
+    }
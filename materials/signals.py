@@ -0,0 +1,124 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from materials.cache import invalidate_responses
+from materials.models import Course, CourseStats, Lesson, Subscription
+from materials.stats import (
+    add_payment_change, apply_stats_deltas, in_bulk_stats_changes, payment_contribution, rebuild_course_stats,
+    stats_deltas, update_course_stats,
+)
+from users.models import Payment
+
+
+def _deleted_with_course(origin):
+    """Урок или подписка удаляются каскадом вместе с курсом, а с ним и его статистика"""
+    return isinstance(origin, Course) or (isinstance(origin, QuerySet) and origin.model is Course)
+
+
+def _skip_row_delete(origin):
+    return in_bulk_stats_changes() or _deleted_with_course(origin)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=Subscription)
+def invalidate_cached_responses(sender, **kwargs):
+    invalidate_responses()
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=Subscription)
+def invalidate_cached_responses_on_delete(sender, origin=None, **kwargs):
+    # При каскадном удалении курса кеш сбрасывается один раз, по сигналу самого курса
+    if sender is Course or not _skip_row_delete(origin):
+        invalidate_responses()
+
+
+@receiver(post_save, sender=Course)
+def create_course_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        CourseStats.objects.create(course=instance, last_activity=instance.last_update)
+
+
+@receiver(post_init, sender=Lesson)
+def remember_lesson_course(sender, instance, **kwargs):
+    # Курс, к которому урок относился при загрузке: нужен, чтобы заметить перенос урока
+    instance._stats_course_id = instance.__dict__.get('course_id')
+
+
+@receiver(post_save, sender=Lesson)
+def update_stats_on_lesson_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_course_id, instance._stats_course_id = instance._stats_course_id, instance.course_id
+    if created:
+        update_course_stats(instance.course_id, lessons_count=1)
+    elif old_course_id is not None and old_course_id != instance.course_id:
+        deltas = stats_deltas()
+        deltas[old_course_id]['lessons_count'] -= 1
+        deltas[instance.course_id]['lessons_count'] += 1
+        apply_stats_deltas(deltas)
+    else:
+        update_course_stats(instance.course_id)
+
+
+@receiver(post_delete, sender=Lesson)
+def update_stats_on_lesson_delete(sender, instance, origin=None, **kwargs):
+    if not _skip_row_delete(origin):
+        update_course_stats(instance.course_id, lessons_count=-1)
+
+
+@receiver(post_save, sender=Subscription)
+def update_stats_on_subscription_save(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_course_stats(instance.course_id, subscribers_count=1)
+
+
+@receiver(post_delete, sender=Subscription)
+def update_stats_on_subscription_delete(sender, instance, origin=None, **kwargs):
+    if not _skip_row_delete(origin):
+        update_course_stats(instance.course_id, subscribers_count=-1)
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_contribution(sender, instance, **kwargs):
+    instance._stats_contribution = payment_contribution(instance)
+
+
+@receiver(pre_save, sender=Payment)
+def remember_payment_course(sender, instance, raw=False, **kwargs):
+    # Платеж загружен не полностью: прежний курс читаем из БД, чтобы пересчитать и его
+    if not raw and not instance._state.adding and instance._stats_contribution is None:
+        instance._stats_old_course_id = (
+            Payment.objects.filter(pk=instance.pk).values_list('paid_course_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Payment)
+def update_stats_on_payment_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = (None, 0) if created else instance._stats_contribution
+    new = instance._stats_contribution = payment_contribution(instance)
+    if old is None or new is None:
+        # Вклад неизвестен: пересчитываем целиком прежний и новый курс платежа
+        course_ids = {getattr(instance, '_stats_old_course_id', None), instance.paid_course_id} - {None}
+        if course_ids:
+            rebuild_course_stats(sorted(course_ids))
+        return
+    deltas = stats_deltas()
+    add_payment_change(deltas, old, new)
+    apply_stats_deltas(deltas)
+
+
+@receiver(post_delete, sender=Payment)
+def update_stats_on_payment_delete(sender, instance, **kwargs):
+    old = payment_contribution(instance)
+    if old is None:
+        rebuild_course_stats([instance.paid_course_id])
+        return
+    deltas = stats_deltas()
+    add_payment_change(deltas, old, (None, 0))
+    apply_stats_deltas(deltas)
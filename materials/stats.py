@@ -0,0 +1,160 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from materials.models import Course, CourseStats, Lesson, Subscription
+from users.models import Payment
+
+STATS_COUNTERS = ['lessons_count', 'subscribers_count', 'payments_count', 'revenue']
+
+# Оплаченными считаются Stripe-платежи со статусом paid и все платежи наличными и переводом
+PAID_PAYMENTS = Q(payment_status='paid') | ~Q(payment_method='stripe')
+_CONTRIBUTION_FIELDS = ['paid_course_id', 'payment_method', 'payment_status', 'amount']
+
+_bulk_changes = ContextVar('course_stats_bulk_changes', default=False)
+
+
+@contextmanager
+def bulk_stats_changes():
+    """
+    Отключает в блоке обработку удаления уроков и подписок по одной строке.
+
+    Сигналы post_delete в блоке не сдвигают счетчики и не сбрасывают кеш ответов: вызывающий
+    код сам применяет изменения одним apply_stats_deltas и один раз вызывает invalidate_responses.
+    """
+    token = _bulk_changes.set(True)
+    try:
+        yield
+    finally:
+        _bulk_changes.reset(token)
+
+
+def in_bulk_stats_changes():
+    return _bulk_changes.get()
+
+
+def payment_contribution(payment):
+    """
+    Вклад платежа в статистику: (id курса, сумма) или (None, 0), если платеж не учитывается.
+
+    Поля читаются из __dict__, чтобы не подгружать отложенные поля; если какого-то
+    из них нет, возвращает None — вклад неизвестен.
+    """
+    values = payment.__dict__
+    if any(field not in values for field in _CONTRIBUTION_FIELDS):
+        return None
+    is_paid = values['payment_status'] == 'paid' or values['payment_method'] != 'stripe'
+    if values['paid_course_id'] is None or not is_paid:
+        return None, Decimal(0)
+    return values['paid_course_id'], Decimal(str(values['amount']))
+
+
+def add_payment_change(deltas, old, new):
+    """Добавляет в deltas изменение счетчиков оплат при переходе вклада платежа из old в new"""
+    if old == new:
+        return
+    old_course_id, old_amount = old
+    new_course_id, new_amount = new
+    if old_course_id is not None:
+        deltas[old_course_id]['payments_count'] -= 1
+        deltas[old_course_id]['revenue'] -= old_amount
+    if new_course_id is not None:
+        deltas[new_course_id]['payments_count'] += 1
+        deltas[new_course_id]['revenue'] += new_amount
+
+
+def stats_deltas():
+    """Пустой набор изменений {id курса: {счетчик: приращение}} для apply_stats_deltas"""
+    return defaultdict(lambda: defaultdict(int))
+
+
+def apply_stats_deltas(deltas):
+    """
+    Применяет изменения {id курса: {счетчик: приращение}} атомарными UPDATE через F().
+
+    Курсы с одинаковым набором приращений обновляются одним запросом, у всех затронутых
+    курсов обновляется last_activity. Курсы без строки статистики пропускаются — их
+    досчитает rebuild_course_stats. Возвращает число обновленных строк.
+    """
+    groups = defaultdict(list)
+    for course_id, counters in deltas.items():
+        if course_id is None:
+            continue
+        key = tuple(sorted((name, value) for name, value in counters.items() if value))
+        groups[key].append(course_id)
+
+    now = timezone.now()
+    updated = 0
+    for key, course_ids in groups.items():
+        values = {name: F(name) + value for name, value in key}
+        updated += CourseStats.objects.filter(course_id__in=course_ids).update(**values, last_activity=now)
+    return updated
+
+
+def update_course_stats(course_id, **counters):
+    """Сдвигает счетчики одного курса, например update_course_stats(course.id, lessons_count=1)"""
+    return apply_stats_deltas({course_id: counters})
+
+
+def rebuild_course_stats(course_ids=None, batch_size=None):
+    """
+    Пересчитывает статистику курсов агрегатами по урокам, подпискам и платежам.
+
+    course_ids — id курсов или подзапрос, None — все курсы. Курсы обрабатываются пачками
+    по COURSE_STATS_REBUILD_BATCH_SIZE, недостающие строки создаются, расхождения
+    исправляются. Изменения, пришедшие во время пересчета пачки, могут быть перезаписаны
+    и будут исправлены следующим пересчетом.
+    Возвращает число пересчитанных курсов.
+    """
+    batch_size = batch_size or settings.COURSE_STATS_REBUILD_BATCH_SIZE
+    courses = Course.objects.order_by('id')
+    if course_ids is not None:
+        courses = courses.filter(id__in=course_ids)
+
+    rebuilt = 0
+    last_id = 0
+    while True:
+        batch = list(courses.filter(id__gt=last_id).values_list('id', 'last_update')[:batch_size])
+        if not batch:
+            break
+        ids = [course_id for course_id, _ in batch]
+
+        lessons = dict(
+            Lesson.objects.filter(course_id__in=ids).values('course_id').annotate(count=Count('id'))
+            .values_list('course_id', 'count')
+        )
+        subscribers = dict(
+            Subscription.objects.filter(course_id__in=ids).values('course_id').annotate(count=Count('id'))
+            .values_list('course_id', 'count')
+        )
+        payments = {
+            row['paid_course_id']: row
+            for row in Payment.objects.filter(PAID_PAYMENTS, paid_course_id__in=ids).values('paid_course_id')
+            .annotate(count=Count('id'), revenue=Sum('amount'), last_payment=Max('payment_date'))
+        }
+        activity = dict(CourseStats.objects.filter(course_id__in=ids).values_list('course_id', 'last_activity'))
+
+        stats = []
+        for course_id, last_update in batch:
+            paid = payments.get(course_id, {})
+            dates = [last_update, paid.get('last_payment'), activity.get(course_id)]
+            stats.append(CourseStats(
+                course_id=course_id,
+                lessons_count=lessons.get(course_id, 0),
+                subscribers_count=subscribers.get(course_id, 0),
+                payments_count=paid.get('count', 0),
+                revenue=paid.get('revenue') or 0,
+                last_activity=max(date for date in dates if date is not None),
+            ))
+        CourseStats.objects.bulk_create(
+            stats, update_conflicts=True, unique_fields=['course'],
+            update_fields=STATS_COUNTERS + ['last_activity'],
+        )
+        rebuilt += len(stats)
+        last_id = ids[-1]
+    return rebuilt
@@ -1,47 +1,125 @@
+import logging
 from datetime import timedelta
 
-from celery import shared_task
+from celery import group, shared_task
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
 from django.utils import timezone
 
+from config.metrics import TASK_BATCH_SIZE
 from materials.models import Course, Subscription
+from materials.stats import rebuild_course_stats
 from users.models import User
+from users.signals import users_deactivated
+
+logger = logging.getLogger(__name__)
+
+
+def _iter_subscriber_email_chunks(course_id, chunk_size):
+    emails = (
+        Subscription.objects.filter(course_id=course_id)
+        .exclude(user__email='')
+        # Порядок по user_id отдает индекс subscription_course_user_idx без сортировки
+        .order_by('user_id')
+        .values_list('user__email', flat=True)
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk = []
+    for email in emails:
+        chunk.append(email)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 @shared_task
-def send_course_update_notifications(course_id: int) -> None:
-    try:
-        course = Course.objects.get(id=course_id)
-    except Course.DoesNotExist:
-        return
+def send_course_update_notifications(course_id: int) -> int:
+    """
+    Рассылает уведомления об обновлении курса подписчикам.
 
-    subscriptions = Subscription.objects.filter(course=course).select_related('user')
-    recipients = [sub.user.email for sub in subscriptions if sub.user.email]
+    Адреса читаются из БД потоком и делятся на пачки фиксированного размера,
+    пачки отправляются подзадачами одной группы Celery. Группа получает генератор
+    и публикует подзадачу сразу после чтения пачки, так что в памяти воркера
+    одновременно находится не больше двух пачек. Возвращает число пачек.
+    """
+    if not Course.objects.filter(id=course_id).exists():
+        return 0
 
-    if not recipients:
-        return
+    chunk_size = settings.COURSE_NOTIFICATION_CHUNK_SIZE
+    chunks_count = 0
+
+    def chunk_signatures():
+        nonlocal chunks_count
+        for emails in _iter_subscriber_email_chunks(course_id, chunk_size):
+            TASK_BATCH_SIZE.labels('send_course_update_notifications').observe(len(emails))
+            chunks_count += 1
+            yield send_course_update_notifications_chunk.s(course_id, emails)
+
+    group(chunk_signatures()).apply_async()
+    return chunks_count
+
+
+@shared_task
+def send_course_update_notifications_chunk(course_id: int, recipients: list[str]) -> int:
+    """
+    Отправляет каждому получателю из пачки отдельное письмо через одно SMTP-соединение.
+    Возвращает число отправленных писем.
+    """
+    course = Course.objects.filter(id=course_id).only('name').first()
+    if course is None:
+        return 0
 
     subject = f'Обновление курса: {course.name}'
     message = f'Материалы курса \"{course.name}\" были обновлены.'
 
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        recipients,
-        fail_silently=True,
-    )
+    connection = get_connection(fail_silently=True)
+    messages = [
+        EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [email], connection=connection)
+        for email in recipients
+    ]
+    return connection.send_messages(messages) or 0
 
 
 @shared_task
-def deactivate_inactive_users() -> None:
+def deactivate_inactive_users() -> int:
+    """
+    Деактивирует пользователей, не заходивших больше 30 дней.
+
+    Обновление выполняется пачками по диапазонам первичного ключа, чтобы не держать
+    длительных блокировок на таблице пользователей. Возвращает число деактивированных.
+    """
     threshold = timezone.now() - timedelta(days=30)
-    users = User.objects.filter(is_active=True).filter(
-        last_login__lt=threshold
-    ) | User.objects.filter(is_active=True, last_login__isnull=True)
+    inactive = User.objects.filter(is_active=True).filter(
+        Q(last_login__lt=threshold) | Q(last_login__isnull=True)
+    )
+    batch_size = settings.DEACTIVATE_USERS_BATCH_SIZE
 
-    for user in users:
-        user.is_active = False
-        user.save(update_fields=['is_active'])
+    deactivated = 0
+    last_pk = 0
+    while True:
+        pks = list(
+            inactive.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            break
+        deactivated += inactive.filter(pk__gte=pks[0], pk__lte=pks[-1]).update(is_active=False)
+        TASK_BATCH_SIZE.labels('deactivate_inactive_users').observe(len(pks))
+        last_pk = pks[-1]
 
+    logger.info('Деактивировано неактивных пользователей: %s', deactivated)
+    users_deactivated.send(sender=User, count=deactivated)
+    return deactivated
+
+
+@shared_task
+def repair_course_stats() -> int:
+    """
+    Пересчитывает CourseStats всех курсов, исправляя расхождения счетчиков, накопившиеся
+    из-за изменений в обход сигналов (update(), сырой SQL, гонки). Возвращает число курсов.
+    """
+    rebuilt = rebuild_course_stats()
+    logger.info('Пересчитана статистика курсов: %s', rebuilt)
+    return rebuilt
@@ -1,9 +1,40 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.mail import get_connection
+from django.utils import timezone
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import Group
+from celery.signals import worker_process_shutdown
+from prometheus_client import REGISTRY
 from rest_framework.test import APIClient
 from rest_framework import status
-from users.models import User
-from materials.models import Course, Lesson, Subscription
+from users.models import Payment, User
+from config import checks
+from config.celery import celery_app
+from config.metrics import clear_multiprocess_dir
+from config.profiling import ProfilingMiddleware
+from materials.management.commands.benchmark_api import Command as BenchmarkApiCommand
+from materials.models import SEARCH_CONFIG, Course, CourseStats, Lesson, Subscription
+from materials.services import schedule_course_update_notification
+from materials.views import LessonListCreateView
+from materials.search import trigram_available
+from materials.stats import rebuild_course_stats
+from materials.tasks import deactivate_inactive_users, send_course_update_notifications
+from users.signals import users_deactivated
 
 
 class LessonCRUDTestCase(TestCase):
@@ -226,4 +257,1004 @@ class SubscriptionTestCase(TestCase):
         self.client.force_authenticate(user=self.user2)
         Subscription.objects.create(user=self.user2, course=self.course1)
         
-        self.assertEqual(Subscription.objects.filter(course=self.course1).count(), 2)
\ No newline at end of file
+        self.assertEqual(Subscription.objects.filter(course=self.course1).count(), 2)
+
+class CourseListQueriesTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='owner@test.com')
+
+        for i in range(20):
+            course = Course.objects.create(name=f'Course {i}', owner=self.user)
+            for j in range(3):
+                Lesson.objects.create(name=f'Lesson {i}.{j}', course=course, owner=self.user)
+            if i % 2:
+                Subscription.objects.create(user=self.user, course=course)
+
+    def test_list_courses_constant_queries(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get('/api/courses/')
+        for page_size in [5, 20]:
+            with self.assertNumQueries(3):
+                response = self.client.get('/api/courses/', {'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_list_courses_counts_and_subscription(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/courses/', {'page_size': 2})
+        first, second = response.data['results']
+        self.assertEqual(first['lessons_count'], 3)
+        self.assertEqual((first['subscribers_count'], second['subscribers_count']), (0, 1))
+        self.assertEqual(len(first['lessons']), 3)
+        self.assertFalse(first['is_subscribed'])
+        self.assertTrue(second['is_subscribed'])
+
+
+class ModeratorRoleQueriesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.moderator_group = Group.objects.create(name='Модераторы')
+        self.owner = User.objects.create(email='owner@test.com')
+        self.moderator = User.objects.create(email='moderator@test.com')
+        self.moderator.groups.add(self.moderator_group)
+        self.course = Course.objects.create(name='Test Course', owner=self.owner)
+        self.lesson = Lesson.objects.create(name='Test Lesson', course=self.course, owner=self.owner)
+
+    def _group_queries(self, context):
+        return [query for query in context.captured_queries if 'auth_group' in query['sql']]
+
+    def test_group_lookup_once_per_request(self):
+        self.client.force_authenticate(user=self.moderator)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/lessons/{self.lesson.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self._group_queries(context)), 1)
+
+    def test_group_lookup_cached_between_requests(self):
+        self.client.force_authenticate(user=self.moderator)
+        self.client.get(f'/api/lessons/{self.lesson.id}/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'/api/lessons/{self.lesson.id}/', {'name': 'Updated'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._group_queries(context), [])
+
+    def test_group_change_invalidates_cache(self):
+        self.client.force_authenticate(user=self.moderator)
+        response = self.client.get('/api/lessons/')
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.moderator.groups.remove(self.moderator_group)
+        response = self.client.get('/api/lessons/')
+        self.assertEqual(len(response.data['results']), 0)
+
+        self.moderator_group.user_set.add(self.moderator)
+        response = self.client.get('/api/lessons/')
+        self.assertEqual(len(response.data['results']), 1)
+
+
+@override_settings(COURSE_NOTIFICATION_CHUNK_SIZE=100)
+class CourseUpdateNotificationsTestCase(TestCase):
+    # Нижняя граница с десятикратным запасом: вместе с чтением адресов и eager-подзадачами на locmem
+    # выходит около 1000 писем в секунду, так что тест ловит только заметную регрессию
+    min_messages_per_second = 100
+
+    def setUp(self):
+        # Очистка регистрируется сразу, поэтому флаг сбрасывается, даже если setUp упадет дальше
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        self.course = Course.objects.create(name='Test Course')
+        users = User.objects.bulk_create(
+            User(email=f'subscriber{i}@test.com') for i in range(250)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, course=self.course) for user in users
+        )
+
+    def test_one_message_per_recipient(self):
+        with mock.patch('materials.tasks.get_connection', wraps=get_connection) as connection_factory:
+            chunks_count = send_course_update_notifications(self.course.id)
+
+        self.assertEqual(chunks_count, 3)
+        self.assertEqual(connection_factory.call_count, 3)
+        self.assertEqual(len(mail.outbox), 250)
+        self.assertTrue(all(len(message.to) == 1 for message in mail.outbox))
+        self.assertEqual(
+            {message.to[0] for message in mail.outbox},
+            set(Subscription.objects.values_list('user__email', flat=True)),
+        )
+
+    def test_throughput(self):
+        """Пропускная способность рассылки на locmem-бэкенде, писем в секунду"""
+        started = time.perf_counter()
+        send_course_update_notifications(self.course.id)
+        rate = len(mail.outbox) / (time.perf_counter() - started)
+
+        self.assertEqual(len(mail.outbox), 250)
+        self.assertGreater(rate, self.min_messages_per_second, f'{rate:.0f} писем/с')
+
+    def test_missing_course(self):
+        self.assertEqual(send_course_update_notifications(self.course.id + 1), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+@override_settings(DEACTIVATE_USERS_BATCH_SIZE=3)
+class DeactivateInactiveUsersTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.stale = User.objects.bulk_create(
+            User(email=f'stale{i}@test.com', last_login=now - timedelta(days=31)) for i in range(5)
+        )
+        self.never_logged_in = User.objects.bulk_create(
+            User(email=f'new{i}@test.com') for i in range(2)
+        )
+        self.recent = User.objects.create(email='recent@test.com', last_login=now - timedelta(days=1))
+
+    def test_deactivate_inactive_users(self):
+        handler = mock.Mock()
+        users_deactivated.connect(handler)
+        self.addCleanup(users_deactivated.disconnect, handler)
+
+        with CaptureQueriesContext(connection) as context:
+            deactivated = deactivate_inactive_users()
+
+        self.assertEqual(deactivated, 7)
+        self.assertEqual(len([q for q in context.captured_queries if q['sql'].startswith('UPDATE')]), 3)
+        self.assertEqual(User.objects.filter(is_active=False).count(), 7)
+        self.recent.refresh_from_db()
+        self.assertTrue(self.recent.is_active)
+        handler.assert_called_once_with(signal=users_deactivated, sender=User, count=7)
+
+    def test_deactivate_inactive_users_idempotent(self):
+        deactivate_inactive_users()
+        self.assertEqual(deactivate_inactive_users(), 0)
+
+
+class CourseUpdateNotificationSchedulingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='owner@test.com')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='Test Course', owner=self.user)
+        self.lessons = [
+            Lesson.objects.create(name=f'Lesson {i}', course=self.course, owner=self.user) for i in range(3)
+        ]
+
+    @mock.patch('materials.services.send_course_update_notifications.apply_async')
+    def test_burst_of_edits_schedules_one_notification(self, apply_async):
+        last_update = self.course.last_update
+        with self.captureOnCommitCallbacks(execute=True):
+            for lesson in self.lessons:
+                response = self.client.patch(f'/api/lessons/{lesson.id}/', {'name': 'Updated'})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.patch(f'/api/courses/{self.course.id}/', {'name': 'Updated'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        apply_async.assert_called_once_with((self.course.id,), countdown=settings.COURSE_NOTIFICATION_DELAY)
+        self.assertEqual(Course.objects.get(id=self.course.id).name, 'Updated')
+        self.assertNotEqual(Course.objects.get(id=self.course.id).last_update, last_update)
+
+    @mock.patch('materials.services.send_course_update_notifications.apply_async')
+    def test_lesson_edit_does_not_touch_course(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as context:
+                self.client.patch(f'/api/lessons/{self.lessons[0].id}/', {'name': 'Updated'})
+
+        updates = [q['sql'] for q in context.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len([sql for sql in updates if sql.startswith('UPDATE "materials_lesson"')]), 1)
+        self.assertFalse([sql for sql in updates if sql.startswith('UPDATE "materials_course"')])
+        apply_async.assert_called_once()
+
+    @mock.patch('materials.services.send_course_update_notifications.apply_async')
+    def test_next_window_schedules_again(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/lessons/{self.lessons[0].id}/', {'name': 'Updated'})
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/lessons/{self.lessons[0].id}/', {'name': 'Updated again'})
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    @mock.patch('materials.services.send_course_update_notifications.apply_async')
+    def test_rolled_back_edit_does_not_take_window(self, apply_async):
+        """Откаченная правка не занимает окно: следующая зафиксированная ставит задачу"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError):
+                with transaction.atomic():
+                    schedule_course_update_notification(self.course.id)
+                    raise DatabaseError('откат')
+        apply_async.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/lessons/{self.lessons[0].id}/', {'name': 'Updated'})
+
+        apply_async.assert_called_once_with((self.course.id,), countdown=settings.COURSE_NOTIFICATION_DELAY)
+
+
+class CachedResponsesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='owner@test.com')
+        self.other = User.objects.create(email='other@test.com')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='Test Course', owner=self.user)
+        self.lesson = Lesson.objects.create(name='Test Lesson', course=self.course, owner=self.user)
+
+    def test_cached_response_skips_database(self):
+        for url in ['/api/courses/', f'/api/courses/{self.course.id}/', f'/api/lessons/{self.lesson.id}/']:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.status_code, status.HTTP_200_OK)
+            self.assertEqual(first.data, second.data)
+            self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_if_none_match_returns_not_modified(self):
+        response = self.client.get('/api/lessons/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/lessons/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_lesson_update_invalidates_cache(self):
+        etag = self.client.get(f'/api/courses/{self.course.id}/')['ETag']
+        self.client.patch(f'/api/lessons/{self.lesson.id}/', {'name': 'Updated Lesson'})
+
+        response = self.client.get(f'/api/courses/{self.course.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['lessons'][0]['name'], 'Updated Lesson')
+
+    def test_subscription_invalidates_cache(self):
+        self.assertFalse(self.client.get(f'/api/courses/{self.course.id}/').data['is_subscribed'])
+        self.client.post(f'/api/courses/{self.course.id}/subscribe/')
+        self.assertTrue(self.client.get(f'/api/courses/{self.course.id}/').data['is_subscribed'])
+
+    def test_cache_is_per_user(self):
+        self.client.get(f'/api/lessons/{self.lesson.id}/')
+        self.client.force_authenticate(user=self.other)
+        response = self.client.get(f'/api/lessons/{self.lesson.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CursorPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='owner@test.com')
+        self.client.force_authenticate(user=self.user)
+        course = Course.objects.create(name='Test Course', owner=self.user)
+        self.lessons = Lesson.objects.bulk_create(
+            Lesson(name=f'Lesson {i}', course=course, owner=self.user) for i in range(25)
+        )
+
+    def test_cursor_mode_walks_all_lessons(self):
+        names = []
+        url = '/api/lessons/?pagination=cursor&page_size=10'
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            for query in context.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('OFFSET', query['sql'])
+            names += [lesson['name'] for lesson in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(names, [lesson.name for lesson in self.lessons])
+
+    def test_page_number_mode_by_default(self):
+        response = self.client.get('/api/lessons/', {'page': 3})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_view_setting_selects_cursor_mode(self):
+        with mock.patch.object(LessonListCreateView, 'pagination_mode', 'cursor', create=True):
+            response = self.client.get('/api/lessons/')
+        self.assertNotIn('count', response.data)
+        self.assertIsNotNone(response.data['next'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN-проверки индексов рассчитаны на PostgreSQL')
+class MaterialsIndexUsageTestCase(TestCase):
+    """Проверяет по плану запроса, что SQL эндпоинтов и рассылки идет по составным индексам."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='owner@test.com')
+        self.course = Course.objects.create(name='Test Course', owner=self.user)
+        # Индексы должны занимать больше одной страницы, иначе полный проход по чужому индексу
+        # стоит столько же, сколько поиск по нужному
+        users = User.objects.bulk_create(User(email=f'user{i}@test.com') for i in range(30))
+        courses = Course.objects.bulk_create(Course(name=f'Course {i}', owner=users[i]) for i in range(20))
+        Subscription.objects.bulk_create(
+            Subscription(user=user, course=course) for user in users for course in [self.course, *courses]
+        )
+        # На пустой странице пагинатор не выполняет выборку, поэтому у владельца есть строки в каждой таблице
+        Lesson.objects.create(name='Test Lesson', course=self.course, owner=self.user)
+        Subscription.objects.create(user=self.user, course=courses[0])
+        # На маленьких таблицах планировщику дешевле отсортировать результат после любого индекса,
+        # поэтому запрещаем сортировку: выбор остается только между индексами, которые сразу
+        # отдают строки в нужном порядке, и лучшим из них будет тот, что покрывает и фильтр
+        with connection.cursor() as cursor:
+            # Без статистики оценка строк зависит от того, успел ли autovacuum обработать таблицу
+            # после прошлых тестов, и при оценке в одну строку индексы становятся равноценными
+            cursor.execute('ANALYZE materials_subscription')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+
+    def explain_captured(self, queries, table):
+        """План первого запроса к таблице (не COUNT пагинации) из перехваченных"""
+        sql = next(
+            query['sql'] for query in queries
+            if f'FROM "{table}"' in query['sql'] and 'COUNT(' not in query['sql']
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def assertEndpointUsesIndex(self, url, table, index_name):
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        plan = self.explain_captured(ctx.captured_queries, table)
+        self.assertIn(index_name, plan, plan)
+
+    def test_course_list_by_owner(self):
+        self.assertEndpointUsesIndex('/api/courses/', 'materials_course', 'course_owner_id_idx')
+
+    def test_lesson_list_by_owner(self):
+        self.assertEndpointUsesIndex('/api/lessons/', 'materials_lesson', 'lesson_owner_id_idx')
+
+    def test_subscriptions_of_user(self):
+        self.assertEndpointUsesIndex('/api/subscriptions/', 'materials_subscription', 'subscription_user_id_idx')
+
+    def test_subscribers_of_course(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        with CaptureQueriesContext(connection) as ctx:
+            send_course_update_notifications(self.course.id)
+        self.assertEqual(len(mail.outbox), 30)
+        plan = self.explain_captured(ctx.captured_queries, 'materials_subscription')
+        self.assertIn('subscription_course_user_idx', plan, plan)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkApiCommandTestCase(TestCase):
+    """Тесты команды benchmark_api"""
+
+    def setUp(self):
+        fd, self.budget_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, self.budget_path)
+        self.options = {
+            'budget': self.budget_path, 'users': 5, 'courses': 3, 'lessons_per_course': 2,
+            'subscriptions_per_user': 1, 'payments_per_user': 1, 'repeat': 2, 'analyze': False,
+            'stdout': io.StringIO(),
+        }
+
+    def test_budget_roundtrip(self):
+        """Записанный бюджет проходит проверку, а сгенерированные данные откатываются"""
+        call_command('benchmark_api', update_budget=True, **self.options)
+        call_command('benchmark_api', **self.options)
+
+        with open(self.budget_path) as f:
+            budget = json.load(f)
+        self.assertIn('GET /api/courses/', budget)
+        self.assertFalse(User.objects.filter(email__startswith='benchmark0-').exists())
+
+    def test_query_budget_exceeded(self):
+        """Превышение бюджета по запросам завершает команду ошибкой"""
+        call_command('benchmark_api', update_budget=True, **self.options)
+        with open(self.budget_path) as f:
+            budget = json.load(f)
+        budget['GET /api/courses/']['queries'] = 0
+        with open(self.budget_path, 'w') as f:
+            json.dump(budget, f)
+
+        with self.assertRaisesMessage(CommandError, 'GET /api/courses/: queries'):
+            call_command('benchmark_api', **self.options)
+
+    def test_endpoint_without_benchmark(self):
+        """Маршрут API, для метода которого нет замера, завершает команду ошибкой"""
+        get_endpoints = BenchmarkApiCommand.get_endpoints
+
+        def without_course_delete(command, fixtures):
+            return [endpoint for endpoint in get_endpoints(command, fixtures) if endpoint[0] != 'DELETE /api/courses/{id}/']
+
+        with mock.patch.object(BenchmarkApiCommand, 'get_endpoints', without_course_delete):
+            with self.assertRaisesMessage(CommandError, 'DELETE course-detail'):
+                call_command('benchmark_api', update_budget=True, **self.options)
+
+    def test_latency_budget_reported(self):
+        """Превышение по времени ответа выводится предупреждением, ошибкой — только с --check-latency"""
+        call_command('benchmark_api', update_budget=True, **self.options)
+        with open(self.budget_path) as f:
+            budget = json.load(f)
+        budget['GET /api/courses/']['p95_ms'] = 0
+        with open(self.budget_path, 'w') as f:
+            json.dump(budget, f)
+
+        call_command('benchmark_api', **self.options)
+        self.assertIn('Время ответа выше бюджета: GET /api/courses/: p95_ms', self.options['stdout'].getvalue())
+        with self.assertRaisesMessage(CommandError, 'GET /api/courses/: p95_ms'):
+            call_command('benchmark_api', check_latency=True, **self.options)
+
+
+@override_settings(
+    MIDDLEWARE=['config.profiling.ProfilingMiddleware', *settings.MIDDLEWARE],
+    PROFILING_SLOW_REQUEST_MS=60_000,
+)
+class ProfilingMiddlewareTestCase(TestCase):
+    """Тесты профилирования запросов"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='profiling@test.com')
+        self.course = Course.objects.create(name='Курс', owner=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_server_timing_header(self):
+        """В ответе есть Server-Timing с БД, правами, пагинацией и сериализатором"""
+        response = self.client.get('/api/courses/')
+
+        metrics = {item.split(';')[0] for item in response['Server-Timing'].split(', ')}
+        self.assertTrue({'total', 'db', 'permissions', 'pagination', 'serializer.CourseSerializer'} <= metrics)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    @override_settings(PROFILING_SLOW_REQUEST_MS=0)
+    def test_slow_request_logs_duplicated_queries(self):
+        """Медленный запрос логируется вместе с повторяющимися SQL"""
+        def view(request):
+            for _ in range(3):
+                list(Course.objects.filter(pk=self.course.pk))
+            return HttpResponse()
+
+        request = RequestFactory().get('/slow/')
+        with self.assertLogs('config.profiling', level='WARNING') as logs:
+            ProfilingMiddleware(view)(request)
+
+        self.assertIn('Медленный запрос GET /slow/', logs.output[0])
+        self.assertIn('3x', logs.output[0])
+        self.assertIn('materials_course', logs.output[0])
+
+
+class MetricsTestCase(TestCase):
+    """Тесты метрик Prometheus"""
+
+    def setUp(self):
+        cache.clear()
+        celery_app.conf.task_always_eager = True
+        self.user = User.objects.create(email='metrics@test.com')
+        self.course = Course.objects.create(name='Курс', owner=self.user)
+        Subscription.objects.create(user=self.user, course=self.course)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        celery_app.conf.task_always_eager = False
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_metrics(self):
+        """Запросы считаются по маршруту и действию ViewSet и видны в /metrics"""
+        labels = {'method': 'GET', 'view': 'course-list', 'action': 'list'}
+        before = self.sample('http_requests_total', status='200', **labels)
+
+        self.client.get('/api/courses/')
+
+        self.assertEqual(self.sample('http_requests_total', status='200', **labels), before + 1)
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'http_request_duration_seconds_bucket{action="list"', response.content)
+
+    def test_metrics_access(self):
+        """/metrics отдается только по токену или с разрешенных адресов"""
+        client = APIClient()
+        self.assertEqual(client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+            self.assertEqual(
+                client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, status.HTTP_403_FORBIDDEN,
+            )
+            self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, status.HTTP_200_OK)
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8']):
+            self.assertEqual(client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, status.HTTP_200_OK)
+            self.assertEqual(client.get('/metrics', REMOTE_ADDR='192.168.1.1').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_clear_multiprocess_dir(self):
+        """При старте сервиса файлы метрик прошлого запуска удаляются"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        for name in ('counter_101.db', 'histogram_101.db'):
+            open(os.path.join(directory, name), 'w').close()
+
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+            clear_multiprocess_dir()
+
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_celery_child_marked_dead(self):
+        """Завершившийся процесс пула Celery помечается мертвым"""
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': '/tmp/metrics'}), \
+                mock.patch('config.metrics.multiprocess.mark_process_dead') as mark_process_dead:
+            worker_process_shutdown.send(sender=None, pid=4321, exitcode=0)
+
+        mark_process_dead.assert_called_once_with(4321)
+
+    def test_task_metrics(self):
+        """Для задач Celery пишутся длительность и размеры пачек"""
+        task_name = 'materials.tasks.send_course_update_notifications'
+        duration_before = self.sample('celery_task_duration_seconds_count', task=task_name, state='SUCCESS')
+        batches_before = self.sample('celery_task_batch_size_sum', task='send_course_update_notifications')
+
+        send_course_update_notifications.delay(self.course.id)
+
+        self.assertEqual(
+            self.sample('celery_task_duration_seconds_count', task=task_name, state='SUCCESS'), duration_before + 1,
+        )
+        self.assertEqual(self.sample('celery_task_batch_size_sum', task='send_course_update_notifications'),
+                         batches_before + 1)
+
+
+class ProductionChecksTestCase(TestCase):
+    """Тесты самопроверки production-конфигурации"""
+
+    def database_settings(self, **options):
+        return {'default': {**settings.DATABASES['default'], **options}}
+
+    def test_database_connection(self):
+        self.assertEqual(checks.check_database_connection(None, databases=['default']), [])
+
+    def test_pool_with_persistent_connections(self):
+        database = self.database_settings(CONN_MAX_AGE=60, OPTIONS={'pool': {'max_size': 4}})
+        with mock.patch.object(settings, 'DATABASES', database):
+            self.assertEqual([error.id for error in checks.check_database_settings(None)], ['config.E002'])
+
+    def test_connection_per_request(self):
+        with mock.patch.object(settings, 'DATABASES', self.database_settings(CONN_MAX_AGE=0, OPTIONS={})):
+            self.assertEqual([error.id for error in checks.check_database_settings(None)], ['config.W001'])
+
+    @override_settings(CACHE_ENABLED=False)
+    def test_local_cache(self):
+        self.assertEqual([error.id for error in checks.check_shared_cache(None)], ['config.W002'])
+
+    @override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=[])
+    def test_metrics_closed(self):
+        self.assertEqual([error.id for error in checks.check_metrics_access(None)], ['config.W003'])
+
+
+@mock.patch('materials.services.send_course_update_notifications.apply_async')
+class LessonBulkTestCase(TestCase):
+    """Тесты пакетного API уроков"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@test.com')
+        self.other = User.objects.create(email='other@test.com')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='Курс', owner=self.user)
+        self.other_course = Course.objects.create(name='Чужой курс', owner=self.other)
+        self.lessons = [
+            Lesson.objects.create(name=f'Урок {i}', course=self.course, owner=self.user) for i in range(3)
+        ]
+        self.other_lesson = Lesson.objects.create(name='Чужой урок', course=self.other_course, owner=self.other)
+
+    def new_lessons(self, count):
+        return [
+            {'name': f'Новый урок {i}', 'course': self.course.id, 'video_url': 'https://www.youtube.com/watch?v=x'}
+            for i in range(count)
+        ]
+
+    def test_create_constant_queries(self, apply_async):
+        """Число запросов не зависит от размера пакета"""
+        query_counts = []
+        for count in [2, 20]:
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post('/api/lessons/bulk/', {'create': self.new_lessons(count)}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['create']), count)
+            query_counts.append(len(context.captured_queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(Lesson.objects.filter(course=self.course, owner=self.user).count(), 25)
+
+    def test_mixed_operations_notify_once(self, apply_async):
+        """Создание, изменение и удаление в одном пакете дают одно уведомление на курс"""
+        self.client.get('/api/lessons/')
+        payload = {
+            'create': self.new_lessons(2),
+            'update': [{'id': self.lessons[0].id, 'name': 'Переименован'}],
+            'delete': [self.lessons[1].id],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/lessons/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['update'][0]['name'], 'Переименован')
+        self.assertEqual(response.data['delete'], [{'id': self.lessons[1].id}])
+        self.assertFalse(Lesson.objects.filter(id=self.lessons[1].id).exists())
+        apply_async.assert_called_once_with((self.course.id,), countdown=settings.COURSE_NOTIFICATION_DELAY)
+
+        names = {lesson['name'] for lesson in self.client.get('/api/lessons/').data['results']}
+        self.assertIn('Переименован', names)
+        self.assertIn('Новый урок 0', names)
+
+    def test_invalid_item_rolls_back_batch(self, apply_async):
+        """Ошибка в одном элементе отклоняет весь пакет и возвращает ошибки по элементам"""
+        create = self.new_lessons(2)
+        create[1]['video_url'] = 'https://vimeo.com/1'
+        payload = {
+            'create': create,
+            'update': [{'id': self.other_lesson.id, 'name': 'Взлом'}],
+            'delete': [self.lessons[0].id, self.lessons[0].id],
+        }
+        response = self.client.post('/api/lessons/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['create'][0], {})
+        self.assertIn('video_url', response.data['create'][1])
+        self.assertIn('id', response.data['update'][0])
+        self.assertEqual(response.data['delete'][0], {})
+        self.assertIn('id', response.data['delete'][1])
+        self.assertEqual(Lesson.objects.count(), 4)
+        apply_async.assert_not_called()
+
+    def test_foreign_course(self, apply_async):
+        """Нельзя добавить урок в чужой курс или перенести урок в него"""
+        payload = {
+            'create': [{'name': 'Урок', 'course': self.other_course.id}],
+            'update': [{'id': self.lessons[0].id, 'course': self.other_course.id}],
+        }
+        response = self.client.post('/api/lessons/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('course', response.data['create'][0])
+        self.assertIn('course', response.data['update'][0])
+
+    def test_malformed_ids(self, apply_async):
+        """Id и курсы не того типа дают ошибки по элементам, а не 500; строковые id принимаются"""
+        payload = {
+            'create': [{'name': 'Урок', 'course': {}}, {'name': 'Урок', 'course': str(self.course.id)}],
+            'update': [{'id': [self.lessons[0].id]}, {'name': 'Без id'}, {'id': str(self.lessons[1].id), 'name': 'Ок'}],
+        }
+        response = self.client.post('/api/lessons/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('course', response.data['create'][0])
+        self.assertEqual(response.data['create'][1], {})
+        self.assertIn('id', response.data['update'][0])
+        self.assertIn('id', response.data['update'][1])
+        self.assertEqual(response.data['update'][2], {})
+        self.assertEqual(Lesson.objects.count(), 4)
+
+    def test_moderator_cannot_delete(self, apply_async):
+        moderator = User.objects.create(email='moderator@test.com')
+        moderator.groups.add(Group.objects.create(name='Модераторы'))
+        self.client.force_authenticate(user=moderator)
+
+        response = self.client.post('/api/lessons/bulk/', {
+            'update': [{'id': self.other_lesson.id, 'name': 'Исправлено модератором'}],
+            'delete': [self.lessons[0].id],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['update'][0], {})
+        self.assertIn('id', response.data['delete'][0])
+
+    @override_settings(LESSONS_BULK_MAX_ITEMS=3)
+    def test_max_items(self, apply_async):
+        response = self.client.post('/api/lessons/bulk/', {'create': self.new_lessons(4)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SubscriptionBatchTestCase(TestCase):
+    """Тесты пакетной подписки и списка подписок"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='student@test.com')
+        self.client.force_authenticate(user=self.user)
+        self.courses = [Course.objects.create(name=f'Курс {i}', owner=self.user) for i in range(5)]
+        self.foreign_course = Course.objects.create(name='Чужой курс', owner=User.objects.create(email='x@test.com'))
+        Subscription.objects.create(user=self.user, course=self.courses[0])
+        Subscription.objects.create(user=self.user, course=self.courses[1])
+
+    def test_batch(self):
+        ids = [course.id for course in self.courses]
+        self.client.get('/api/courses/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/subscriptions/batch/', {
+                'subscribe': [ids[0], ids[2], ids[3], self.foreign_course.id],
+                'unsubscribe': [ids[1], ids[4]],
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'subscribed': [ids[2], ids[3]],
+            'already_subscribed': [ids[0]],
+            'unsubscribed': [ids[1]],
+            'not_subscribed': [ids[4]],
+            'not_found': [self.foreign_course.id],
+        })
+        self.assertEqual(
+            set(Subscription.objects.filter(user=self.user).values_list('course_id', flat=True)),
+            {ids[0], ids[2], ids[3]},
+        )
+        inserts = [q for q in context.captured_queries if q['sql'].startswith('INSERT')]
+        deletes = [q for q in context.captured_queries if q['sql'].startswith('DELETE')]
+        self.assertEqual((len(inserts), len(deletes)), (1, 1))
+
+        courses = {course['id']: course for course in self.client.get('/api/courses/').data['results']}
+        self.assertTrue(courses[ids[2]]['is_subscribed'])
+        self.assertFalse(courses[ids[1]]['is_subscribed'])
+
+    def test_conflicting_ids(self):
+        response = self.client.post('/api/subscriptions/batch/', {
+            'subscribe': [self.courses[0].id], 'unsubscribe': [self.courses[0].id],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list(self):
+        Subscription.objects.create(user=User.objects.get(email='x@test.com'), course=self.courses[2])
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/subscriptions/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            [(item['course'], item['course_name']) for item in response.data['results']],
+            [(self.courses[0].id, 'Курс 0'), (self.courses[1].id, 'Курс 1')],
+        )
+
+
+@mock.patch('materials.services.send_course_update_notifications.apply_async')
+class CourseStatsTestCase(TestCase):
+    """Тесты инкрементальной статистики курсов"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@test.com')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='Курс', owner=self.user)
+        self.other_course = Course.objects.create(name='Другой курс', owner=self.user)
+
+    def assertStats(self, course, lessons, subscribers, payments=0, revenue=0):
+        stats = CourseStats.objects.get(course=course)
+        self.assertEqual(
+            (stats.lessons_count, stats.subscribers_count, stats.payments_count, stats.revenue),
+            (lessons, subscribers, payments, revenue),
+        )
+
+    def test_lessons_and_subscriptions(self, apply_async):
+        lesson = Lesson.objects.create(name='Урок', course=self.course, owner=self.user)
+        Lesson.objects.create(name='Урок 2', course=self.course, owner=self.user)
+        self.client.post(f'/api/courses/{self.course.id}/subscribe/')
+        self.assertStats(self.course, 2, 1)
+
+        lesson.course = self.other_course
+        lesson.save()
+        self.client.delete(f'/api/courses/{self.course.id}/unsubscribe/')
+        self.assertStats(self.course, 1, 0)
+        self.assertStats(self.other_course, 1, 0)
+
+        lesson.delete()
+        self.assertStats(self.other_course, 0, 0)
+
+    def test_payments(self, apply_async):
+        payment = Payment.objects.create(user=self.user, paid_course=self.course, amount='100.00',
+                                         payment_method='stripe', payment_status='unpaid')
+        Payment.objects.create(user=self.user, paid_course=self.course, amount='50.00', payment_method='cash')
+        self.assertStats(self.course, 0, 0, 1, 50)
+
+        payment.payment_status = 'paid'
+        payment.save()
+        self.assertStats(self.course, 0, 0, 2, 150)
+
+        payment.delete()
+        self.assertStats(self.course, 0, 0, 1, 50)
+
+    def test_bulk_endpoints(self, apply_async):
+        lessons = [Lesson.objects.create(name=f'Урок {i}', course=self.course, owner=self.user) for i in range(2)]
+        response = self.client.post('/api/lessons/bulk/', {
+            'create': [{'name': 'Новый', 'course': self.course.id}],
+            'update': [{'id': lessons[0].id, 'course': self.other_course.id}],
+            'delete': [lessons[1].id],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post('/api/subscriptions/batch/', {
+            'subscribe': [self.course.id, self.other_course.id],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.post('/api/subscriptions/batch/', {'unsubscribe': [self.other_course.id]}, format='json')
+
+        self.assertStats(self.course, 1, 1)
+        self.assertStats(self.other_course, 1, 0)
+
+    def test_batch_unsubscribe_single_update(self, apply_async):
+        """Отписка от нескольких курсов сдвигает счетчики одним UPDATE, без запроса на каждую строку"""
+        courses = [self.course, self.other_course] + [
+            Course.objects.create(name=f'Курс {i}', owner=self.user) for i in range(3)
+        ]
+        ids = [course.id for course in courses]
+        self.client.post('/api/subscriptions/batch/', {'subscribe': ids}, format='json')
+
+        with self.assertNumQueries(7) as context:
+            response = self.client.post('/api/subscriptions/batch/', {'unsubscribe': ids}, format='json')
+
+        self.assertEqual(response.data['unsubscribed'], sorted(ids))
+        updates = [q for q in context.captured_queries if q['sql'].startswith('UPDATE "materials_coursestats"')]
+        self.assertEqual(len(updates), 1)
+        for course in courses:
+            self.assertStats(course, 0, 0)
+
+    def test_course_delete_skips_row_updates(self, apply_async):
+        """Каскадное удаление курса не обновляет его статистику по каждому уроку и подписке"""
+        for i in range(3):
+            Lesson.objects.create(name=f'Урок {i}', course=self.course, owner=self.user)
+            Subscription.objects.create(user=User.objects.create(email=f'student{i}@test.com'), course=self.course)
+
+        with self.assertNumQueries(15) as context:
+            response = self.client.delete(f'/api/courses/{self.course.id}/')
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(any(q['sql'].startswith('UPDATE "materials_coursestats"') for q in context.captured_queries))
+        self.assertFalse(CourseStats.objects.filter(course_id=self.course.id).exists())
+
+    def test_partially_loaded_payment_moved(self, apply_async):
+        """Платеж без загруженных полей вклада пересчитывает и прежний, и новый курс"""
+        payment = Payment.objects.create(user=self.user, paid_course=self.course, amount='30.00', payment_method='cash')
+        payment = Payment.objects.only('id').get(pk=payment.pk)
+
+        payment.paid_course = self.other_course
+        payment.save()
+
+        self.assertStats(self.course, 0, 0)
+        self.assertStats(self.other_course, 0, 0, 1, 30)
+
+    def test_rebuild(self, apply_async):
+        Lesson.objects.create(name='Урок', course=self.course, owner=self.user)
+        Payment.objects.create(user=self.user, paid_course=self.course, amount='10.00', payment_method='transfer')
+        CourseStats.objects.update(lessons_count=99, revenue=0)
+        [missing] = Course.objects.bulk_create([Course(name='Без статистики', owner=self.user)])
+
+        self.assertEqual(rebuild_course_stats(batch_size=2), 3)
+        self.assertStats(self.course, 1, 0, 1, 10)
+        self.assertStats(self.other_course, 0, 0)
+        self.assertStats(missing, 0, 0)
+
+        out = io.StringIO()
+        call_command('rebuild_course_stats', course=[self.course.id], stdout=out)
+        self.assertIn('Пересчитана статистика курсов: 1', out.getvalue())
+
+
+class SearchTestCase(TestCase):
+    """Тесты поиска курсов и уроков"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@test.com')
+        self.other = User.objects.create(email='other@test.com')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='Основы программирования', description='Циклы и функции',
+                                            owner=self.user)
+        self.described = Course.objects.create(name='Алгоритмы', description='Задачи по программированию',
+                                               owner=self.user)
+        self.foreign = Course.objects.create(name='Программирование для всех', owner=self.other)
+        self.lesson = Lesson.objects.create(name='Функции', description='Аргументы функций', course=self.course,
+                                            owner=self.user)
+
+    def search(self, **params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def test_ranking_and_visibility(self):
+        data = self.search(q='программирование')
+        self.assertEqual([course['id'] for course in data['courses']], [self.course.id, self.described.id])
+        self.assertGreater(data['courses'][0]['rank'], data['courses'][1]['rank'])
+        self.assertEqual(data['lessons'], [])
+
+        moderator = User.objects.create(email='moderator@test.com')
+        moderator.groups.add(Group.objects.create(name='Модераторы'))
+        self.client.force_authenticate(user=moderator)
+        self.assertIn(self.foreign.id, [course['id'] for course in self.search(q='программирование')['courses']])
+
+    def test_type_and_validation(self):
+        data = self.search(q='функция', type='lessons')
+        self.assertEqual(list(data), ['lessons'])
+        self.assertEqual([lesson['id'] for lesson in data['lessons']], [self.lesson.id])
+        self.assertNotIn('search_vector', self.client.get(f'/api/lessons/{self.lesson.id}/').data)
+
+        response = self.client.get('/api/search/', {'q': 'а'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_vector_follows_updates(self):
+        Lesson.objects.bulk_create([Lesson(name='Рекурсия', course=self.course, owner=self.user)])
+        self.lesson.description = 'Замыкания'
+        self.lesson.save()
+
+        self.assertEqual(len(self.search(q='рекурсия', type='lessons')['lessons']), 1)
+        self.assertEqual(self.search(q='замыкание', type='lessons')['lessons'][0]['id'], self.lesson.id)
+        self.assertEqual(self.search(q='аргументы', type='lessons')['lessons'], [])
+
+    def test_uses_gin_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Lesson.objects.filter(search_vector=SearchQuery('функция', config=SEARCH_CONFIG)).order_by().explain()
+        self.assertIn('lesson_search_idx', plan, plan)
+
+    @override_settings(SEARCH_RANK_CANDIDATES=1)
+    def test_rank_candidates_limit(self):
+        self.assertEqual(len(self.search(q='программирование', type='courses')['courses']), 1)
+
+    def test_trigram_fallback(self):
+        if not trigram_available():
+            self.skipTest('Расширение pg_trgm не установлено')
+        data = self.search(q='програмирования', type='courses')
+        self.assertEqual(data['courses'][0]['id'], self.course.id)
+
+
+class SparseFieldsetTestCase(TestCase):
+    """Тесты ?fields= и ?omit= для курсов и уроков"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='owner@test.com')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='Курс', description='Описание', owner=self.user)
+        self.lesson = Lesson.objects.create(name='Урок', description='Описание урока', course=self.course,
+                                            owner=self.user)
+        Subscription.objects.create(user=self.user, course=self.course)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        # Запросы групп пользователя и владельца для проверки прав от полей не зависят
+        return response.data, [query['sql'] for query in context.captured_queries if 'materials_' in query['sql']]
+
+    def test_course_fields(self):
+        data, queries = self.get('/api/courses/', fields='id,name,unknown')
+        self.assertEqual(data['results'], [{'id': self.course.id, 'name': 'Курс'}])
+        # COUNT и сами курсы: без prefetch уроков, подзапроса подписки, CourseStats и лишних колонок
+        self.assertEqual(len(queries), 2, queries)
+        for fragment in ['materials_subscription', 'materials_coursestats', 'description', 'search_vector']:
+            self.assertNotIn(fragment, queries[-1])
+
+    def test_course_omit(self):
+        data, queries = self.get(f'/api/courses/{self.course.id}/', omit='lessons,description')
+        self.assertNotIn('lessons', data)
+        self.assertNotIn('description', data)
+        self.assertEqual((data['lessons_count'], data['subscribers_count'], data['is_subscribed']), (1, 1, True))
+        self.assertEqual(len(queries), 1, queries)
+
+    def test_lesson_fields(self):
+        data, queries = self.get('/api/lessons/', fields='id,name')
+        self.assertEqual(data['results'], [{'id': self.lesson.id, 'name': 'Урок'}])
+        self.assertNotIn('description', queries[-1])
+
+        data, _ = self.get(f'/api/lessons/{self.lesson.id}/', omit='description', fields='')
+        self.assertNotIn('description', data)
+        self.assertEqual(data['course'], self.course.id)
+
+    def test_nested_and_write_keep_all_fields(self):
+        data, _ = self.get('/api/courses/', fields='id,lessons')
+        self.assertIn('description', data['results'][0]['lessons'][0])
+
+        response = self.client.patch(f'/api/courses/{self.course.id}/?fields=id', {'name': 'Новое название'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Новое название')
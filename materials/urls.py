@@ -1,12 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from materials.views import CourseViewSet, LessonListCreateView, LessonRetrieveUpdateDestroyView
+from materials.views import (
+    CourseViewSet, LessonBulkView, LessonListCreateView, LessonRetrieveUpdateDestroyView, SearchView,
+    SubscriptionViewSet,
+)
 
 router = DefaultRouter()
 router.register(r'courses', CourseViewSet, basename='course')
+router.register(r'subscriptions', SubscriptionViewSet, basename='subscription')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('lessons/', LessonListCreateView.as_view(), name='lesson-list-create'),
+    path('lessons/bulk/', LessonBulkView.as_view(), name='lesson-bulk'),
     path('lessons/<int:pk>/', LessonRetrieveUpdateDestroyView.as_view(), name='lesson-detail'),
+    path('search/', SearchView.as_view(), name='search'),
 ] 
@@ -1,29 +1,45 @@
-from datetime import timedelta
-
-from django.utils import timezone
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
+from rest_framework.mixins import ListModelMixin
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+from materials.cache import CachedResponseMixin
+from materials.fieldsets import SparseFieldsetMixin
 from materials.models import Course, Lesson, Subscription
-from materials.serializers import CourseSerializer, LessonSerializer
+from materials.search import search
+from materials.serializers import (
+    CourseSearchSerializer, CourseSerializer, LessonBulkSerializer, LessonSearchSerializer, LessonSerializer,
+    SearchQuerySerializer, SubscriptionBatchSerializer, SubscriptionSerializer,
+)
 from materials.permissions import IsOwnerOrModerator, IsOwnerOrModeratorReadOnly
 from materials.paginators import CourseLessonPagination
-from materials.tasks import send_course_update_notifications
+from materials.services import apply_subscription_batch, schedule_course_update_notification
+from users.roles import is_moderator
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(SparseFieldsetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrModerator]
     pagination_class = CourseLessonPagination
+    response_cache_per_user = True
 
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='Модераторы').exists():
-            return Course.objects.all()
-        return Course.objects.filter(owner=user)
+        if is_moderator(self.request):
+            queryset = Course.objects.all()
+        else:
+            queryset = Course.objects.filter(owner=user)
+        if self.action in ['list', 'retrieve', 'update', 'partial_update']:
+            queryset = queryset.with_lessons_info(
+                user,
+                lessons=self.wants_field('lessons'),
+                stats=self.wants_field('lessons_count') or self.wants_field('subscribers_count'),
+                is_subscribed=self.wants_field('is_subscribed'),
+            )
+        return queryset.defer(*self.get_deferred_fields(Course))
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -34,14 +50,8 @@ class CourseViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user)
 
     def perform_update(self, serializer):
-        course = self.get_object()
-        previous_update = course.last_update
-        now = timezone.now()
-
-        serializer.save()
-
-        if not previous_update or (now - previous_update) >= timedelta(hours=4):
-            send_course_update_notifications.delay(course.id)
+        course = serializer.save()
+        schedule_course_update_notification(course.id)
 
     @action(detail=True, methods=['post'], url_path='subscribe')
     def subscribe(self, request, pk=None):
@@ -70,7 +80,7 @@ class CourseViewSet(viewsets.ModelViewSet):
         return Response({'message': 'Вы не подписаны на этот курс'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class LessonListCreateView(ListCreateAPIView):
+class LessonListCreateView(SparseFieldsetMixin, CachedResponseMixin, ListCreateAPIView):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrModeratorReadOnly]
@@ -78,34 +88,103 @@ class LessonListCreateView(ListCreateAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='Модераторы').exists():
-            return Lesson.objects.all()
-        return Lesson.objects.filter(owner=user)
+        if is_moderator(self.request):
+            queryset = Lesson.objects.all()
+        else:
+            queryset = Lesson.objects.filter(owner=user)
+        return queryset.defer(*self.get_deferred_fields(Lesson))
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
 
-class LessonRetrieveUpdateDestroyView(RetrieveUpdateDestroyAPIView):
+class LessonRetrieveUpdateDestroyView(SparseFieldsetMixin, CachedResponseMixin, RetrieveUpdateDestroyAPIView):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrModeratorReadOnly]
 
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='Модераторы').exists():
-            return Lesson.objects.all()
-        return Lesson.objects.filter(owner=user)
+        if is_moderator(self.request):
+            queryset = Lesson.objects.all()
+        else:
+            queryset = Lesson.objects.filter(owner=user)
+        return queryset.defer(*self.get_deferred_fields(Lesson))
 
     def perform_update(self, serializer):
-        lesson = self.get_object()
-        course = lesson.course
-        previous_update = course.last_update
-        now = timezone.now()
+        lesson = serializer.save()
+        schedule_course_update_notification(lesson.course_id)
+
+
+class LessonBulkView(APIView):
+    """Пакетное создание, изменение и удаление уроков: {"create": [...], "update": [...], "delete": [...]}"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = LessonBulkSerializer
+
+    def get_queryset(self):
+        if is_moderator(self.request):
+            return Lesson.objects.all()
+        return Lesson.objects.filter(owner=self.request.user)
+
+    def post(self, request):
+        serializer = LessonBulkSerializer(
+            data=request.data, context={'request': request, 'lessons': self.get_queryset()}
+        )
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_200_OK)
+
+
+class SubscriptionViewSet(ListModelMixin, viewsets.GenericViewSet):
+    """Подписки текущего пользователя и пакетная подписка/отписка"""
+    serializer_class = SubscriptionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CourseLessonPagination
+
+    def get_queryset(self):
+        return Subscription.objects.filter(user=self.request.user).select_related('course').order_by('id')
+
+    def get_serializer_class(self):
+        if self.action == 'batch':
+            return SubscriptionBatchSerializer
+        return SubscriptionSerializer
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Те же курсы, что доступны в CourseViewSet.subscribe/unsubscribe
+        if is_moderator(request):
+            courses = Course.objects.all()
+        else:
+            courses = Course.objects.filter(owner=request.user)
+        result = apply_subscription_batch(
+            request.user, courses, serializer.validated_data['subscribe'], serializer.validated_data['unsubscribe']
+        )
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class SearchView(APIView):
+    """
+    Поиск курсов и уроков: ?q=строка&type=all|courses|lessons.
+
+    Видны те же курсы и уроки, что в списках: модератору все, остальным свои.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        text, search_type = query.validated_data['q'], query.validated_data['type']
+
+        if is_moderator(request):
+            courses, lessons = Course.objects.all(), Lesson.objects.all()
+        else:
+            courses, lessons = Course.objects.filter(owner=request.user), Lesson.objects.filter(owner=request.user)
 
-        serializer.save()
+        data = {}
+        if search_type in ['all', 'courses']:
+            data['courses'] = CourseSearchSerializer(search(courses, text), many=True).data
+        if search_type in ['all', 'lessons']:
+            data['lessons'] = LessonSearchSerializer(search(lessons, text), many=True).data
+        return Response(data)
 
-        if not previous_update or (now - previous_update) >= timedelta(hours=4):
-            course.last_update = now
-            course.save(update_fields=['last_update'])
-            send_course_update_notifications.delay(course.id)
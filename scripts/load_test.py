@@ -0,0 +1,66 @@
+"""
+Простой нагрузочный тест API: N конкурентных клиентов в течение заданного времени.
+
+    python scripts/load_test.py http://localhost:8000/api/courses/ --token <JWT> --concurrency 32 --duration 30
+
+Печатает RPS, перцентили времени ответа и число ошибок. Используется для сравнения
+runserver и gunicorn (см. README).
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+
+async def worker(client, urls, deadline, timings, errors):
+    i = 0
+    while time.perf_counter() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = await client.get(url)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        timings.append(time.perf_counter() - started)
+
+
+async def run(urls, token, concurrency, duration):
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    timings, errors = [], []
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(worker(client, urls, deadline, timings, errors) for _ in range(concurrency)))
+    return timings, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--token', help='JWT access-токен')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    timings, errors = asyncio.run(run(args.urls, args.token, args.concurrency, args.duration))
+    if len(timings) < 2:
+        raise SystemExit(f'Недостаточно успешных ответов, ошибок: {len(errors)}')
+    percentiles = statistics.quantiles(timings, n=100)
+    print(f'запросов: {len(timings)}, ошибок: {len(errors)}, RPS: {len(timings) / args.duration:.1f}')
+    if errors:
+        print('ошибки:', ', '.join(f'{error} x{count}' for error, count in Counter(errors).most_common()))
+    print(f'p50: {percentiles[49] * 1000:.1f} ms, p95: {percentiles[94] * 1000:.1f} ms, '
+          f'p99: {percentiles[98] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DateField, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, Trunc, TruncDate
+from django.utils import timezone
+
+from materials.stats import PAID_PAYMENTS
+from users.models import Payment, PaymentDailyRollup, PaymentRollupWatermark
+
+ANALYTICS_PERIODS = ['day', 'week', 'month']
+ANALYTICS_GROUPS = {
+    'course': 'paid_course',
+    'lesson': 'paid_lesson',
+    'method': 'payment_method',
+    'status': 'payment_status',
+}
+
+
+def _day_ranges(days):
+    """Склеивает даты в непрерывные диапазоны [(первый день, последний день), ...]"""
+    ranges = []
+    for day in sorted(days):
+        if ranges and ranges[-1][1] + timedelta(days=1) == day:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return ranges
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _replace_rollups(rollups, payments):
+    """Заменяет строки rollups итогами, посчитанными одной группировкой по payments"""
+    rows = (
+        payments.order_by()
+        .annotate(date=TruncDate('payment_date'))
+        .values('date', 'paid_course_id', 'paid_lesson_id', 'payment_method', 'payment_status')
+        .annotate(payments_count=Count('id'), amount=Sum('amount'))
+    )
+    batch_size = settings.PAYMENT_ROLLUP_BATCH_SIZE
+    rows = rows.iterator(chunk_size=batch_size)
+    rollups.delete()
+    created = 0
+    while batch := [PaymentDailyRollup(**row) for row in islice(rows, batch_size)]:
+        PaymentDailyRollup.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def recompute_payment_rollups(days):
+    """Пересчитывает итоги за дни days по диапазонам payment_date, без сканирования остальных платежей"""
+    if not days:
+        return 0
+    payments_filter = Q()
+    for first, last in _day_ranges(days):
+        payments_filter |= Q(
+            payment_date__gte=_start_of_day(first), payment_date__lt=_start_of_day(last + timedelta(days=1)),
+        )
+    return _replace_rollups(
+        PaymentDailyRollup.objects.filter(date__in=days), Payment.objects.filter(payments_filter),
+    )
+
+
+def update_payment_rollups(window_days=None):
+    """
+    Дополняет суточные итоги платежами, появившимися после отметки PaymentRollupWatermark.
+
+    Пересчитываются только дни, в которые попали новые платежи (id больше отметки), и
+    последние window_days дней (PAYMENT_ROLLUP_WINDOW_DAYS): в этом окне меняются статусы
+    Stripe-платежей и могут закоммититься транзакции с id меньше отметки. Отметка
+    блокируется на время пересчета, поэтому параллельные запуски не пересекаются.
+    Возвращает число пересчитанных дней.
+    """
+    if window_days is None:
+        window_days = settings.PAYMENT_ROLLUP_WINDOW_DAYS
+    with transaction.atomic():
+        PaymentRollupWatermark.objects.get_or_create(pk=1)
+        watermark = PaymentRollupWatermark.objects.select_for_update().get(pk=1)
+        last_payment_id = Payment.objects.aggregate(last_id=Max('id'))['last_id'] or watermark.last_payment_id
+
+        days = set(
+            Payment.objects.filter(id__gt=watermark.last_payment_id, id__lte=last_payment_id)
+            .order_by()
+            .annotate(date=TruncDate('payment_date'))
+            .values_list('date', flat=True)
+            .distinct()
+        )
+        today = timezone.localdate()
+        days.update(today - timedelta(days=offset) for offset in range(window_days))
+        recompute_payment_rollups(days)
+
+        watermark.last_payment_id = last_payment_id
+        watermark.updated_at = timezone.now()
+        watermark.save()
+    return len(days)
+
+
+def rebuild_payment_rollups():
+    """Пересчитывает все суточные итоги с нуля, например после удаления или правки старых платежей"""
+    with transaction.atomic():
+        PaymentRollupWatermark.objects.get_or_create(pk=1)
+        watermark = PaymentRollupWatermark.objects.select_for_update().get(pk=1)
+        last_payment_id = Payment.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        created = _replace_rollups(PaymentDailyRollup.objects.all(), Payment.objects.filter(id__lte=last_payment_id))
+        watermark.last_payment_id = last_payment_id
+        watermark.updated_at = timezone.now()
+        watermark.save()
+    return created
+
+
+def payment_analytics(period='day', group_by=(), **filters):
+    """
+    Выручка и число платежей по периодам (day, week, month) и, при необходимости, по курсу,
+    уроку, способу и статусу оплаты (ANALYTICS_GROUPS). Считается по PaymentDailyRollup.
+
+    amount — сумма всех платежей группы, revenue — только оплаченных (materials.stats.PAID_PAYMENTS).
+    """
+    fields = [ANALYTICS_GROUPS[name] for name in group_by]
+    return list(
+        PaymentDailyRollup.objects.filter(**filters)
+        .annotate(period=Trunc('date', period, output_field=DateField()))
+        .values('period', *fields)
+        # revenue объявлена раньше amount: после аннотации amount имя ссылалось бы на агрегат, а не на поле
+        .annotate(revenue=Coalesce(Sum('amount', filter=PAID_PAYMENTS), Value(Decimal('0.00'))))
+        .annotate(payments_count=Sum('payments_count'), amount=Sum('amount'))
+        .order_by('period', *fields)
+    )
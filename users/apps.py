@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'users' 
+    name = 'users'
+
+    def ready(self):
+        import users.signals  # noqa: F401
@@ -0,0 +1,102 @@
+"""Имитация Stripe API для тестов и замеров эндпоинтов оплаты без обращения к сети"""
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+def sign_webhook_payload(payload, secret, timestamp=None):
+    """Заголовок Stripe-Signature для тела вебхука, подписанного секретом secret"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class FakeStripeServer:
+    """Локальный HTTP-сервер, отвечающий как Stripe API на используемые проектом вызовы."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = []
+        self.sessions = {}
+        self.payment_status = 'unpaid'
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.respond(None)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.respond(parse_qs(self.rfile.read(length).decode()))
+
+            def respond(self, params):
+                server.requests.append((self.command, self.path, params))
+                time.sleep(server.delay)
+                body = json.dumps(server.handle(self.command, self.path, params)).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except BrokenPipeError:
+                    pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def handle(self, method, path, params):
+        number = len(self.requests)
+        path, _, query = path.partition('?')
+        if path == '/v1/products':
+            return {'id': f'prod_{number}', 'object': 'product', 'name': params['name'][0]}
+        if path.startswith('/v1/products/'):
+            return {'id': path.rsplit('/', 1)[1], 'object': 'product', 'name': params['name'][0]}
+        if path == '/v1/prices':
+            return {'id': f'price_{number}', 'object': 'price', 'unit_amount': int(params['unit_amount'][0])}
+        if path == '/v1/checkout/sessions' and method == 'GET':
+            query = parse_qs(query)
+            session_ids = list(self.sessions)
+            if 'starting_after' in query:
+                session_ids = session_ids[session_ids.index(query['starting_after'][0]) + 1:]
+            limit = int(query.get('limit', ['10'])[0])
+            return {
+                'object': 'list',
+                'url': '/v1/checkout/sessions',
+                'has_more': len(session_ids) > limit,
+                'data': [self.session(session_id) for session_id in session_ids[:limit]],
+            }
+        if path == '/v1/checkout/sessions':
+            session_id = f'cs_{number}'
+            self.sessions[session_id] = self.payment_status
+            return self.session(session_id)
+        if path.startswith('/v1/checkout/sessions/'):
+            return self.session(path.rsplit('/', 1)[1])
+        return {}
+
+    def session(self, session_id):
+        return {
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f'https://checkout.stripe.test/{session_id}',
+            'payment_status': self.sessions[session_id],
+            'status': 'open',
+        }
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 from users.models import User, Payment
 from materials.models import Course, Lesson
+from materials.stats import rebuild_course_stats
 from decimal import Decimal
 import random
 
@@ -9,47 +9,42 @@ import random
 class Command(BaseCommand):
     help = 'Создает тестовые платежи'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help='Для скольких пользователей создать платежи')
+
     def handle(self, *args, **options):
-        users = User.objects.all()
-        courses = Course.objects.all()
-        lessons = Lesson.objects.all()
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:options['users']])
+        course_ids = list(Course.objects.values_list('id', flat=True))
+        lesson_ids = list(Lesson.objects.values_list('id', flat=True))
 
-        if not users.exists():
+        if not user_ids:
             self.stdout.write(self.style.WARNING('Нет пользователей. Создайте пользователей сначала.'))
             return
 
-        if not courses.exists() and not lessons.exists():
+        if not course_ids and not lesson_ids:
             self.stdout.write(self.style.WARNING('Нет курсов и уроков. Создайте их сначала.'))
             return
 
         payment_methods = ['cash', 'transfer']
         amounts = [Decimal('1000.00'), Decimal('2000.00'), Decimal('3000.00'), Decimal('5000.00'), Decimal('1500.00')]
 
-        payments_created = 0
+        payments = []
 
-        for user in users[:5]:
+        for user_id in user_ids:
             for _ in range(random.randint(2, 5)):
-                if courses.exists() and random.choice([True, False]):
-                    course = random.choice(courses)
-                    Payment.objects.create(
-                        user=user,
-                        payment_date=timezone.now(),
-                        paid_course=course,
-                        paid_lesson=None,
-                        amount=random.choice(amounts),
-                        payment_method=random.choice(payment_methods)
-                    )
-                    payments_created += 1
-                elif lessons.exists():
-                    lesson = random.choice(lessons)
-                    Payment.objects.create(
-                        user=user,
-                        payment_date=timezone.now(),
-                        paid_course=None,
-                        paid_lesson=lesson,
-                        amount=random.choice(amounts),
-                        payment_method=random.choice(payment_methods)
-                    )
-                    payments_created += 1
-
-        self.stdout.write(self.style.SUCCESS(f'Успешно создано {payments_created} платежей'))
\ No newline at end of file
+                if course_ids and (not lesson_ids or random.choice([True, False])):
+                    paid_course_id, paid_lesson_id = random.choice(course_ids), None
+                else:
+                    paid_course_id, paid_lesson_id = None, random.choice(lesson_ids)
+                payments.append(Payment(
+                    user_id=user_id,
+                    paid_course_id=paid_course_id,
+                    paid_lesson_id=paid_lesson_id,
+                    amount=random.choice(amounts),
+                    payment_method=random.choice(payment_methods)
+                ))
+
+        Payment.objects.bulk_create(payments, batch_size=1000)
+        rebuild_course_stats({payment.paid_course_id for payment in payments if payment.paid_course_id})
+
+        self.stdout.write(self.style.SUCCESS(f'Успешно создано {len(payments)} платежей'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from users.exports import EXPORT_CONTENT_TYPES, iter_payments_export
+from users.models import Payment
+
+
+class Command(BaseCommand):
+    help = 'Выгружает платежи в CSV или NDJSON потоком, не загружая их в память'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=list(EXPORT_CONTENT_TYPES), default='csv')
+        parser.add_argument('--file', help='Путь к файлу; по умолчанию — стандартный вывод')
+        parser.add_argument('--paid-course', type=int)
+        parser.add_argument('--paid-lesson', type=int)
+        parser.add_argument('--payment-method', choices=[method for method, _ in Payment.PAYMENT_METHOD_CHOICES])
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        # Те же фильтры, что у PaymentViewSet.filterset_fields, и та же сортировка по умолчанию
+        filters = {
+            field: options[field] for field in ['paid_course', 'paid_lesson', 'payment_method']
+            if options[field] is not None
+        }
+        queryset = Payment.objects.filter(**filters).order_by('-payment_date')
+        chunks = iter_payments_export(queryset, options['output'], options['chunk_size'])
+
+        if options['file']:
+            with open(options['file'], 'w', encoding='utf-8', newline='') as f:
+                f.writelines(chunks)
+        else:
+            self.stdout.ending = ''
+            for chunk in chunks:
+                self.stdout.write(chunk)
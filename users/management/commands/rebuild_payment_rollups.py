@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.analytics import rebuild_payment_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает суточные итоги платежей (PaymentDailyRollup) по всем платежам'
+
+    def handle(self, *args, **options):
+        created = rebuild_payment_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Создано строк суточных итогов: {created}'))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import User
+from users.seeding import SEED_BATCH_SIZE, SEED_PASSWORD, seed_data
+
+
+class Command(BaseCommand):
+    help = 'Генерирует большой синтетический набор данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--courses', type=int, default=100)
+        parser.add_argument('--lessons-per-course', type=int, default=10)
+        parser.add_argument('--subscriptions-per-user', type=int, default=3)
+        parser.add_argument('--payments-per-user', type=int, default=2)
+        parser.add_argument('--days', type=int, default=365, help='За сколько последних дней распределить платежи')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(email__startswith=f'seed{options["seed"]}-').exists():
+            raise CommandError(f'Данные с seed={options["seed"]} уже загружены, укажите другой --seed')
+
+        def progress(model, count):
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {count}')
+
+        started = time.perf_counter()
+        counts = seed_data(
+            users=options['users'],
+            courses=options['courses'],
+            lessons_per_course=options['lessons_per_course'],
+            subscriptions_per_user=options['subscriptions_per_user'],
+            payments_per_user=options['payments_per_user'],
+            seed=options['seed'],
+            days=options['days'],
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+        summary = ', '.join(f'{name}: {count}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано за {time.perf_counter() - started:.1f} с — {summary}. Пароль пользователей: {SEED_PASSWORD}'
+        ))
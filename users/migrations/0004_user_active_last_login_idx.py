@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0003_payment_payment_status_payment_payment_url_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['last_login'], name='user_active_last_login_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:39
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0005_stripeprice'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['payment_method', '-payment_date'], name='payment_method_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['paid_course', '-payment_date'], name='payment_course_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['paid_lesson', '-payment_date'], name='payment_lesson_date_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 6.0.2 on 2026-10-18 11:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0008_coursestats'),
+        ('users', '0006_payment_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('payment_method', models.CharField(choices=[('cash', 'Наличные'), ('transfer', 'Перевод на счет'), ('stripe', 'Stripe')], max_length=10, verbose_name='Способ оплаты')),
+                ('payment_status', models.CharField(blank=True, max_length=50, null=True, verbose_name='Статус оплаты')),
+                ('payments_count', models.IntegerField(verbose_name='Количество платежей')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Сумма')),
+            ],
+            options={
+                'verbose_name': 'Суточные итоги платежей',
+                'verbose_name_plural': 'Суточные итоги платежей',
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentRollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_payment_id', models.BigIntegerField(default=0, verbose_name='ID последнего учтенного платежа')),
+                ('updated_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата обновления итогов')),
+            ],
+            options={
+                'verbose_name': 'Отметка обработки платежей',
+                'verbose_name_plural': 'Отметки обработки платежей',
+            },
+        ),
+        migrations.AddField(
+            model_name='paymentdailyrollup',
+            name='paid_course',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_rollups', to='materials.course', verbose_name='Оплаченный курс'),
+        ),
+        migrations.AddField(
+            model_name='paymentdailyrollup',
+            name='paid_lesson',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_rollups', to='materials.lesson', verbose_name='Оплаченный урок'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentdailyrollup',
+            index=models.Index(fields=['date'], name='payment_rollup_date_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Одиночные индексы ForeignKey, которые покрывают payment_course_date_idx и
+# payment_lesson_date_idx; удаляются без блокировки таблицы, как в materials 0011
+REDUNDANT_FK_INDEXES = [
+    ('users_payment_paid_course_id_10e91062', 'users_payment', 'paid_course_id'),
+    ('users_payment_paid_lesson_id_f5fbfa03', 'users_payment', 'paid_lesson_id'),
+]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('materials', '0011_drop_redundant_fk_indexes'),
+        ('users', '0008_payment_date_idx'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    f'DROP INDEX CONCURRENTLY IF EXISTS {name}',
+                    reverse_sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column})',
+                )
+                for name, table, column in REDUNDANT_FK_INDEXES
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='payment',
+                    name='paid_course',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='materials.course', verbose_name='Оплаченный курс'),
+                ),
+                migrations.AlterField(
+                    model_name='payment',
+                    name='paid_lesson',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='materials.lesson', verbose_name='Оплаченный урок'),
+                ),
+            ],
+        ),
+    ]
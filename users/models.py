@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Q
 from django.core.exceptions import ValidationError
 
 
@@ -16,6 +17,9 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            models.Index(fields=['last_login'], condition=Q(is_active=True), name='user_active_last_login_idx'),
+        ]
 
 
 class Payment(models.Model):
@@ -27,8 +31,9 @@ class Payment(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payments', verbose_name='Пользователь')
     payment_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата оплаты')
-    paid_course = models.ForeignKey('materials.Course', on_delete=models.SET_NULL, null=True, blank=True, related_name='payments', verbose_name='Оплаченный курс')
-    paid_lesson = models.ForeignKey('materials.Lesson', on_delete=models.SET_NULL, null=True, blank=True, related_name='payments', verbose_name='Оплаченный урок')
+    # Одиночные индексы FK покрываются payment_course_date_idx и payment_lesson_date_idx
+    paid_course = models.ForeignKey('materials.Course', on_delete=models.SET_NULL, null=True, blank=True, related_name='payments', verbose_name='Оплаченный курс', db_index=False)
+    paid_lesson = models.ForeignKey('materials.Lesson', on_delete=models.SET_NULL, null=True, blank=True, related_name='payments', verbose_name='Оплаченный урок', db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Сумма оплаты')
     payment_method = models.CharField(max_length=10, choices=PAYMENT_METHOD_CHOICES, verbose_name='Способ оплаты')
     stripe_product_id = models.CharField(max_length=255, blank=True, null=True, verbose_name='ID продукта в Stripe')
@@ -41,6 +46,12 @@ class Payment(models.Model):
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
         ordering = ['-payment_date']
+        indexes = [
+            models.Index(fields=['payment_method', '-payment_date'], name='payment_method_date_idx'),
+            models.Index(fields=['paid_course', '-payment_date'], name='payment_course_date_idx'),
+            models.Index(fields=['paid_lesson', '-payment_date'], name='payment_lesson_date_idx'),
+            models.Index(fields=['payment_date'], name='payment_date_idx'),
+        ]
 
     def clean(self):
         if not self.paid_course and not self.paid_lesson:
@@ -51,4 +62,59 @@ class Payment(models.Model):
     def __str__(self):
         if self.paid_course:
             return f'{self.user.email} - {self.paid_course.name} - {self.amount}'
-        return f'{self.user.email} - {self.paid_lesson.name} - {self.amount}' 
+        return f'{self.user.email} - {self.paid_lesson.name} - {self.amount}'
+
+
+class PaymentDailyRollup(models.Model):
+    """Суточные итоги платежей в разрезе курса, урока, способа и статуса оплаты для аналитики."""
+    date = models.DateField(verbose_name='Дата')
+    paid_course = models.ForeignKey('materials.Course', on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_rollups', verbose_name='Оплаченный курс')
+    paid_lesson = models.ForeignKey('materials.Lesson', on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_rollups', verbose_name='Оплаченный урок')
+    payment_method = models.CharField(max_length=10, choices=Payment.PAYMENT_METHOD_CHOICES, verbose_name='Способ оплаты')
+    payment_status = models.CharField(max_length=50, blank=True, null=True, verbose_name='Статус оплаты')
+    payments_count = models.IntegerField(verbose_name='Количество платежей')
+    amount = models.DecimalField(max_digits=14, decimal_places=2, verbose_name='Сумма')
+
+    class Meta:
+        verbose_name = 'Суточные итоги платежей'
+        verbose_name_plural = 'Суточные итоги платежей'
+        indexes = [
+            models.Index(fields=['date'], name='payment_rollup_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} - {self.payment_method} - {self.amount}'
+
+
+class PaymentRollupWatermark(models.Model):
+    """Последний платеж, учтенный в PaymentDailyRollup; в таблице одна строка."""
+    last_payment_id = models.BigIntegerField(default=0, verbose_name='ID последнего учтенного платежа')
+    updated_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата обновления итогов')
+
+    class Meta:
+        verbose_name = 'Отметка обработки платежей'
+        verbose_name_plural = 'Отметки обработки платежей'
+
+    def __str__(self):
+        return f'Платежи до {self.last_payment_id}'
+
+
+class StripePrice(models.Model):
+    """Продукт и цена в Stripe, созданные один раз для курса или урока по конкретной цене."""
+    course = models.ForeignKey('materials.Course', on_delete=models.CASCADE, null=True, blank=True, related_name='stripe_prices', verbose_name='Курс')
+    lesson = models.ForeignKey('materials.Lesson', on_delete=models.CASCADE, null=True, blank=True, related_name='stripe_prices', verbose_name='Урок')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена')
+    stripe_product_id = models.CharField(max_length=255, verbose_name='ID продукта в Stripe')
+    stripe_price_id = models.CharField(max_length=255, verbose_name='ID цены в Stripe')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Цена в Stripe'
+        verbose_name_plural = 'Цены в Stripe'
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'amount'], condition=Q(course__isnull=False), name='unique_stripe_price_course_amount'),
+            models.UniqueConstraint(fields=['lesson', 'amount'], condition=Q(lesson__isnull=False), name='unique_stripe_price_lesson_amount'),
+        ]
+
+    def __str__(self):
+        return f'{self.stripe_price_id} - {self.amount}'
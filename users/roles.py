@@ -0,0 +1,46 @@
+from django.core.cache import cache
+
+MODERATORS_GROUP = 'Модераторы'
+
+GROUPS_CACHE_KEY = 'users:groups:{user_id}'
+GROUPS_CACHE_TIMEOUT = 60 * 60
+
+
+def _groups_cache_key(user_id):
+    return GROUPS_CACHE_KEY.format(user_id=user_id)
+
+
+def get_user_groups(user):
+    """
+    Возвращает множество названий групп пользователя.
+
+    Результат кешируется между запросами и сбрасывается сигналами
+    при изменении состава групп (см. users.signals).
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    key = _groups_cache_key(user.pk)
+    groups = cache.get(key)
+    if groups is None:
+        groups = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(key, groups, GROUPS_CACHE_TIMEOUT)
+    return groups
+
+
+def invalidate_user_groups(user_ids):
+    keys = [_groups_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def is_moderator(request):
+    """
+    Проверяет, состоит ли автор запроса в группе модераторов.
+
+    Значение вычисляется один раз и запоминается на объекте запроса,
+    поэтому повторные вызовы из get_queryset и permissions не обращаются ни к кешу, ни к БД.
+    """
+    if not hasattr(request, '_is_moderator'):
+        request._is_moderator = MODERATORS_GROUP in get_user_groups(request.user)
+    return request._is_moderator
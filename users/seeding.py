@@ -0,0 +1,128 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db.models import DurationField, ExpressionWrapper, F, Value
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from materials.models import Course, Lesson, Subscription
+from materials.stats import rebuild_course_stats
+from users.models import Payment, User
+
+SEED_PASSWORD = 'password'
+SEED_BATCH_SIZE = 5000
+
+PAYMENT_AMOUNTS = [Decimal('1000.00'), Decimal('1500.00'), Decimal('2000.00'), Decimal('3000.00'), Decimal('5000.00')]
+PAYMENT_STATUSES = ['paid', 'paid', 'paid', 'unpaid', 'expired']
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _bulk_create(model, objects, batch_size, progress=None):
+    """Вставляет объекты пачками, не держа в памяти больше одной пачки, и возвращает их id"""
+    ids = []
+    for batch in _batched(objects, batch_size):
+        ids.extend(obj.pk for obj in model.objects.bulk_create(batch))
+        if progress:
+            progress(model, len(ids))
+    return ids
+
+
+def seed_data(users=1000, courses=100, lessons_per_course=10, subscriptions_per_user=3, payments_per_user=2,
+              seed=0, days=365, batch_size=SEED_BATCH_SIZE, prefix='seed', progress=None):
+    """
+    Генерирует синтетический набор пользователей, курсов, уроков, подписок и платежей.
+
+    Одинаковый seed дает одинаковые данные. Email пользователей имеют вид
+    {prefix}{seed}-{n}@example.com, пароль у всех один (SEED_PASSWORD) и хешируется
+    один раз. Даты платежей равномерно распределены по последним days дням.
+    """
+    rnd = random.Random(seed)
+    password = make_password(SEED_PASSWORD)
+
+    user_ids = _bulk_create(
+        User,
+        (User(email=f'{prefix}{seed}-{i}@example.com', password=password) for i in range(users)),
+        batch_size, progress,
+    )
+    course_ids = _bulk_create(
+        Course,
+        (
+            Course(name=f'Курс {i}', description=f'Описание курса {i}', price=rnd.choice(PAYMENT_AMOUNTS),
+                   owner_id=rnd.choice(user_ids))
+            for i in range(courses)
+        ),
+        batch_size, progress,
+    )
+    course_owners = dict(Course.objects.filter(pk__in=course_ids).values_list('id', 'owner_id').iterator())
+    lesson_ids = _bulk_create(
+        Lesson,
+        (
+            Lesson(name=f'Урок {j} курса {course_id}', course_id=course_id, owner_id=course_owners[course_id],
+                   video_url=f'https://www.youtube.com/watch?v=seed{course_id}x{j}',
+                   price=rnd.choice(PAYMENT_AMOUNTS) / 10)
+            for course_id in course_ids
+            for j in range(lessons_per_course)
+        ),
+        batch_size, progress,
+    )
+    subscription_ids = _bulk_create(
+        Subscription,
+        (
+            Subscription(user_id=user_id, course_id=course_id)
+            for user_id in user_ids
+            for course_id in rnd.sample(course_ids, min(subscriptions_per_user, len(course_ids)))
+        ),
+        batch_size, progress,
+    )
+
+    def make_payment(user_id):
+        paid_course_id = rnd.choice(course_ids) if course_ids and (not lesson_ids or rnd.random() < 0.5) else None
+        method = rnd.choice(Payment.PAYMENT_METHOD_CHOICES)[0]
+        return Payment(
+            user_id=user_id,
+            paid_course_id=paid_course_id,
+            paid_lesson_id=None if paid_course_id else rnd.choice(lesson_ids),
+            amount=rnd.choice(PAYMENT_AMOUNTS),
+            payment_method=method,
+            stripe_session_id=f'cs_seed_{rnd.getrandbits(64):016x}' if method == 'stripe' else None,
+            payment_status=rnd.choice(PAYMENT_STATUSES) if method == 'stripe' else None,
+        )
+
+    payment_ids = []
+    if course_ids or lesson_ids:
+        payment_ids = _bulk_create(
+            Payment,
+            (make_payment(user_id) for user_id in user_ids for _ in range(payments_per_user)),
+            batch_size, progress,
+        )
+
+    if payment_ids and days:
+        # payment_date заполняется auto_now_add, поэтому разносим даты одним UPDATE уже после вставки
+        Payment.objects.filter(pk__gte=payment_ids[0], pk__lte=payment_ids[-1]).update(
+            payment_date=Value(timezone.now()) - ExpressionWrapper(
+                Value(timedelta(seconds=1)) * Mod(F('id') * 7919, days * 24 * 60 * 60),
+                output_field=DurationField(),
+            )
+        )
+
+    # Все вставки шли через bulk_create без сигналов, поэтому статистику курсов считаем одним проходом
+    if course_ids:
+        rebuild_course_stats(
+            Course.objects.filter(pk__gte=course_ids[0], pk__lte=course_ids[-1]).values('pk'), batch_size=batch_size,
+        )
+
+    return {
+        'users': len(user_ids),
+        'courses': len(course_ids),
+        'lessons': len(lesson_ids),
+        'subscriptions': len(subscription_ids),
+        'payments': len(payment_ids),
+    }
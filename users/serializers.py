@@ -1,16 +1,38 @@
 from rest_framework import serializers
+from users.analytics import ANALYTICS_GROUPS, ANALYTICS_PERIODS
 from users.models import User, Payment
 from materials.serializers import CourseSerializer, LessonSerializer
 
 
 class PaymentSerializer(serializers.ModelSerializer):
-    paid_course = CourseSerializer(read_only=True)
-    paid_lesson = LessonSerializer(read_only=True)
+    """
+    Компактное представление платежа: идентификаторы и названия курса/урока.
+
+    Полные вложенные объекты отдаются только для полей, перечисленных
+    в контексте сериализатора под ключом ``expand``.
+    """
+    EXPANDABLE_FIELDS = {
+        'paid_course': CourseSerializer,
+        'paid_lesson': LessonSerializer,
+    }
+
+    paid_course = serializers.PrimaryKeyRelatedField(read_only=True)
+    paid_lesson = serializers.PrimaryKeyRelatedField(read_only=True)
+    paid_course_name = serializers.CharField(source='paid_course.name', read_only=True, default=None)
+    paid_lesson_name = serializers.CharField(source='paid_lesson.name', read_only=True, default=None)
 
     class Meta:
         model = Payment
         fields = '__all__'
 
+    def get_fields(self):
+        fields = super().get_fields()
+        for field_name in self.context.get('expand', []):
+            serializer_class = self.EXPANDABLE_FIELDS.get(field_name)
+            if serializer_class:
+                fields[field_name] = serializer_class(read_only=True)
+        return fields
+
 
 class PaymentStripeSerializer(serializers.Serializer):
     course_id = serializers.IntegerField(required=False, allow_null=True)
@@ -24,6 +46,54 @@ class PaymentStripeSerializer(serializers.Serializer):
         return data
 
 
+class PaymentAnalyticsQuerySerializer(serializers.Serializer):
+    """Параметры запроса аналитики платежей"""
+    period = serializers.ChoiceField(choices=ANALYTICS_PERIODS, default='day')
+    group_by = serializers.CharField(required=False, default='', allow_blank=True)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    paid_course = serializers.IntegerField(required=False)
+    paid_lesson = serializers.IntegerField(required=False)
+    payment_method = serializers.ChoiceField(choices=Payment.PAYMENT_METHOD_CHOICES, required=False)
+    payment_status = serializers.CharField(required=False)
+
+    def validate_group_by(self, value):
+        group_by = [name for name in value.split(',') if name]
+        unknown = [name for name in group_by if name not in ANALYTICS_GROUPS]
+        if unknown:
+            raise serializers.ValidationError(
+                f'Неизвестная группировка: {", ".join(unknown)}. Допустимые значения: {", ".join(ANALYTICS_GROUPS)}'
+            )
+        return list(dict.fromkeys(group_by))
+
+    def validate(self, attrs):
+        if 'date_from' in attrs and 'date_to' in attrs and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError('date_from не может быть позже date_to')
+        return attrs
+
+    def get_filters(self):
+        """Фильтры по PaymentDailyRollup для users.analytics.payment_analytics"""
+        data = self.validated_data
+        lookups = {'date_from': 'date__gte', 'date_to': 'date__lte'}
+        return {
+            lookups.get(name, name): data[name]
+            for name in ['date_from', 'date_to', 'paid_course', 'paid_lesson', 'payment_method', 'payment_status']
+            if name in data
+        }
+
+
+class PaymentAnalyticsRowSerializer(serializers.Serializer):
+    """Строка аналитики; поля группировки, не указанные в group_by, в ответ не попадают"""
+    period = serializers.DateField()
+    paid_course = serializers.IntegerField(required=False)
+    paid_lesson = serializers.IntegerField(required=False)
+    payment_method = serializers.CharField(required=False)
+    payment_status = serializers.CharField(required=False)
+    payments_count = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
 class UserSerializer(serializers.ModelSerializer):
     payments = PaymentSerializer(many=True, read_only=True)
     password = serializers.CharField(write_only=True, required=False)
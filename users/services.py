@@ -1,51 +1,429 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import weakref
+from contextvars import ContextVar
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
 import stripe
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from config.metrics import track_external_call
+from materials.stats import add_payment_change, apply_stats_deltas, payment_contribution, stats_deltas
+from users.models import Payment, StripePrice
+
+STRIPE_CATALOG_CACHE_KEY = 'users:stripe-catalog:{kind}:{item_id}:{amount}'
+STRIPE_CATALOG_CACHE_TIMEOUT = 24 * 60 * 60
+
+PAYMENT_IDEMPOTENCY_KEY = 'users:payment-idempotency:{user_id}:{key_hash}'
+PAYMENT_IDEMPOTENCY_PENDING = 'pending'
+PAYMENT_IDEMPOTENCY_MISMATCH = 'mismatch'
+
+_async_clients = weakref.WeakKeyDictionary()
+_request_async_client = ContextVar('request_async_stripe_client', default=None)
+
+
+def _build_stripe_client(http_client):
+    base_addresses = {'api': settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else None
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=http_client,
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+        base_addresses=base_addresses,
+    )
+
+
+@functools.cache
+def get_stripe_client():
+    """
+    Синхронный клиент Stripe для WSGI-воркеров.
+
+    RequestsClient держит по одной requests.Session на поток, поэтому соединения
+    с API переиспользуются между запросами. Сетевые ошибки, 409/429 и 5xx
+    повторяются STRIPE_MAX_NETWORK_RETRIES раз с экспоненциальной задержкой.
+    """
+    http_client = stripe.RequestsClient(
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_TIMEOUT),
+    )
+    return _build_stripe_client(http_client)
+
+
+def _build_async_stripe_client():
+    import httpx
+
+    http_client = stripe.HTTPXClient(
+        timeout=httpx.Timeout(settings.STRIPE_TIMEOUT, connect=settings.STRIPE_CONNECT_TIMEOUT),
+    )
+    return _build_stripe_client(http_client), http_client
+
+
+def get_async_stripe_client():
+    """
+    Асинхронный клиент Stripe с пулом соединений httpx.AsyncClient.
+
+    Внутри async_stripe_client_scope возвращается клиент текущего запроса.
+    Иначе клиент создается один раз на работающий цикл событий: под ASGI
+    цикл один на процесс и живет до его остановки.
+    """
+    client = _request_async_client.get()
+    if client is not None:
+        return client
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client, _ = _build_async_stripe_client()
+        _async_clients[loop] = client
+    return client
+
+
+@contextlib.asynccontextmanager
+async def async_stripe_client_scope(shared=True):
+    """
+    Область использования асинхронного клиента Stripe на время запроса.
+
+    Под WSGI асинхронное представление выполняется в отдельном цикле событий,
+    который закрывается после ответа. Общий клиент такого цикла никто не
+    закрыл бы, поэтому при shared=False клиент создается на запрос и его
+    пул соединений закрывается на выходе из области.
+    """
+    if shared:
+        yield
+        return
+    client, http_client = _build_async_stripe_client()
+    token = _request_async_client.set(client)
+    try:
+        yield
+    finally:
+        _request_async_client.reset(token)
+        await http_client.close_async()
+
+
+def _product_params(name, description):
+    return {'name': name, 'description': description or ''}
+
+
+def _price_params(product_id, amount, currency):
+    # Через Decimal и с округлением: int(0.29 * 100) дал бы 28 центов
+    unit_amount = int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    return {'product': product_id, 'unit_amount': unit_amount, 'currency': currency}
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+def _session_params(price_id, success_url, cancel_url):
+    return {
+        'line_items': [{
+            'price': price_id,
+            'quantity': 1,
+        }],
+        'mode': 'payment',
+        'success_url': success_url,
+        'cancel_url': cancel_url,
+    }
 
 
 def create_stripe_product(name, description=None):
     try:
-        product = stripe.Product.create(
-            name=name,
-            description=description or '',
-        )
-        return product
+        with track_external_call('stripe', 'products.create'):
+            return get_stripe_client().v1.products.create(_product_params(name, description))
     except stripe.error.StripeError as e:
         raise Exception(f'Ошибка создания продукта в Stripe: {str(e)}')
 
 
+def update_stripe_product(product_id, name, description=None):
+    try:
+        with track_external_call('stripe', 'products.update'):
+            return get_stripe_client().v1.products.update(product_id, _product_params(name, description))
+    except stripe.error.StripeError as e:
+        raise Exception(f'Ошибка обновления продукта в Stripe: {str(e)}')
+
+
 def create_stripe_price(product_id, amount, currency='usd'):
     try:
-        price = stripe.Price.create(
-            product=product_id,
-            unit_amount=int(amount * 100),
-            currency=currency,
-        )
-        return price
+        with track_external_call('stripe', 'prices.create'):
+            return get_stripe_client().v1.prices.create(_price_params(product_id, amount, currency))
     except stripe.error.StripeError as e:
         raise Exception(f'Ошибка создания цены в Stripe: {str(e)}')
 
 
-def create_stripe_session(price_id, success_url, cancel_url):
+def _session_options(idempotency_key):
+    return {'idempotency_key': idempotency_key} if idempotency_key else None
+
+
+def create_stripe_session(price_id, success_url, cancel_url, idempotency_key=None):
     try:
-        session = stripe.checkout.Session.create(
-            line_items=[{
-                'price': price_id,
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url=success_url,
-            cancel_url=cancel_url,
-        )
-        return session
+        with track_external_call('stripe', 'checkout.sessions.create'):
+            return get_stripe_client().v1.checkout.sessions.create(
+                _session_params(price_id, success_url, cancel_url),
+                _session_options(idempotency_key),
+            )
     except stripe.error.StripeError as e:
         raise Exception(f'Ошибка создания сессии в Stripe: {str(e)}')
 
 
 def retrieve_stripe_session(session_id):
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        return session
+        with track_external_call('stripe', 'checkout.sessions.retrieve'):
+            return get_stripe_client().v1.checkout.sessions.retrieve(session_id)
+    except stripe.error.StripeError as e:
+        raise Exception(f'Ошибка получения сессии из Stripe: {str(e)}')
+
+
+def list_stripe_sessions(created_since, page_size=100):
+    """
+    Перебирает сессии оплаты, созданные не раньше created_since, страницами по page_size.
+
+    Страницы запрашиваются явно, а не через auto_paging_iter, чтобы замерять каждый вызов API.
+    """
+    params = {'created': {'gte': int(created_since.timestamp())}, 'limit': page_size}
+    try:
+        while True:
+            with track_external_call('stripe', 'checkout.sessions.list'):
+                page = get_stripe_client().v1.checkout.sessions.list(params)
+            yield from page.data
+            if not page.has_more or not page.data:
+                return
+            params = {**params, 'starting_after': page.data[-1].id}
+    except stripe.error.StripeError as e:
+        raise Exception(f'Ошибка получения сессий из Stripe: {str(e)}')
+
+
+def update_payment_statuses(statuses):
+    """
+    Применяет статусы оплаты {stripe_session_id: payment_status} к платежам.
+
+    Записываются только платежи, у которых статус действительно изменился,
+    одним bulk_update вместе с изменением выручки их курсов в CourseStats.
+    Возвращает число обновленных платежей.
+    """
+    changed = []
+    deltas = stats_deltas()
+    payments = Payment.objects.filter(stripe_session_id__in=list(statuses)).only(
+        'id', 'stripe_session_id', 'payment_status', 'payment_method', 'paid_course_id', 'amount',
+    )
+    for payment in payments:
+        payment_status = statuses[payment.stripe_session_id]
+        if payment.payment_status != payment_status:
+            old = payment_contribution(payment)
+            payment.payment_status = payment_status
+            add_payment_change(deltas, old, payment_contribution(payment))
+            changed.append(payment)
+    with transaction.atomic():
+        Payment.objects.bulk_update(changed, ['payment_status'])
+        # bulk_update не отправляет сигналы, поэтому выручку курсов пересчитываем явно
+        apply_stats_deltas(deltas)
+    return len(changed)
+
+
+async def create_stripe_product_async(name, description=None):
+    try:
+        with track_external_call('stripe', 'products.create'):
+            return await get_async_stripe_client().v1.products.create_async(_product_params(name, description))
+    except stripe.error.StripeError as e:
+        raise Exception(f'Ошибка создания продукта в Stripe: {str(e)}')
+
+
+async def create_stripe_price_async(product_id, amount, currency='usd'):
+    try:
+        with track_external_call('stripe', 'prices.create'):
+            return await get_async_stripe_client().v1.prices.create_async(_price_params(product_id, amount, currency))
+    except stripe.error.StripeError as e:
+        raise Exception(f'Ошибка создания цены в Stripe: {str(e)}')
+
+
+async def create_stripe_session_async(price_id, success_url, cancel_url, idempotency_key=None):
+    try:
+        with track_external_call('stripe', 'checkout.sessions.create'):
+            return await get_async_stripe_client().v1.checkout.sessions.create_async(
+                _session_params(price_id, success_url, cancel_url),
+                _session_options(idempotency_key),
+            )
     except stripe.error.StripeError as e:
-        raise Exception(f'Ошибка получения сессии из Stripe: {str(e)}')
\ No newline at end of file
+        raise Exception(f'Ошибка создания сессии в Stripe: {str(e)}')
+
+
+def _catalog_lookup(item):
+    kind = item._meta.model_name
+    key = STRIPE_CATALOG_CACHE_KEY.format(kind=kind, item_id=item.pk, amount=item.price)
+    return key, {kind: item}
+
+
+def _save_catalog_price(item, lookup, product_id, price_id):
+    try:
+        with transaction.atomic():
+            return StripePrice.objects.create(
+                amount=item.price,
+                stripe_product_id=product_id,
+                stripe_price_id=price_id,
+                **lookup,
+            )
+    except IntegrityError:
+        # Параллельный запрос успел сохранить цену раньше; используем его запись.
+        return StripePrice.objects.get(amount=item.price, **lookup)
+
+
+def get_stripe_catalog_price(item):
+    """
+    Возвращает (stripe_product_id, stripe_price_id) для курса или урока по его текущей цене.
+
+    Продукт и цена создаются в Stripe один раз и сохраняются в StripePrice;
+    при изменении цены курса/урока создается только новая цена для уже
+    существующего продукта, а изменение названия или описания переносится в продукт
+    задачей users.tasks.sync_stripe_products. Поиск идет через кеш, поэтому на горячем
+    пути остается лишь создание сессии оплаты.
+    """
+    key, lookup = _catalog_lookup(item)
+    ids = cache.get(key)
+    if ids is not None:
+        return ids
+
+    entry = StripePrice.objects.filter(amount=item.price, **lookup).first()
+    if entry is None:
+        product_id = StripePrice.objects.filter(**lookup).values_list('stripe_product_id', flat=True).first()
+        if product_id is None:
+            product_id = create_stripe_product(item.name, item.description).id
+        price_id = create_stripe_price(product_id, item.price).id
+        entry = _save_catalog_price(item, lookup, product_id, price_id)
+
+    ids = (entry.stripe_product_id, entry.stripe_price_id)
+    cache.set(key, ids, STRIPE_CATALOG_CACHE_TIMEOUT)
+    return ids
+
+
+async def get_stripe_catalog_price_async(item):
+    key, lookup = _catalog_lookup(item)
+    ids = await cache.aget(key)
+    if ids is not None:
+        return ids
+
+    entry = await StripePrice.objects.filter(amount=item.price, **lookup).afirst()
+    if entry is None:
+        product_id = await StripePrice.objects.filter(**lookup).values_list('stripe_product_id', flat=True).afirst()
+        if product_id is None:
+            product_id = (await create_stripe_product_async(item.name, item.description)).id
+        price_id = (await create_stripe_price_async(product_id, item.price)).id
+        entry = await sync_to_async(_save_catalog_price)(item, lookup, product_id, price_id)
+
+    ids = (entry.stripe_product_id, entry.stripe_price_id)
+    await cache.aset(key, ids, STRIPE_CATALOG_CACHE_TIMEOUT)
+    return ids
+
+
+def get_payment_return_urls():
+    frontend_url = settings.FRONTEND_URL or 'http://localhost:8000'
+    success_url = f"{frontend_url}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
+    cancel_url = f"{frontend_url}/payment/cancel"
+    return success_url, cancel_url
+
+
+def _idempotency_cache_key(user, key):
+    key_hash = hashlib.sha256(key.encode()).hexdigest()
+    return PAYMENT_IDEMPOTENCY_KEY.format(user_id=user.pk, key_hash=key_hash)
+
+
+def payment_request_fingerprint(course_id=None, lesson_id=None):
+    """Отпечаток параметров запроса на оплату, с которым связывается ключ идемпотентности"""
+    return f'course:{course_id or ""}:lesson:{lesson_id or ""}'
+
+
+def claim_payment_idempotency_key(user, key, fingerprint):
+    """
+    Атомарно занимает ключ идемпотентности (заголовок Idempotency-Key) для пользователя.
+
+    Возвращает None, если ключ свободен и теперь принадлежит текущему запросу;
+    id платежа, если запрос с этим ключом уже выполнен; PAYMENT_IDEMPOTENCY_PENDING,
+    если такой запрос еще выполняется; PAYMENT_IDEMPOTENCY_MISMATCH, если ключ
+    использован для запроса с другими параметрами (другой fingerprint).
+    """
+    cache_key = _idempotency_cache_key(user, key)
+    value = None
+    while value is None:
+        if cache.add(cache_key, (fingerprint, PAYMENT_IDEMPOTENCY_PENDING), settings.PAYMENT_IDEMPOTENCY_TTL):
+            return None
+        # Ключ мог истечь или быть освобожден между add и get: тогда занимаем его заново
+        value = cache.get(cache_key)
+    claimed_fingerprint, state = value
+    if claimed_fingerprint != fingerprint:
+        return PAYMENT_IDEMPOTENCY_MISMATCH
+    return state
+
+
+def complete_payment_idempotency_key(user, key, fingerprint, payment_id):
+    cache.set(_idempotency_cache_key(user, key), (fingerprint, payment_id), settings.PAYMENT_IDEMPOTENCY_TTL)
+
+
+def release_payment_idempotency_key(user, key):
+    cache.delete(_idempotency_cache_key(user, key))
+
+
+def _open_payments(user, item):
+    since = timezone.now() - timedelta(seconds=settings.STRIPE_SESSION_REUSE_WINDOW)
+    return Payment.objects.filter(
+        user=user,
+        payment_method='stripe',
+        payment_status='unpaid',
+        amount=item.price,
+        payment_date__gte=since,
+        **{f'paid_{item._meta.model_name}': item},
+    ).order_by('-payment_date')
+
+
+def _stripe_idempotency_key(user, item, idempotency_key):
+    if not idempotency_key:
+        return None
+    return f'checkout:{user.pk}:{item._meta.model_name}:{item.pk}:{idempotency_key}'
+
+
+def _build_payment(user, item, product_id, price_id, session):
+    return Payment(
+        user=user,
+        amount=item.price,
+        payment_method='stripe',
+        stripe_product_id=product_id,
+        stripe_price_id=price_id,
+        stripe_session_id=session.id,
+        payment_url=session.url,
+        payment_status=session.payment_status,
+        **{f'paid_{item._meta.model_name}': item},
+    )
+
+
+def create_checkout_payment(user, item, idempotency_key=None):
+    """
+    Создает платеж со ссылкой на оплату курса или урока в Stripe.
+
+    Если у пользователя уже есть неоплаченная сессия за тот же курс/урок по той
+    же цене, не старше STRIPE_SESSION_REUSE_WINDOW, возвращается она, без обращения
+    к Stripe и записи в БД. Возвращает (платеж, создан ли новый платеж).
+    """
+    payment = _open_payments(user, item).first()
+    if payment is not None:
+        return payment, False
+
+    product_id, price_id = get_stripe_catalog_price(item)
+    success_url, cancel_url = get_payment_return_urls()
+    session = create_stripe_session(
+        price_id, success_url, cancel_url, _stripe_idempotency_key(user, item, idempotency_key)
+    )
+    payment = _build_payment(user, item, product_id, price_id, session)
+    payment.save()
+    return payment, True
+
+
+async def create_checkout_payment_async(user, item, idempotency_key=None):
+    payment = await _open_payments(user, item).afirst()
+    if payment is not None:
+        return payment, False
+
+    product_id, price_id = await get_stripe_catalog_price_async(item)
+    success_url, cancel_url = get_payment_return_urls()
+    session = await create_stripe_session_async(
+        price_id, success_url, cancel_url, _stripe_idempotency_key(user, item, idempotency_key)
+    )
+    payment = _build_payment(user, item, product_id, price_id, session)
+    await payment.asave()
+    return payment, True
@@ -0,0 +1,89 @@
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from materials.models import Course, Lesson
+from users.models import StripePrice, User
+from users.roles import invalidate_user_groups
+from users.tasks import sync_stripe_products
+
+# Поля курса и урока, которые копируются в продукт Stripe
+STRIPE_PRODUCT_FIELDS = ['name', 'description']
+
+# Отправляется после массовой деактивации неактивных пользователей; аргумент count — число затронутых строк.
+users_deactivated = Signal()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_groups_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            invalidate_user_groups([instance.pk])
+    elif action in ['post_add', 'post_remove']:
+        invalidate_user_groups(pk_set)
+    elif action == 'pre_clear':
+        invalidate_user_groups(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_groups_on_group_change(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    invalidate_user_groups(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+def invalidate_groups_on_user_create(sender, instance, created, **kwargs):
+    if created:
+        invalidate_user_groups([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def invalidate_groups_on_user_delete(sender, instance, **kwargs):
+    invalidate_user_groups([instance.pk])
+
+
+def _stripe_product_state(instance):
+    # Из __dict__, чтобы не подгружать отложенные поля; None — состояние неизвестно
+    values = instance.__dict__
+    if any(field not in values for field in STRIPE_PRODUCT_FIELDS):
+        return None
+    return tuple(values[field] for field in STRIPE_PRODUCT_FIELDS)
+
+
+def schedule_stripe_product_sync(instance):
+    """
+    Ставит после коммита задачу sync_stripe_products, если название или описание курса
+    или урока с продуктом в Stripe изменились с момента загрузки. Вызывается из post_save и явно из массовых
+    обновлений, которые сигналы не отправляют. Возвращает True, если изменение найдено.
+    """
+    old = getattr(instance, '_stripe_product_state', None)
+    new = instance._stripe_product_state = _stripe_product_state(instance)
+    if old is None or new is None or old == new:
+        return False
+    model_name, item_id = instance._meta.model_name, instance.pk
+
+    def enqueue():
+        # Большинство курсов и уроков не продавались через Stripe, и задача им не нужна
+        if StripePrice.objects.filter(**{model_name: item_id}).exists():
+            sync_stripe_products.delay(model_name, item_id)
+
+    transaction.on_commit(enqueue)
+    return True
+
+
+@receiver(post_init, sender=Course)
+@receiver(post_init, sender=Lesson)
+def remember_stripe_product_state(sender, instance, **kwargs):
+    instance._stripe_product_state = _stripe_product_state(instance)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+def sync_stripe_product_on_save(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        instance._stripe_product_state = _stripe_product_state(instance)
+        return
+    schedule_stripe_product_sync(instance)
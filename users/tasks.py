@@ -0,0 +1,74 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from users import analytics
+from users.models import Payment, StripePrice
+from users.services import list_stripe_sessions, update_payment_statuses, update_stripe_product
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def reconcile_stripe_payments() -> int:
+    """
+    Сверяет статусы неоплаченных Stripe-платежей с сессиями в Stripe.
+
+    Вместо запроса к Stripe на каждый платеж сессии читаются списком,
+    начиная с даты самого раннего ожидающего платежа в окне
+    STRIPE_RECONCILE_WINDOW, и применяются пачками. Возвращает число
+    обновленных платежей.
+    """
+    since = timezone.now() - timedelta(seconds=settings.STRIPE_RECONCILE_WINDOW)
+    pending = Payment.objects.filter(
+        payment_method='stripe',
+        stripe_session_id__isnull=False,
+        payment_date__gte=since,
+    ).filter(Q(payment_status='unpaid') | Q(payment_status__isnull=True))
+
+    oldest = pending.aggregate(oldest=Min('payment_date'))['oldest']
+    if oldest is None:
+        return 0
+
+    updated = 0
+    statuses = {}
+    for session in list_stripe_sessions(oldest - timedelta(minutes=1)):
+        statuses[session.id] = session.payment_status
+        if len(statuses) >= settings.STRIPE_RECONCILE_BATCH_SIZE:
+            updated += update_payment_statuses(statuses)
+            statuses = {}
+    if statuses:
+        updated += update_payment_statuses(statuses)
+
+    logger.info('Обновлено статусов Stripe-платежей: %s', updated)
+    return updated
+
+
+@shared_task
+def update_payment_rollups() -> int:
+    """Дополняет суточные итоги платежей новыми платежами (users.analytics). Возвращает число пересчитанных дней."""
+    days = analytics.update_payment_rollups()
+    logger.info('Пересчитаны суточные итоги платежей за дней: %s', days)
+    return days
+
+
+@shared_task
+def sync_stripe_products(model_name, item_id) -> int:
+    """
+    Переносит название и описание курса или урока (model_name: course, lesson) во все его
+    продукты Stripe. Возвращает число обновленных продуктов.
+    """
+    item = apps.get_model('materials', model_name).objects.filter(pk=item_id).only('name', 'description').first()
+    if item is None:
+        return 0
+    product_ids = set(
+        StripePrice.objects.filter(**{model_name: item_id}).values_list('stripe_product_id', flat=True)
+    )
+    for product_id in sorted(product_ids):
+        update_stripe_product(product_id, item.name, item.description)
+    return len(product_ids)
@@ -1,3 +1,651 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from materials.models import Course, CourseStats, Lesson, Subscription
+from users.analytics import rebuild_payment_rollups, update_payment_rollups
+from users.fake_stripe import FakeStripeServer, sign_webhook_payload
+from users.models import Payment, PaymentDailyRollup, StripePrice, User
+from users.seeding import seed_data
+from users.services import (
+    PAYMENT_IDEMPOTENCY_PENDING, claim_payment_idempotency_key, create_stripe_session, get_stripe_client,
+    list_stripe_sessions, payment_request_fingerprint,
+)
+from users.tasks import reconcile_stripe_payments, sync_stripe_products
+
+
+class PaymentListQueriesTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='buyer@test.com')
+        self.client.force_authenticate(user=self.user)
+
+        for i in range(10):
+            course = Course.objects.create(name=f'Course {i}', owner=self.user, price=Decimal('100.00'))
+            lesson = Lesson.objects.create(name=f'Lesson {i}', course=course, owner=self.user)
+            Payment.objects.create(user=self.user, paid_course=course, amount=Decimal('100.00'), payment_method='cash')
+            Payment.objects.create(user=self.user, paid_lesson=lesson, amount=Decimal('10.00'), payment_method='transfer')
+
+    def test_list_payments_compact(self):
+        for page_size in [5, 20]:
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/payments/', {'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), page_size)
+
+        payment = response.data['results'][-1]
+        self.assertIsInstance(payment['paid_course'], int)
+        self.assertEqual(payment['paid_course_name'], 'Course 0')
+        self.assertIsNone(payment['paid_lesson'])
+        self.assertIsNone(payment['paid_lesson_name'])
+
+    def test_list_payments_expanded(self):
+        for page_size in [5, 20]:
+            with self.assertNumQueries(4):
+                response = self.client.get('/api/payments/', {
+                    'page_size': page_size,
+                    'expand': 'paid_course,paid_lesson',
+                })
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        course_payment = response.data['results'][-1]
+        lesson_payment = response.data['results'][-2]
+        self.assertEqual(course_payment['paid_course']['name'], 'Course 0')
+        self.assertEqual(course_payment['paid_course']['lessons_count'], 1)
+        self.assertEqual(lesson_payment['paid_lesson']['name'], 'Lesson 0')
+
+    def test_me_payments_compact(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['payments']), 20)
+        self.assertIn('paid_course_name', response.data['payments'][0])
+
+
+class StripePaymentIntentTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email='buyer@test.com')
+        self.course = Course.objects.create(name='Paid Course', owner=self.user, price=Decimal('49.90'))
+        self.free_course = Course.objects.create(name='Free Course', owner=self.user)
+
+        self.stripe = FakeStripeServer()
+        self.stripe.__enter__()
+        self.addCleanup(self.stripe.__exit__)
+        settings_override = override_settings(
+            STRIPE_SECRET_KEY='sk_test_fake',
+            STRIPE_API_BASE=self.stripe.url,
+            STRIPE_MAX_NETWORK_RETRIES=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_stripe_client.cache_clear()
+        self.addCleanup(get_stripe_client.cache_clear)
+
+    def auth_header(self):
+        return f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def test_create_payment_intent(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        payment = Payment.objects.get()
+        self.assertEqual(response.data['payment_url'], payment.payment_url)
+        self.assertEqual(payment.amount, Decimal('49.90'))
+        self.assertEqual(payment.payment_status, 'unpaid')
+        self.assertEqual(
+            [path for _, path, _ in self.stripe.requests],
+            ['/v1/products', '/v1/prices', '/v1/checkout/sessions'],
+        )
+        self.assertEqual(self.stripe.requests[1][2]['unit_amount'], ['4990'])
+
+    def test_stripe_call_metrics(self):
+        labels = {'service': 'stripe', 'operation': 'checkout.sessions.create'}
+        before = REGISTRY.get_sample_value('external_call_duration_seconds_count', labels) or 0
+
+        create_stripe_session('price_1', 'https://example.com/ok', 'https://example.com/cancel')
+
+        self.assertEqual(REGISTRY.get_sample_value('external_call_duration_seconds_count', labels), before + 1)
+
+    def test_stripe_call_error_metrics(self):
+        labels = {'service': 'stripe', 'operation': 'checkout.sessions.create', 'error': 'APIConnectionError'}
+        before = REGISTRY.get_sample_value('external_call_errors_total', labels) or 0
+        self.stripe.__exit__()
+
+        with self.assertRaises(Exception):
+            create_stripe_session('price_1', 'https://example.com/ok', 'https://example.com/cancel')
+
+        self.assertEqual(REGISTRY.get_sample_value('external_call_errors_total', labels), before + 1)
+
+    def test_session_list_pages_metrics(self):
+        """Каждая страница списка сессий замеряется отдельным вызовом"""
+        labels = {'service': 'stripe', 'operation': 'checkout.sessions.list'}
+        before = REGISTRY.get_sample_value('external_call_duration_seconds_count', labels) or 0
+        self.stripe.sessions = {f'cs_{i}': 'paid' for i in range(5)}
+
+        sessions = list(list_stripe_sessions(timezone.now() - timedelta(days=1), page_size=2))
+
+        self.assertEqual([session.id for session in sessions], [f'cs_{i}' for i in range(5)])
+        self.assertEqual(len(self.stripe.requests), 3)
+        self.assertEqual(REGISTRY.get_sample_value('external_call_duration_seconds_count', labels), before + 3)
+
+    def test_catalog_reused_between_payments(self):
+        self.client.force_authenticate(user=self.user)
+        for _ in range(3):
+            response = self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            Payment.objects.update(payment_status='paid')
+
+        self.assertEqual(
+            [path for _, path, _ in self.stripe.requests],
+            ['/v1/products', '/v1/prices'] + ['/v1/checkout/sessions'] * 3,
+        )
+        self.assertEqual(StripePrice.objects.count(), 1)
+        self.assertEqual(len(set(Payment.objects.values_list('stripe_price_id', flat=True))), 1)
+
+    def test_catalog_price_change_creates_new_price_only(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+        Payment.objects.update(payment_status='paid')
+        self.course.price = Decimal('59.90')
+        self.course.save()
+        self.stripe.requests.clear()
+
+        self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+
+        self.assertEqual([path for _, path, _ in self.stripe.requests], ['/v1/prices', '/v1/checkout/sessions'])
+        product_ids = set(StripePrice.objects.values_list('stripe_product_id', flat=True))
+        self.assertEqual(len(product_ids), 1)
+        self.assertEqual(StripePrice.objects.count(), 2)
+
+    def test_price_amount_rounding(self):
+        self.course.price = Decimal('0.29')
+        self.course.save()
+        self.client.force_authenticate(user=self.user)
+        self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+        self.assertEqual(self.stripe.requests[1][2]['unit_amount'], ['29'])
+
+    @mock.patch('materials.services.send_course_update_notifications.apply_async')
+    def test_catalog_product_follows_rename(self, apply_async):
+        self.client.force_authenticate(user=self.user)
+        self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+        product_id = StripePrice.objects.get().stripe_product_id
+        self.stripe.requests.clear()
+
+        with mock.patch.object(sync_stripe_products, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(f'/api/courses/{self.course.id}/', {'price': '49.90'})
+            delay.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(f'/api/courses/{self.course.id}/', {'name': 'Renamed Course'})
+        delay.assert_called_once_with('course', self.course.id)
+
+        self.assertEqual(sync_stripe_products('course', self.course.id), 1)
+        method, path, params = self.stripe.requests[-1]
+        self.assertEqual((method, path, params['name']), ('POST', f'/v1/products/{product_id}', ['Renamed Course']))
+
+    def test_idempotency_key_returns_same_payment(self):
+        self.client.force_authenticate(user=self.user)
+        first = self.client.post(
+            '/api/payments/create-payment-intent/', {'course_id': self.course.id}, HTTP_IDEMPOTENCY_KEY='checkout-1',
+        )
+        Payment.objects.update(payment_status='paid')
+        self.stripe.requests.clear()
+        with self.assertNumQueries(1):
+            second = self.client.post(
+                '/api/payments/create-payment-intent/', {'course_id': self.course.id}, HTTP_IDEMPOTENCY_KEY='checkout-1',
+            )
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data['payment']['id'], second.data['payment']['id'])
+        self.assertEqual(self.stripe.requests, [])
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_idempotency_key_in_progress(self):
+        self.client.force_authenticate(user=self.user)
+        claim_payment_idempotency_key(self.user, 'checkout-1', payment_request_fingerprint(course_id=self.course.id))
+        response = self.client.post(
+            '/api/payments/create-payment-intent/', {'course_id': self.course.id}, HTTP_IDEMPOTENCY_KEY='checkout-1',
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_idempotency_key_expired_before_read_is_claimed_again(self):
+        fingerprint = payment_request_fingerprint(course_id=self.course.id)
+        claim_payment_idempotency_key(self.user, 'checkout-1', fingerprint)
+
+        def expire_and_get(key, default=None):
+            cache.delete(key)
+            return default
+
+        with mock.patch.object(cache, 'get', side_effect=expire_and_get) as get:
+            self.assertIsNone(claim_payment_idempotency_key(self.user, 'checkout-1', fingerprint))
+        get.assert_called_once()
+        self.assertEqual(
+            claim_payment_idempotency_key(self.user, 'checkout-1', fingerprint),
+            PAYMENT_IDEMPOTENCY_PENDING,
+        )
+
+    def test_idempotency_key_released_on_error(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            '/api/payments/create-payment-intent/', {'course_id': self.free_course.id}, HTTP_IDEMPOTENCY_KEY='checkout-1',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(claim_payment_idempotency_key(
+            self.user, 'checkout-1', payment_request_fingerprint(course_id=self.free_course.id),
+        ))
+
+    def test_idempotency_key_reused_with_other_item(self):
+        self.client.force_authenticate(user=self.user)
+        lesson = Lesson.objects.create(name='Paid Lesson', course=self.course, owner=self.user, price=Decimal('9.90'))
+        first = self.client.post(
+            '/api/payments/create-payment-intent/', {'course_id': self.course.id}, HTTP_IDEMPOTENCY_KEY='checkout-1',
+        )
+        self.stripe.requests.clear()
+        second = self.client.post(
+            '/api/payments/create-payment-intent/', {'lesson_id': lesson.id}, HTTP_IDEMPOTENCY_KEY='checkout-1',
+        )
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(self.stripe.requests, [])
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_open_session_reused(self):
+        self.client.force_authenticate(user=self.user)
+        first = self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+        self.stripe.requests.clear()
+        second = self.client.post('/api/payments/create-payment-intent/', {'course_id': self.course.id})
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data['payment_url'], second.data['payment_url'])
+        self.assertEqual(self.stripe.requests, [])
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_stripe_session_created_with_idempotency_key(self):
+        self.client.force_authenticate(user=self.user)
+        with mock.patch('users.services.create_stripe_session', wraps=create_stripe_session) as create_session:
+            self.client.post(
+                '/api/payments/create-payment-intent/', {'course_id': self.course.id}, HTTP_IDEMPOTENCY_KEY='checkout-1',
+            )
+        self.assertEqual(create_session.call_args.args[3], f'checkout:{self.user.id}:course:{self.course.id}:checkout-1')
+
+    def test_create_payment_intent_free_course(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/payments/create-payment-intent/', {'course_id': self.free_course.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stripe.requests, [])
+
+    async def test_create_payment_intent_async(self):
+        response = await self.async_client.post(
+            '/api/payments/create-payment-intent-async/',
+            {'course_id': self.course.id},
+            content_type='application/json',
+            headers={'Authorization': await sync_to_async(self.auth_header)()},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        payment = await Payment.objects.aget()
+        self.assertEqual(response.json()['payment_url'], payment.payment_url)
+        self.assertEqual(payment.stripe_session_id, response.json()['payment']['stripe_session_id'])
+        self.assertEqual(len(self.stripe.requests), 3)
+
+    async def test_create_payment_intent_async_requires_auth(self):
+        response = await self.async_client.post(
+            '/api/payments/create-payment-intent-async/',
+            {'course_id': self.course.id},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(STRIPE_TIMEOUT=0.2)
+    async def test_create_payment_intent_async_timeout(self):
+        self.stripe.delay = 1
+        started = time.monotonic()
+        response = await self.async_client.post(
+            '/api/payments/create-payment-intent-async/',
+            {'course_id': self.course.id},
+            content_type='application/json',
+            headers={'Authorization': await sync_to_async(self.auth_header)()},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertFalse(await Payment.objects.aexists())
+
+    def test_create_payment_intent_async_under_wsgi_closes_client(self):
+        close_async = stripe.HTTPXClient.close_async
+        with mock.patch.object(stripe.HTTPXClient, 'close_async', autospec=True, side_effect=close_async) as close:
+            response = self.client.post(
+                '/api/payments/create-payment-intent-async/',
+                {'course_id': self.course.id},
+                format='json',
+                HTTP_AUTHORIZATION=self.auth_header(),
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.stripe.requests), 3)
+        close.assert_called_once()
+
+
+class StripeStatusSyncTestCase(TestCase):
+    webhook_secret = 'whsec_test'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='buyer@test.com')
+        self.course = Course.objects.create(name='Paid Course', owner=self.user, price=Decimal('10.00'))
+        self.payments = [
+            Payment.objects.create(
+                user=self.user,
+                paid_course=self.course,
+                amount=self.course.price,
+                payment_method='stripe',
+                stripe_session_id=f'cs_{i}',
+                payment_status='unpaid',
+            )
+            for i in range(3)
+        ]
+
+    def sign(self, payload):
+        return sign_webhook_payload(payload, self.webhook_secret)
+
+    def post_event(self, event, signature=None):
+        payload = json.dumps(event)
+        return self.client.post(
+            '/api/payments/webhook/',
+            payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature or self.sign(payload),
+        )
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=webhook_secret)
+    def test_webhook_updates_payment_status(self):
+        response = self.post_event({
+            'id': 'evt_1',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': {'id': 'cs_1', 'object': 'checkout.session', 'payment_status': 'paid'}},
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(Payment.objects.order_by('id').values_list('payment_status', flat=True)),
+            ['unpaid', 'paid', 'unpaid'],
+        )
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=webhook_secret)
+    def test_webhook_rejects_bad_signature(self):
+        response = self.post_event({'id': 'evt_1', 'type': 'checkout.session.completed'}, signature='t=1,v1=bad')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_check_status_reads_database(self):
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/payments/{self.payments[0].id}/check-status/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['stripe_status'], 'unpaid')
+
+    def test_reconcile_updates_only_changed_payments(self):
+        with FakeStripeServer() as stripe_server, override_settings(
+            STRIPE_SECRET_KEY='sk_test_fake', STRIPE_API_BASE=stripe_server.url, STRIPE_MAX_NETWORK_RETRIES=0,
+        ):
+            get_stripe_client.cache_clear()
+            self.addCleanup(get_stripe_client.cache_clear)
+            stripe_server.sessions = {'cs_0': 'paid', 'cs_1': 'unpaid', 'cs_2': 'paid', 'cs_other': 'paid'}
+
+            with CaptureQueriesContext(connection) as context:
+                updated = reconcile_stripe_payments()
+
+        self.assertEqual(updated, 2)
+        self.assertEqual(len(stripe_server.requests), 1)
+        updates = [q['sql'] for q in context.captured_queries if q['sql'].startswith('UPDATE "users_payment"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(Payment.objects.order_by('id').values_list('payment_status', flat=True)),
+            ['paid', 'unpaid', 'paid'],
+        )
+        stats = CourseStats.objects.get(course=self.course)
+        self.assertEqual((stats.payments_count, stats.revenue), (2, Decimal('20.00')))
+
+    def test_reconcile_without_pending_payments(self):
+        Payment.objects.update(payment_status='paid')
+        self.assertEqual(reconcile_stripe_payments(), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN-проверки индексов рассчитаны на PostgreSQL')
+class PaymentIndexUsageTestCase(TestCase):
+    """Проверяет по плану запроса, что SQL списка платежей с фильтрами идет по составным индексам."""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(email='buyer@test.com')
+        self.course = Course.objects.create(name='Course', owner=user)
+        self.lesson = Lesson.objects.create(name='Lesson', course=self.course, owner=user)
+        # На пустой странице пагинатор не выполняет выборку, поэтому под каждый фильтр есть платеж
+        Payment.objects.create(
+            user=user, amount=100, payment_method='cash', paid_course=self.course, paid_lesson=self.lesson,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertEndpointUsesIndex(self, url, index_name):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # План строится для SQL, который выполнил эндпоинт, а не для похожего queryset в тесте
+        sql = next(
+            query['sql'] for query in ctx.captured_queries
+            if 'FROM "users_payment"' in query['sql'] and 'COUNT(' not in query['sql']
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}')
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn(index_name, plan, plan)
+
+    def test_filter_by_payment_method(self):
+        self.assertEndpointUsesIndex('/api/payments/?payment_method=cash', 'payment_method_date_idx')
+
+    def test_filter_by_paid_course(self):
+        self.assertEndpointUsesIndex(f'/api/payments/?paid_course={self.course.id}', 'payment_course_date_idx')
+
+    def test_filter_by_paid_lesson(self):
+        self.assertEndpointUsesIndex(f'/api/payments/?paid_lesson={self.lesson.id}', 'payment_lesson_date_idx')
+
+
+class SeedDataTestCase(TestCase):
+    """Тесты генератора синтетических данных"""
+
+    def seed(self, **kwargs):
+        options = {'users': 6, 'courses': 3, 'lessons_per_course': 2, 'subscriptions_per_user': 2,
+                   'payments_per_user': 2, 'batch_size': 4}
+        options.update(kwargs)
+        return seed_data(**options)
+
+    def test_counts(self):
+        """Создается заданное количество объектов, пачки не теряют записи"""
+        counts = self.seed()
+
+        self.assertEqual(counts, {'users': 6, 'courses': 3, 'lessons': 6, 'subscriptions': 12, 'payments': 12})
+        self.assertEqual(Subscription.objects.count(), 12)
+        self.assertEqual(Payment.objects.count(), 12)
+        self.assertTrue(User.objects.get(email='seed0-0@example.com').check_password('password'))
+
+    def test_deterministic(self):
+        """Один и тот же seed дает одинаковые данные"""
+        def snapshot(prefix):
+            payments = Payment.objects.filter(user__email__startswith=f'{prefix}1-').order_by('id')
+            return [(p.amount, p.payment_method, p.payment_status, p.paid_course_id is None) for p in payments]
+
+        self.seed(seed=1)
+        self.seed(seed=1, prefix='copy')
+        self.assertEqual(snapshot('seed'), snapshot('copy'))
+
+    def test_payment_dates_spread(self):
+        """Даты платежей распределяются по заданному периоду"""
+        self.seed(users=20, days=30)
+
+        dates = set(Payment.objects.values_list('payment_date__date', flat=True))
+        self.assertGreater(len(dates), 1)
+
+
+class PaymentAnalyticsTestCase(TestCase):
+    """Тесты суточных итогов платежей и эндпоинта аналитики"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create(email='admin@test.com', is_staff=True)
+        self.user = User.objects.create(email='buyer@test.com')
+        self.course = Course.objects.create(name='Курс', owner=self.user)
+        self.lesson = Lesson.objects.create(name='Урок', course=self.course, owner=self.user)
+        self.today = timezone.localdate()
+        self.old_day = self.today - timedelta(days=40)
+
+    def pay(self, day, amount, method='cash', status=None, **item):
+        payment = Payment.objects.create(user=self.user, amount=Decimal(amount), payment_method=method,
+                                         payment_status=status, **(item or {'paid_course': self.course}))
+        Payment.objects.filter(pk=payment.pk).update(
+            payment_date=timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=12),
+        )
+        return payment
+
+    def analytics(self, **params):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/payments/analytics/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data['results']
+
+    def test_incremental_update(self):
+        self.pay(self.old_day, '100.00')
+        self.pay(self.old_day, '30.00', paid_lesson=self.lesson)
+        stripe_payment = self.pay(self.today, '50.00', method='stripe', status='unpaid')
+        self.assertEqual(update_payment_rollups(window_days=1), 2)
+        self.assertEqual(PaymentDailyRollup.objects.filter(date=self.old_day).count(), 2)
+
+        # Новый платеж задним числом попадает в итоги по отметке, смена статуса — по окну
+        self.pay(self.old_day, '20.00')
+        Payment.objects.filter(pk=stripe_payment.pk).update(payment_status='paid')
+        self.assertEqual(update_payment_rollups(window_days=1), 2)
+
+        rows = self.analytics(group_by='course')
+        self.assertEqual(
+            [(row['period'], row['paid_course'], row['payments_count'], row['amount'], row['revenue']) for row in rows],
+            [
+                (self.old_day.isoformat(), self.course.id, 2, '120.00', '120.00'),
+                (self.old_day.isoformat(), None, 1, '30.00', '30.00'),
+                (self.today.isoformat(), self.course.id, 1, '50.00', '50.00'),
+            ],
+        )
+        self.assertEqual(update_payment_rollups(window_days=0), 0)
+
+    def test_group_by_period_and_status(self):
+        self.pay(self.old_day, '100.00')
+        self.pay(self.today, '40.00', method='stripe', status='paid')
+        self.pay(self.today, '60.00', method='stripe', status='unpaid')
+        rebuild_payment_rollups()
+
+        with self.assertNumQueries(2):
+            rows = self.analytics(period='month', group_by='method,status', date_from=self.today.isoformat())
+        self.assertEqual(
+            [(row['payment_method'], row['payment_status'], row['amount'], row['revenue']) for row in rows],
+            [('stripe', 'paid', '40.00', '40.00'), ('stripe', 'unpaid', '60.00', '0.00')],
+        )
+        self.assertEqual(rows[0]['period'], self.today.replace(day=1).isoformat())
+        self.assertNotIn('paid_course', rows[0])
+
+    def test_validation_and_permissions(self):
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/api/payments/analytics/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/payments/analytics/', {'group_by': 'course,user'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('group_by', response.data)
+        response = self.client.get('/api/payments/analytics/', {'period': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PaymentExportTestCase(TestCase):
+    """Тесты потоковой выгрузки платежей"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create(email='admin@test.com', is_staff=True)
+        self.user = User.objects.create(email='buyer@test.com')
+        self.course = Course.objects.create(name='Курс, "первый"', owner=self.user)
+        self.lesson = Lesson.objects.create(name='Урок', course=self.course, owner=self.user)
+        Payment.objects.bulk_create([
+            Payment(user=self.user, paid_course=self.course, amount=Decimal('100.00'), payment_method='cash'),
+            Payment(user=self.user, paid_lesson=self.lesson, amount=Decimal('10.00'), payment_method='stripe',
+                    payment_status='paid', stripe_session_id='cs_1'),
+        ])
+        self.client.force_authenticate(user=self.admin)
+
+    def export(self, **params):
+        response = self.client.get('/api/payments/export/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        with self.assertNumQueries(1):
+            content = self.export(payment_method='cash')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['paid_course_name'], 'Курс, "первый"')
+        self.assertEqual((rows[0]['amount'], rows[0]['payment_status']), ('100.00', ''))
+
+    def test_csv_formula_escaped(self):
+        """Текст, который табличный редактор принял бы за формулу, выгружается в CSV с апострофом"""
+        Course.objects.filter(pk=self.course.pk).update(name='=HYPERLINK("http://evil")')
+        User.objects.filter(pk=self.user.pk).update(email='@buyer@test.com')
+
+        rows = list(csv.DictReader(io.StringIO(self.export(payment_method='cash'))))
+
+        self.assertEqual(rows[0]['paid_course_name'], '\'=HYPERLINK("http://evil")')
+        self.assertEqual(rows[0]['user_email'], "'@buyer@test.com")
+        self.assertEqual(rows[0]['amount'], '100.00')
+        ndjson = json.loads(self.export(output='ndjson', payment_method='cash'))
+        self.assertEqual(ndjson['paid_course_name'], '=HYPERLINK("http://evil")')
+
+    def test_ndjson(self):
+        content = self.export(output='ndjson', paid_lesson=self.lesson.id)
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['paid_lesson_name'], 'Урок')
+        self.assertEqual((rows[0]['amount'], rows[0]['stripe_session_id']), ('10.00', 'cs_1'))
+
+    def test_invalid_output_and_permissions(self):
+        response = self.client.get('/api/payments/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/api/payments/export/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_payments', output='ndjson', payment_method='stripe', chunk_size=1, stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['payment_method'] for row in rows], ['stripe'])
 
-# Create your tests here. 
@@ -1,11 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from users.views import PaymentViewSet, UserViewSet
+from users.views import (
+    PaymentAnalyticsView, PaymentViewSet, UserViewSet, create_payment_intent_async, stripe_webhook,
+)
 
 router = DefaultRouter()
 router.register(r'payments', PaymentViewSet, basename='payment')
 router.register(r'users', UserViewSet, basename='user')
 
 urlpatterns = [
+    path('payments/webhook/', stripe_webhook, name='payment-stripe-webhook'),
+    path('payments/analytics/', PaymentAnalyticsView.as_view(), name='payment-analytics'),
+    path('payments/create-payment-intent-async/', create_payment_intent_async, name='payment-create-payment-intent-async'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
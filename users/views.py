@@ -1,14 +1,79 @@
+import json
+
+import stripe
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.filters import OrderingFilter
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from django_filters.rest_framework import DjangoFilterBackend
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from materials.models import Course, Lesson
-from users.models import Payment, User
-from users.serializers import PaymentSerializer, UserSerializer, UserRegistrationSerializer, PaymentStripeSerializer
-from users.services import create_stripe_product, create_stripe_price, create_stripe_session, retrieve_stripe_session
+from users.analytics import payment_analytics
+from users.exports import EXPORT_CONTENT_TYPES, iter_payments_export
+from users.models import Payment, PaymentRollupWatermark, User
+from users.paginators import PaymentPagination
+from users.serializers import (
+    PaymentAnalyticsQuerySerializer, PaymentAnalyticsRowSerializer, PaymentSerializer, PaymentStripeSerializer,
+    UserRegistrationSerializer, UserSerializer,
+)
+from users.services import (
+    PAYMENT_IDEMPOTENCY_MISMATCH,
+    PAYMENT_IDEMPOTENCY_PENDING,
+    async_stripe_client_scope,
+    claim_payment_idempotency_key,
+    complete_payment_idempotency_key,
+    create_checkout_payment,
+    create_checkout_payment_async,
+    payment_request_fingerprint,
+    release_payment_idempotency_key,
+    update_payment_statuses,
+)
+
+IDEMPOTENCY_CONFLICT = {'error': 'Запрос с этим ключом идемпотентности еще выполняется'}
+IDEMPOTENCY_MISMATCH = {'error': 'Ключ идемпотентности уже использован для запроса с другими параметрами'}
+
+STRIPE_SESSION_EVENTS = [
+    'checkout.session.completed',
+    'checkout.session.async_payment_succeeded',
+    'checkout.session.async_payment_failed',
+    'checkout.session.expired',
+]
+
+
+def get_payment_item(course_id, lesson_id):
+    """
+    Возвращает (курс или урок, None) для оплаты либо (None, (тело ответа, статус)),
+    если оплатить его нельзя.
+    """
+    if course_id:
+        item = Course.objects.filter(id=course_id).first()
+        not_found = 'Курс не найден'
+    else:
+        item = Lesson.objects.filter(id=lesson_id).first()
+        not_found = 'Урок не найден'
+
+    if item is None:
+        return None, ({'error': not_found}, status.HTTP_404_NOT_FOUND)
+    if item.price <= 0:
+        return None, ({'error': 'Цена должна быть больше нуля'}, status.HTTP_400_BAD_REQUEST)
+    return item, None
+
+
+def get_payment_intent_data(payment):
+    return {
+        'payment': PaymentSerializer(payment).data,
+        'payment_url': payment.payment_url,
+    }
 
 
 class PaymentViewSet(viewsets.ModelViewSet):
@@ -18,102 +83,150 @@ class PaymentViewSet(viewsets.ModelViewSet):
     filterset_fields = ['paid_course', 'paid_lesson', 'payment_method']
     ordering_fields = ['payment_date']
     ordering = ['-payment_date']
+    pagination_class = PaymentPagination
+
+    def get_expand(self):
+        if self.request is None:
+            return []
+        expand = self.request.query_params.get('expand', '')
+        return [
+            field_name for field_name in expand.split(',')
+            if field_name in PaymentSerializer.EXPANDABLE_FIELDS
+        ]
+
+    def get_queryset(self):
+        queryset = Payment.objects.select_related('paid_lesson')
+        if 'paid_course' in self.get_expand():
+            return queryset.prefetch_related(
+                Prefetch('paid_course', queryset=Course.objects.with_lessons_info(self.request.user)),
+            )
+        return queryset.select_related('paid_course')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
 
     @action(detail=False, methods=['post'], url_path='create-payment-intent')
     def create_payment_intent(self, request):
         """
         Создание платежа через Stripe.
-        
-        Принимает course_id или lesson_id, создает продукт и цену в Stripe,
-        создает сессию оплаты и возвращает ссылку на оплату.
+
+        Принимает course_id или lesson_id, создает сессию оплаты по цене из каталога
+        Stripe и возвращает ссылку на оплату. Повтор запроса с тем же заголовком
+        Idempotency-Key возвращает уже созданный платеж, а тот же ключ с другими
+        course_id/lesson_id — ошибку 422; открытая неоплаченная сессия за тот же
+        курс/урок переиспользуется.
         """
         serializer = PaymentStripeSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         user = request.user
-        course_id = serializer.validated_data.get('course_id')
-        lesson_id = serializer.validated_data.get('lesson_id')
-
-        if course_id:
-            try:
-                course = Course.objects.get(id=course_id)
-                product_name = course.name
-                product_description = course.description or ''
-                amount = course.price if hasattr(course, 'price') else 0
-            except Course.DoesNotExist:
-                return Response({'error': 'Курс не найден'}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            try:
-                lesson = Lesson.objects.get(id=lesson_id)
-                product_name = lesson.name
-                product_description = lesson.description or ''
-                amount = lesson.price if hasattr(lesson, 'price') else 0
-            except Lesson.DoesNotExist:
-                return Response({'error': 'Урок не найден'}, status=status.HTTP_404_NOT_FOUND)
-
-        if amount <= 0:
-            return Response({'error': 'Цена должна быть больше нуля'}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            product = create_stripe_product(product_name, product_description)
-            price = create_stripe_price(product.id, float(amount))
-
-            success_url = f"{settings.FRONTEND_URL or 'http://localhost:8000'}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
-            cancel_url = f"{settings.FRONTEND_URL or 'http://localhost:8000'}/payment/cancel"
-
-            session = create_stripe_session(price.id, success_url, cancel_url)
-
-            payment = Payment.objects.create(
-                user=user,
-                paid_course_id=course_id if course_id else None,
-                paid_lesson_id=lesson_id if lesson_id else None,
-                amount=amount,
-                payment_method='stripe',
-                stripe_product_id=product.id,
-                stripe_price_id=price.id,
-                stripe_session_id=session.id,
-                payment_url=session.url,
-                payment_status=session.payment_status,
-            )
+        idempotency_key = request.headers.get('Idempotency-Key')
+        fingerprint = payment_request_fingerprint(**serializer.validated_data)
+        if idempotency_key:
+            previous = claim_payment_idempotency_key(user, idempotency_key, fingerprint)
+            if previous == PAYMENT_IDEMPOTENCY_MISMATCH:
+                return Response(IDEMPOTENCY_MISMATCH, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if previous == PAYMENT_IDEMPOTENCY_PENDING:
+                return Response(IDEMPOTENCY_CONFLICT, status=status.HTTP_409_CONFLICT)
+            if previous is not None:
+                payment = Payment.objects.select_related('paid_course', 'paid_lesson').filter(id=previous, user=user).first()
+                if payment is not None:
+                    return Response(get_payment_intent_data(payment), status=status.HTTP_200_OK)
 
-            response_serializer = PaymentSerializer(payment)
-            return Response({
-                'payment': response_serializer.data,
-                'payment_url': session.url
-            }, status=status.HTTP_201_CREATED)
+        item, error = get_payment_item(
+            serializer.validated_data.get('course_id'),
+            serializer.validated_data.get('lesson_id'),
+        )
+        if error:
+            if idempotency_key:
+                release_payment_idempotency_key(user, idempotency_key)
+            return Response(error[0], status=error[1])
 
+        try:
+            payment, created = create_checkout_payment(user, item, idempotency_key)
         except Exception as e:
+            if idempotency_key:
+                release_payment_idempotency_key(user, idempotency_key)
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        if idempotency_key:
+            complete_payment_idempotency_key(user, idempotency_key, fingerprint, payment.id)
+        return Response(
+            get_payment_intent_data(payment),
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Потоковая выгрузка платежей для бухгалтерии в CSV или NDJSON (?output=csv|ndjson).
+
+        Учитывает те же фильтры и сортировку, что и список платежей, но строки читаются
+        серверным курсором и отдаются по мере чтения, без сериализаторов и пагинации.
+        """
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {'output': [f'Допустимые форматы: {", ".join(EXPORT_CONTENT_TYPES)}']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        queryset = self.filter_queryset(Payment.objects.all())
+        response = StreamingHttpResponse(iter_payments_export(queryset, output), content_type=EXPORT_CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="payments.{output}"'
+        return response
+
     @action(detail=True, methods=['get'], url_path='check-status')
     def check_status(self, request, pk=None):
         """
         Проверка статуса платежа в Stripe.
-        
-        Получает актуальный статус платежа из Stripe и обновляет его в базе данных.
+
+        Возвращает статус из базы данных, который поддерживается в актуальном
+        состоянии вебхуком Stripe и периодической сверкой (users.tasks.reconcile_stripe_payments).
         """
         payment = self.get_object()
 
         if not payment.stripe_session_id:
             return Response({'error': 'Платеж не связан со Stripe'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            session = retrieve_stripe_session(payment.stripe_session_id)
-            payment.payment_status = session.payment_status
-            payment.save()
+        response_serializer = PaymentSerializer(payment)
+        return Response({
+            'payment': response_serializer.data,
+            'stripe_status': payment.payment_status
+        }, status=status.HTTP_200_OK)
 
-            response_serializer = PaymentSerializer(payment)
-            return Response({
-                'payment': response_serializer.data,
-                'stripe_status': session.payment_status
-            }, status=status.HTTP_200_OK)
 
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+class PaymentAnalyticsView(APIView):
+    """
+    Аналитика платежей для администраторов.
+
+    Выручка и число платежей по дням, неделям или месяцам (period) с группировкой
+    по курсу, уроку, способу и статусу оплаты (group_by=course,method,...). Читается из
+    суточных итогов PaymentDailyRollup, которые обновляет задача
+    users.tasks.update_payment_rollups; updated_at — время последнего обновления итогов.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        query = PaymentAnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        rows = payment_analytics(query.validated_data['period'], query.validated_data['group_by'], **query.get_filters())
+        watermark = PaymentRollupWatermark.objects.filter(pk=1).first()
+        return Response({
+            'period': query.validated_data['period'],
+            'group_by': query.validated_data['group_by'],
+            'updated_at': watermark.updated_at if watermark else None,
+            'results': PaymentAnalyticsRowSerializer(rows, many=True).data,
+        })
+
+
+def payments_prefetch():
+    return Prefetch('payments', queryset=Payment.objects.select_related('paid_course', 'paid_lesson'))
 
 
 class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related(payments_prefetch())
     serializer_class = UserSerializer
 
     def get_permissions(self):
@@ -128,5 +241,91 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='me')
     def me(self, request):
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
\ No newline at end of file
+        user = self.get_queryset().get(pk=request.user.pk)
+        serializer = self.get_serializer(user)
+        return Response(serializer.data)
+
+@csrf_exempt
+@require_POST
+async def create_payment_intent_async(request):
+    """
+    Асинхронный вариант создания платежа через Stripe для запуска под ASGI.
+
+    Обращения к Stripe выполняются через общий пул соединений httpx и не
+    занимают поток воркера на время ожидания ответа. Под WSGI пул создается
+    на запрос и закрывается после обращений к Stripe.
+    """
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if auth is None:
+        return JsonResponse({'detail': 'Учетные данные не были предоставлены.'}, status=status.HTTP_401_UNAUTHORIZED)
+    user = auth[0]
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный JSON'}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = PaymentStripeSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    fingerprint = payment_request_fingerprint(**serializer.validated_data)
+    if idempotency_key:
+        previous = await sync_to_async(claim_payment_idempotency_key)(user, idempotency_key, fingerprint)
+        if previous == PAYMENT_IDEMPOTENCY_MISMATCH:
+            return JsonResponse(IDEMPOTENCY_MISMATCH, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if previous == PAYMENT_IDEMPOTENCY_PENDING:
+            return JsonResponse(IDEMPOTENCY_CONFLICT, status=status.HTTP_409_CONFLICT)
+        if previous is not None:
+            payment = await Payment.objects.select_related('paid_course', 'paid_lesson').filter(id=previous, user=user).afirst()
+            if payment is not None:
+                data = await sync_to_async(get_payment_intent_data)(payment)
+                return JsonResponse(data, status=status.HTTP_200_OK)
+
+    item, error = await sync_to_async(get_payment_item)(
+        serializer.validated_data.get('course_id'),
+        serializer.validated_data.get('lesson_id'),
+    )
+    if error:
+        if idempotency_key:
+            await sync_to_async(release_payment_idempotency_key)(user, idempotency_key)
+        return JsonResponse(error[0], status=error[1])
+
+    try:
+        async with async_stripe_client_scope(shared=isinstance(request, ASGIRequest)):
+            payment, created = await create_checkout_payment_async(user, item, idempotency_key)
+    except Exception as e:
+        if idempotency_key:
+            await sync_to_async(release_payment_idempotency_key)(user, idempotency_key)
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if idempotency_key:
+        await sync_to_async(complete_payment_idempotency_key)(user, idempotency_key, fingerprint, payment.id)
+    data = await sync_to_async(get_payment_intent_data)(payment)
+    return JsonResponse(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """
+    Прием событий Stripe об изменении сессий оплаты.
+
+    Подпись проверяется секретом STRIPE_WEBHOOK_SECRET; статус платежа
+    обновляется только если он изменился.
+    """
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body,
+            request.headers.get('Stripe-Signature'),
+            settings.STRIPE_WEBHOOK_SECRET,
+        )
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+
+    if event['type'] in STRIPE_SESSION_EVENTS:
+        session = event['data']['object']
+        update_payment_statuses({session['id']: session['payment_status']})
+    return HttpResponse(status=status.HTTP_200_OK)